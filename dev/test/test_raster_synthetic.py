@@ -0,0 +1,354 @@
+
+from dnppy import raster
+from osgeo import osr
+import tempfile
+import numpy
+import gdal
+import os
+
+
+def test_raster_synthetic(test_dir):
+    """
+    tests raster functions on small synthetic rasters with known answers,
+    so no downloaded data is needed. tests the following functions:
+        from_numpy
+            stats policies, build_stats
+            output profiles
+        to_numpy
+            block_cache_info, clear_block_cache
+        read_metadata
+        many_stats
+        null_set_range
+        clip_and_snap
+        spatially_match (virtual)
+        new_mosaic
+        expr
+            con
+            set_null
+    """
+
+    test_dir = os.path.join(test_dir, "pre_processed", "synthetic")
+
+    test_cache_invalidation(os.path.join(test_dir, "cache"))
+    test_stats_policies(os.path.join(test_dir, "stats"))
+    test_cog_profile(os.path.join(test_dir, "cog"))
+    test_many_stats(os.path.join(test_dir, "many_stats"))
+    test_null_set_range(os.path.join(test_dir, "null_set_range"))
+    test_clip_and_snap(os.path.join(test_dir, "clip_and_snap"))
+    test_new_mosaic(os.path.join(test_dir, "new_mosaic"))
+    test_expr(os.path.join(test_dir, "expr"))
+    return
+
+
+def _synthetic_meta(xs, ys, numpy_datatype, NoData_Value = None,
+                    Xmin = 500000.0, Ymax = 4100000.0, cell = 30.0):
+    """ metadata of a north up raster in UTM zone 18N, with its upper left corner at Xmin, Ymax """
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32618)
+
+    meta = raster.metadata(None, xs, ys)
+    meta.cellWidth      = cell
+    meta.cellHeight     = cell
+    meta.Xmin           = Xmin
+    meta.Ymax           = Ymax
+    meta.Xmax           = Xmin + xs * cell
+    meta.Ymin           = Ymax - ys * cell
+    meta.numpy_datatype = numpy_datatype
+    meta.NoData_Value   = NoData_Value
+    meta.projection     = srs.ExportToWkt()
+    return meta
+
+
+def _save(outdir, name, array, NoData_Value = -9999, Xmin = 500000.0, Ymax = 4100000.0,
+          stats = "none", profile = None):
+    """ saves a 2d array as a synthetic raster, returning its filepath """
+
+    path = os.path.join(outdir, name)
+    ys, xs = array.shape
+    meta = _synthetic_meta(xs, ys, str(array.dtype), NoData_Value, Xmin, Ymax)
+    return raster.from_numpy(array, meta, path, NoData_Value, stats = stats, profile = profile)
+
+
+def _assert_raises(error, function, *args, **kwargs):
+    """ asserts that calling function raises an error of the given type """
+
+    try:
+        function(*args, **kwargs)
+    except error:
+        return
+    raise AssertionError("{0} did not raise {1}".format(function.__name__, error.__name__))
+
+
+def test_cache_invalidation(test_dir):
+    """ rewritten rasters are read again, even when their modification time is unchanged """
+
+    array = numpy.arange(100, dtype = "float32").reshape(10, 10)
+    path  = _save(test_dir, "cached.tif", array)
+
+    raster.clear_block_cache()
+    raster.to_numpy(path)
+    rast, meta = raster.to_numpy(path)
+    assert raster.block_cache_info()["hits"] > 0
+    assert (rast == array).all()
+
+    # overwrite the file right away, so its modification time likely stays the same
+    _save(test_dir, "cached.tif", array + 1, NoData_Value = 0)
+    rast, meta = raster.to_numpy(path)
+    assert (rast == array + 1).all()
+    assert meta.NoData_Value == 0
+    assert raster.read_metadata(path).NoData_Value == 0
+
+    # single pass reads leave the cache alone
+    raster.clear_block_cache()
+    rast, meta = raster.to_numpy(path, cache = False)
+    info = raster.block_cache_info()
+    assert (rast == array + 1).all()
+    assert info["blocks"] == 0 and info["misses"] == 0
+    return
+
+
+def _band_info(path):
+    """ the STATISTICS_MEAN (or None), overview count and block size of the first band of a raster """
+
+    dataset = gdal.Open(path)
+    band    = dataset.GetRasterBand(1)
+    mean    = band.GetMetadataItem("STATISTICS_MEAN")
+    info    = (None if mean is None else float(mean), band.GetOverviewCount(), band.GetBlockSize())
+    band    = None
+    dataset = None
+    return info
+
+
+def test_stats_policies(test_dir):
+    """ statistics and overviews are built now, later in one batch, or not at all """
+
+    array = numpy.arange(600 * 600, dtype = "float32").reshape(600, 600)
+
+    none_path = _save(test_dir, "none.tif", array, stats = "none")
+    mean, overviews, _ = _band_info(none_path)
+    assert mean is None and overviews == 0
+
+    now_path = _save(test_dir, "now.tif", array, stats = "now")
+    mean, overviews, _ = _band_info(now_path)
+    assert numpy.isclose(mean, array.mean()) and overviews > 0
+
+    deferred_path = _save(test_dir, "deferred.tif", array, stats = "deferred")
+    mean, overviews, _ = _band_info(deferred_path)
+    assert mean is None and overviews == 0
+
+    assert deferred_path in raster.build_stats()
+    mean, overviews, _ = _band_info(deferred_path)
+    assert numpy.isclose(mean, array.mean()) and overviews > 0
+
+    # nothing is left waiting once the batch is built
+    assert raster.build_stats() == []
+
+    _assert_raises(ValueError, _save, test_dir, "bad.tif", array, stats = "later")
+    return
+
+
+def test_cog_profile(test_dir):
+    """ cloud optimized outputs are compressed, tiled, have overviews, and leave no staging files """
+
+    array = numpy.random.RandomState(0).randint(0, 200, (1024, 1024)).astype("uint8")
+
+    first  = _save(test_dir, "cog.tif", array, NoData_Value = 255, profile = "cog")
+    second = _save(test_dir, "cog_float.tif", array.astype("float32"), profile = "cog")
+
+    for path, expected in [(first, array), (second, array.astype("float32"))]:
+        dataset = gdal.Open(path)
+        band    = dataset.GetRasterBand(1)
+
+        assert dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE") == "DEFLATE"
+        assert band.GetBlockSize() == [512, 512]
+        assert band.GetOverviewCount() == 2
+        assert (band.ReadAsArray() == expected).all()
+        band    = None
+        dataset = None
+
+    # staging files are removed once closed, at the latest by the next cloud optimized output
+    assert not os.path.exists(os.path.join(test_dir, "cog_staging.tif"))
+
+    # profiles may be set as the default for every writer
+    raster.set_output_profile("tiled")
+    try:
+        path = _save(test_dir, "tiled.tif", array)
+        assert _band_info(path)[2] == [256, 256]
+    finally:
+        raster.set_output_profile("striped")
+
+    _assert_raises(ValueError, raster.set_output_profile, "fancy")
+    return
+
+
+def test_many_stats(test_dir):
+    """ streaming and tile parallel statistics match numpy over the whole stack """
+
+    stack = numpy.random.RandomState(0).normal(1000.0, 5.0, (6, 20, 30)).astype("float32")
+    stack[2, :5, :5]   = -9999
+    stack[:, -1, -1]   = -9999
+
+    paths = [_save(test_dir, "stack_{0}.tif".format(i), layer) for i, layer in enumerate(stack)]
+    saves = ["AVG", "STD", "NUM", "SUM", "MIN", "MAX"]
+
+    expected = numpy.ma.masked_equal(stack.astype("float64"), -9999)
+    expected = {"AVG": expected.mean(axis = 0),
+                "STD": expected.std(axis = 0),
+                "NUM": expected.count(axis = 0),
+                "SUM": expected.sum(axis = 0),
+                "MIN": expected.min(axis = 0),
+                "MAX": expected.max(axis = 0)}
+
+    outdir = os.path.join(test_dir, "outputs")
+    raster.many_stats(paths, outdir, "serial", saves)
+    raster.many_stats(paths, outdir, "parallel", saves, workers = 2)
+
+    for outname in ["serial", "parallel"]:
+        for save in saves:
+            out, meta = raster.to_numpy(os.path.join(outdir, "{0}_{1}.tif".format(outname, save)))
+
+            if save in ["NUM", "SUM"]:
+                assert out[-1, -1] == 0
+            else:
+                assert out.mask[-1, -1]
+
+            assert numpy.allclose(numpy.ma.getdata(out)[:-1, :-1],
+                                  numpy.ma.getdata(expected[save])[:-1, :-1],
+                                  rtol = 1e-6, atol = 1e-3), \
+                "{0} {1} does not match numpy".format(outname, save)
+    return
+
+
+def test_null_set_range(test_dir):
+    """ rasters are edited in place, and reads after an edit see it """
+
+    array = numpy.arange(100, dtype = "int16").reshape(10, 10)
+    path  = _save(test_dir, "nulls.tif", array, NoData_Value = -1)
+
+    # fill the caches before the edit
+    raster.to_numpy(path)
+
+    modified = raster.null_set_range(path, high_thresh = 90, NoData_Value = -1, stats = "none")
+    assert len(modified) == 1
+
+    rast, meta = raster.to_numpy(path)
+    assert (rast.mask == (array >= 90)).all()
+    assert (rast.data[~rast.mask] == array[~rast.mask]).all()
+
+    # nothing left to change, so nothing is modified
+    assert raster.null_set_range(path, high_thresh = 90, stats = "none") == []
+
+    # changing the NoData value recodes the old NoData pixels
+    raster.null_set_range(path, low_thresh = 4, NoData_Value = -2, stats = "none")
+    rast, meta = raster.to_numpy(path)
+    assert meta.NoData_Value == -2
+    assert raster.read_metadata(path).NoData_Value == -2
+    assert (rast.mask == ((array >= 90) | (array <= 4))).all()
+    assert (rast.data[rast.mask] == -2).all()
+    return
+
+
+def test_clip_and_snap(test_dir):
+    """ parts of the snap raster outside of the input are padded with NoData """
+
+    snap_array = numpy.zeros((10, 10), dtype = "float32")
+    array      = numpy.arange(100, dtype = "float32").reshape(10, 10)
+
+    # the input is shifted 3 cells east and 2 cells south of the snap raster
+    snap_path = _save(test_dir, "snap.tif", snap_array)
+    in_path   = _save(test_dir, "shifted.tif", array,
+                      Xmin = 500000.0 + 3 * 30.0, Ymax = 4100000.0 - 2 * 30.0)
+
+    expected = numpy.ma.masked_all((10, 10), dtype = "float32")
+    expected[2:, 3:] = array[:8, :7]
+
+    out_path = os.path.join(test_dir, "clipped.tif")
+    raster.clip_and_snap(snap_path, in_path, out_path, NoData_Value = -9999)
+
+    rast, meta = raster.to_numpy(out_path)
+    snap_meta  = raster.read_metadata(snap_path)
+    assert numpy.allclose(meta.geotransform, snap_meta.geotransform)
+    assert (rast.mask == expected.mask).all()
+    assert (rast[~rast.mask] == expected[~expected.mask]).all()
+
+    # virtual matches read exactly the same pixels
+    vrt_dir = os.path.join(test_dir, "virtual")
+    vrt_path, = raster.spatially_match(snap_path, [in_path], vrt_dir, virtual = True)
+    assert vrt_path.endswith(".vrt")
+
+    vrt, vrt_meta = raster.to_numpy(vrt_path)
+    assert numpy.allclose(vrt_meta.geotransform, snap_meta.geotransform)
+    assert (vrt.mask == expected.mask).all()
+    assert (vrt[~vrt.mask] == expected[~expected.mask]).all()
+    return
+
+
+def test_new_mosaic(test_dir):
+    """ each mosaic method of the native engine, for two rasters overlapping by two columns """
+
+    a = numpy.ones((4, 4), dtype = "float32")
+    b = numpy.full((4, 4), 3.0, dtype = "float32")
+    a[1, 2] = -9999
+
+    a_path = _save(test_dir, "a.tif", a)
+    b_path = _save(test_dir, "b.tif", b, Xmin = 500000.0 + 2 * 30.0)
+
+    overlap = {"FIRST": 1.0, "LAST": 3.0, "MEAN": 2.0, "MINIMUM": 1.0, "MAXIMUM": 3.0}
+
+    for method in ["FIRST", "LAST", "MEAN", "MINIMUM", "MAXIMUM", "BLEND"]:
+        out_path = os.path.join(test_dir, "mosaic_{0}.tif".format(method))
+        raster.new_mosaic([a_path, b_path], out_path, mosaic_method = method)
+
+        rast, meta = raster.to_numpy(out_path)
+        assert rast.shape == (4, 6)
+        assert not rast.mask.any()
+        assert (rast[:, :2] == 1).all() and (rast[:, 4:] == 3).all()
+
+        # the NoData pixel of a is filled by b, whatever the method
+        assert rast[1, 2] == 3
+
+        cells = numpy.delete(rast[:, 2:4].ravel(), 2)
+        if method in overlap:
+            assert (cells == overlap[method]).all(), method
+        else:
+            assert ((cells > 1) & (cells < 3)).all(), method
+    return
+
+
+def test_expr(test_dir):
+    """ raster algebra with con and set_null carries NoData through """
+
+    array = numpy.arange(100, dtype = "float32").reshape(10, 10)
+    array[0, 0] = -9999
+    path  = _save(test_dir, "algebra.tif", array)
+    nodata = array == -9999
+
+    a = raster.expr(path)
+
+    # con with a false value
+    out, meta = raster.con(a > 50, a, 0).to_numpy()
+    expected = numpy.where(array > 50, array, 0)
+    assert (out.mask == nodata).all()
+    assert (out.data[~nodata] == expected[~nodata]).all()
+
+    # con without a false value is NoData wherever the condition is False
+    out, meta = raster.con(a > 50, a * 2).to_numpy()
+    assert (out.mask == (nodata | (array <= 50))).all()
+    assert (out.data[~out.mask] == array[~out.mask] * 2).all()
+
+    # set_null, saved block by block and read back
+    out_path = os.path.join(test_dir, "set_null.tif")
+    raster.set_null(a < 10, a + 1).save(out_path, block_shape = (2, 10))
+    out, meta = raster.to_numpy(out_path)
+    assert (out.mask == (nodata | (array < 10))).all()
+    assert (out.data[~out.mask] == array[~out.mask] + 1).all()
+
+    # reductions skip NoData
+    assert raster.set_null(a < 10, a).count() == 90
+    assert raster.set_null(a < 10, a).min() == 10
+    return
+
+
+if __name__ == "__main__":
+    test_raster_synthetic(tempfile.mkdtemp())
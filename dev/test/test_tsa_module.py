@@ -0,0 +1,139 @@
+
+from dnppy import tsa
+from datetime import datetime, timedelta
+
+
+def test_tsa_module():
+    """
+    tests the following functions from the tsa module:
+        time_series
+            from_list
+            build_col_data
+            make_subsets
+            group_bins
+    """
+
+    test_build_col_data()
+    test_make_subsets()
+    test_subset_views()
+    test_group_bins()
+    test_group_bins_leap_year()
+    return
+
+
+def _series(start, step, count):
+    """ builds a time_series with one row per time step, valued with the step's index """
+
+    rows = []
+    for i in range(count):
+        dto = start + step * i
+        rows.append([dto.strftime("%Y-%m-%d %H:%M:%S"), str(i)])
+
+    ts = tsa.time_series("synthetic")
+    ts.from_list(rows, ["date", "value"], "date", "%Y-%m-%d %H:%M:%S")
+    return ts
+
+
+def _daily_series(start, num_days):
+    """ builds a time_series with one row per day """
+    return _series(start, timedelta(days = 1), num_days)
+
+
+def _values(ts):
+    """ the value column of a time_series, as a list of floats """
+    return [float(value) for value in ts.col_data["value"]]
+
+
+def _bin_days(ts):
+    """ dict of the dates in every bin of a binned time_series, keyed on bin name """
+
+    return dict((subset.name, sorted(dto.strftime("%Y-%m-%d") for dto in subset.time_dom))
+                for subset in ts.subsets)
+
+
+def test_build_col_data():
+    """ rows edited in place take effect in the columns once build_col_data is called """
+
+    ts = _daily_series(datetime(2015, 1, 1), 5)
+
+    ts.row_data[0][1] = "100"
+    ts.row_data.append(["2015-01-06 00:00:00", "5"])
+    ts.build_col_data()
+
+    assert _values(ts) == [100.0, 1.0, 2.0, 3.0, 4.0, 5.0], _values(ts)
+    assert len(ts.time_dom) == 6
+    assert ts.time_dom[-1] == datetime(2015, 1, 6)
+    return
+
+
+def test_make_subsets():
+    """ daily subsets of hourly data hold whole days, and overlaps reach the next days """
+
+    ts = _series(datetime(2015, 1, 1, 0, 30), timedelta(hours = 1), 72)
+    ts.make_subsets("%d")
+
+    assert [subset.name for subset in ts.subsets] == ["2015-01-01", "2015-01-02", "2015-01-03"]
+    for i, subset in enumerate(ts.subsets):
+        assert _values(subset) == [float(v) for v in range(24 * i, 24 * (i + 1))]
+
+    ts.make_subsets("%d", overlap_width = 1, discard_old = True)
+    assert _values(ts["2015-01-02"]) == [float(v) for v in range(72)]
+    assert _values(ts["2015-01-01"]) == [float(v) for v in range(48)]
+    return
+
+
+def test_subset_views():
+    """ subsets keep their own rows when the rows of their parent are replaced """
+
+    ts = _series(datetime(2015, 1, 1, 0, 30), timedelta(hours = 1), 72)
+    ts.make_subsets("%d")
+    last = ts.subsets[-1]
+
+    ts.row_data = ts.row_data[:10]
+
+    assert len(ts.row_data) == 10
+    assert _values(last) == [float(v) for v in range(48, 72)]
+    assert last.time_dom[0] == datetime(2015, 1, 3, 0, 30)
+    return
+
+
+def test_group_bins():
+    """ hourly bins of several days hold the same hour of every day """
+
+    ts = _series(datetime(2015, 1, 1, 0, 30), timedelta(hours = 1), 72)
+    ts.group_bins("%H", overlap_width = 0, cyclical = True)
+
+    assert len(ts.subsets) == 24
+    assert _values(ts["05"]) == [5.0, 29.0, 53.0]
+
+    # hours 23 and 00 are adjacent on a cyclical day
+    ts = _series(datetime(2015, 1, 1, 0, 30), timedelta(hours = 1), 72)
+    ts.group_bins("%H", overlap_width = 1, cyclical = True)
+
+    assert _values(ts["00"]) == [0.0, 1.0, 23.0, 24.0, 25.0, 47.0, 48.0, 49.0, 71.0]
+    return
+
+
+def test_group_bins_leap_year():
+    """ day of year bins wrap around the 366 day cycle of leap years """
+
+    # 2012 is a leap year, so 2012-12-31 is day 366
+    ts = _daily_series(datetime(2012, 12, 29), 6)
+    ts.group_bins("%j", overlap_width = 0, cyclical = True)
+    bins = _bin_days(ts)
+
+    assert bins["366"] == ["2012-12-31"], bins["366"]
+    assert bins["001"] == ["2013-01-01"], bins["001"]
+
+    # with an overlap of one, day 366 and day 1 are neighbors
+    ts = _daily_series(datetime(2012, 12, 29), 6)
+    ts.group_bins("%j", overlap_width = 1, cyclical = True)
+    bins = _bin_days(ts)
+
+    assert bins["366"] == ["2012-12-30", "2012-12-31", "2013-01-01"], bins["366"]
+    assert bins["001"] == ["2012-12-31", "2013-01-01", "2013-01-02"], bins["001"]
+    return
+
+
+if __name__ == "__main__":
+    test_tsa_module()
@@ -1,13 +1,15 @@
 __author__ = ['jwely']
 __all__ = ["_gdal_dataset_to_tif"]
 
+from dnppy.core._geotiff_output import _resolve_profile, _stage_geotiff, _finish_geotiff
+from dnppy.core._geotiff_output import _invalidate
 import gdal
 import os
 from _convert_dtype import *
 
 def _gdal_dataset_to_tif(gdal_dataset, outpath, cust_projection = None,
                          cust_geotransform = None, force_custom = False,
-                         nodata_value = None):
+                         nodata_value = None, profile = None):
     """
     This function takes a gdal dataset object as returned from the
     "_extract_HDF_layer_data" OR "_extractNetCDF_layer_data functions
@@ -27,6 +29,9 @@ def _gdal_dataset_to_tif(gdal_dataset, outpath, cust_projection = None,
                                 if valid variables can be pulled from the
                                 gdal.dataset metadata.
     :param nodata_value:        The value to set to Nodata
+    :param profile:             layout of the output tif, a raster.output_profile or one
+                                of "striped", "tiled" or "cog". Defaults to the profile
+                                set with raster.set_output_profile
 
     :return outpath:            The local system filepath to output dataset
     """
@@ -79,19 +84,31 @@ def _gdal_dataset_to_tif(gdal_dataset, outpath, cust_projection = None,
         raise Exception("cannot write 1 dimensional data to tif")
 
     # create the tiff
+    profile = _resolve_profile(profile)
+    options = profile.creation_options(numpy_array.dtype, xsize, ysize, numbands)
+
+    createpath, options = _stage_geotiff(outpath, options, profile)
+
     gtiff = gdal.GetDriverByName("GTiff")
-    outdata = gtiff.Create(outpath, xsize, ysize, numbands, _convert_dtype(numpy_array.dtype))
+    outdata = gtiff.Create(createpath, xsize, ysize, numbands,
+                           _convert_dtype(numpy_array.dtype), options)
     outdata.SetProjection(projection)
     outdata.SetGeoTransform(geotransform)
 
     # write each band
     for i in range(numbands):
         outraster = outdata.GetRasterBand(i+1)
-        outraster.WriteArray(numpy_array, 0, 0)
+        if numbands == 1:
+            outraster.WriteArray(numpy_array, 0, 0)
+        else:
+            outraster.WriteArray(numpy_array[i], 0, 0)
         if nodata_value is not None:
             outraster.SetNoDataValue(nodata_value)
         outraster.FlushCache()
 
+    _finish_geotiff(outdata, profile)
+    outdata = None
+    _invalidate(outpath)
     return outpath
 
 
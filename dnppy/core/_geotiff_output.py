@@ -0,0 +1,288 @@
+"""
+GeoTiff output profiles and cache invalidation shared by the raster and convert
+modules. It depends on gdal alone, so convert can write GeoTiffs without importing
+the raster module (and arcpy). Use the public names through ``dnppy.raster``.
+"""
+
+__author__ = "jwely"
+
+import threading
+import atexit
+import gdal
+import os
+
+
+class output_profile(object):
+    """
+    Describes how GeoTiffs are laid out on disk by the writers of the raster and
+    convert modules (``from_numpy``, ``raster.expr``, the batch functions, and the
+    ``convert`` extractors). A profile may be given to a single call with the
+    ``profile`` argument, or made the default for every writer with
+    ``set_output_profile``. Three profiles are built in, and may be used by name
+
+    =========== ================================================================
+    Name        Description
+    =========== ================================================================
+    "striped"   plain, uncompressed striped GeoTiffs (the default)
+    "tiled"     256x256 tiles, DEFLATE compressed with a predictor
+    "cog"       cloud optimized GeoTiff, 512x512 DEFLATE tiles with internal
+                overviews stored ahead of the full resolution pixels
+    =========== ================================================================
+
+    Cloud optimized outputs are written to a temporary tiled GeoTiff next to the
+    output, then copied to the output with its overviews, which is how gdal lays
+    out a cloud optimized file.
+
+    :param tiled:       set True to write tiles instead of strips
+    :param blocksize:   width and height of tiles, usually 256 or 512
+    :param compress:    "DEFLATE", "LZW", or None for no compression. "ZSTD" may
+                        also be used with gdal 2.3 or newer.
+    :param level:       optional compression level
+    :param predictor:   set True to use a horizontal (integers) or floating point
+                        predictor, which usually compresses rasters much better
+    :param overviews:   set True to build internal overviews before the file is closed
+    :param resampling:  resampling method of overviews, such as "NEAREST" or "AVERAGE"
+    :param cloud_optimized: set True to write cloud optimized GeoTiffs, which implies
+                        tiles and overviews
+
+    Example usage
+
+    .. code-block:: python
+
+        from dnppy import raster
+
+        raster.set_output_profile("cog")
+        raster.set_output_profile(raster.output_profile(compress = "LZW", overviews = True))
+    """
+
+    def __init__(self, tiled = True, blocksize = 512, compress = "DEFLATE", level = None,
+                 predictor = True, overviews = False, resampling = "NEAREST",
+                 cloud_optimized = False):
+
+        if compress and compress.upper() == "ZSTD" and int(gdal.VersionInfo()) < 2030000:
+            raise ValueError("ZSTD compression requires gdal 2.3 or newer, found {0}".format(
+                gdal.VersionInfo("RELEASE_NAME")))
+
+        self.tiled      = tiled or cloud_optimized
+        self.blocksize  = blocksize
+        self.compress   = compress
+        self.level      = level
+        self.predictor  = predictor
+        self.overviews  = overviews or cloud_optimized
+        self.resampling = resampling
+        self.cloud_optimized = cloud_optimized
+
+
+    def creation_options(self, numpy_datatype, xs, ys, zs):
+        """
+        gdal GeoTiff creation options for a raster written with this profile
+
+        :param numpy_datatype:  numpy datatype string of the raster
+        :param xs:              number of columns
+        :param ys:              number of rows
+        :param zs:              number of bands
+
+        :return options:        list of creation option strings
+        """
+
+        options = []
+
+        if self.tiled:
+            options += ["TILED=YES",
+                        "BLOCKXSIZE={0}".format(self.blocksize),
+                        "BLOCKYSIZE={0}".format(self.blocksize)]
+
+        if self.compress:
+            options.append("COMPRESS={0}".format(self.compress.upper()))
+
+            if self.level is not None:
+                level_option = {"DEFLATE": "ZLEVEL", "ZSTD": "ZSTD_LEVEL"}
+                if self.compress.upper() in level_option:
+                    options.append("{0}={1}".format(level_option[self.compress.upper()], self.level))
+
+            if self.predictor and "bool" not in str(numpy_datatype):
+                if "float" in str(numpy_datatype):
+                    options.append("PREDICTOR=3")
+                else:
+                    options.append("PREDICTOR=2")
+
+            # compressed sizes can't be known up front, so let gdal play it safe
+            options.append("BIGTIFF=IF_SAFER")
+        else:
+            options.append("BIGTIFF=IF_NEEDED")
+
+        return options
+
+
+# built in profiles, by name
+_PROFILES = {"striped": output_profile(tiled = False, compress = None, predictor = False),
+             "tiled":   output_profile(blocksize = 256),
+             "cog":     output_profile(blocksize = 512, cloud_optimized = True)}
+
+# profile used by every writer unless another is given
+_default = {"profile": _PROFILES["striped"]}
+
+# cloud optimized outputs being staged, as {temporary path: (outpath, creation options)}
+_staged = {}
+
+# staging files of finished outputs, waiting to be removed
+_leftovers = []
+
+# functions that drop the cached data of a filepath, one per cache
+_caches      = []
+_caches_lock = threading.Lock()
+
+
+def set_output_profile(profile):
+    """
+    Sets the output profile used by every raster writer unless one is given per call.
+
+    :param profile:     an ``output_profile`` object, or one of the names "striped",
+                        "tiled" or "cog"
+    """
+
+    _default["profile"] = _resolve_profile(profile)
+    return
+
+
+def get_output_profile():
+    """ returns the ``output_profile`` currently used by default """
+    return _default["profile"]
+
+
+def _resolve_profile(profile = None):
+    """ turns None, a profile name, or an output_profile into an output_profile """
+
+    if profile is None:
+        return _default["profile"]
+
+    if isinstance(profile, output_profile):
+        return profile
+
+    if profile in _PROFILES:
+        return _PROFILES[profile]
+
+    raise ValueError("unknown output profile '{0}', use one of {1}".format(
+        profile, sorted(_PROFILES.keys())))
+
+
+def _build_overviews(dataset, resampling = "NEAREST"):
+    """
+    builds power of two overviews, down to roughly 256 pixels on the long side.
+    On a GeoTiff that is still open for writing, they are stored inside the file.
+    """
+
+    levels = []
+    level  = 2
+    while max(dataset.RasterXSize, dataset.RasterYSize) // level >= 256:
+        levels.append(level)
+        level *= 2
+
+    if levels:
+        dataset.BuildOverviews(resampling, levels)
+    return
+
+
+def _stage_geotiff(outpath, options, profile = None):
+    """
+    finds where a GeoTiff should be created, and with which creation options.
+    Cloud optimized outputs are staged in a temporary tiled GeoTiff, which
+    ``_finish_geotiff`` copies to outpath once every pixel is written.
+
+    :param outpath:     filepath of the output
+    :param options:     creation options of the output
+    :param profile:     ``output_profile`` or profile name of the output
+
+    :return path:       filepath to create the dataset at
+    :return options:    creation options to create the dataset with
+    """
+
+    profile = _resolve_profile(profile)
+    if not profile.cloud_optimized:
+        return outpath, options
+
+    temp = os.path.splitext(outpath)[0] + "_staging.tif"
+    _staged[os.path.abspath(temp)] = (outpath, options)
+
+    # the staging file is tiled like the output, but compressed only once, by the copy
+    temp_options = [option for option in options
+                    if option.split("=")[0] in ["TILED", "BLOCKXSIZE", "BLOCKYSIZE", "PIXELTYPE"]]
+    return temp, temp_options + ["BIGTIFF=IF_SAFER"]
+
+
+def _finish_geotiff(dataset, profile = None):
+    """
+    builds overviews if the profile asks for them, and copies staged cloud
+    optimized outputs to their final filepath. The dataset is flushed, but
+    it is up to the caller to close it.
+
+    :param dataset:     writable gdal.Dataset object
+    :param profile:     ``output_profile`` or profile name the dataset was created with
+    """
+
+    profile = _resolve_profile(profile)
+    staged  = _staged.pop(os.path.abspath(dataset.GetDescription()), None)
+
+    if dataset.GetDriver().ShortName == "GTiff":
+        if profile.overviews or (staged and dataset.GetRasterBand(1).GetOverviewCount() == 0):
+            _build_overviews(dataset, profile.resampling)
+
+    dataset.FlushCache()
+
+    if staged is not None:
+        outpath, options = staged
+        copy = gdal.GetDriverByName("GTiff").CreateCopy(outpath, dataset, 0,
+                                                        options + ["COPY_SRC_OVERVIEWS=YES"])
+        if copy is None:
+            raise Exception("Could not write cloud optimized GeoTiff {0}".format(outpath))
+        copy = None
+        _leftovers.append(dataset.GetDescription())
+        _remove_leftovers()
+    return
+
+
+@atexit.register
+def _remove_leftovers():
+    """
+    removes the staging files of finished cloud optimized outputs. Files which
+    are still open are kept, and tried again later, or when python exits.
+    """
+
+    for path in _leftovers[:]:
+        try:
+            os.remove(path)
+        except OSError:
+            if os.path.exists(path):
+                continue
+        _leftovers.remove(path)
+    return
+
+
+def _register_cache(invalidate):
+    """
+    registers a cache of data read from raster files, so it is invalidated
+    whenever a file is written by any writer in dnppy.
+
+    :param invalidate:  function of a filepath, which drops its cached data
+    """
+
+    with _caches_lock:
+        if invalidate not in _caches:
+            _caches.append(invalidate)
+    return
+
+
+def _invalidate(raster):
+    """
+    drops the data of a raster from every registered cache, to be called
+    whenever it is written or modified in place.
+
+    :param raster:      filepath to raster
+    """
+
+    with _caches_lock:
+        caches = list(_caches)
+
+    for invalidate in caches:
+        invalidate(raster)
+    return
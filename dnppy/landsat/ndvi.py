@@ -1,10 +1,7 @@
 
 #standard imports
 import os
-import arcpy
-if arcpy.CheckExtension('Spatial')=='Available':
-    arcpy.CheckOutExtension('Spatial')
-    arcpy.env.overwriteOutput = True
+from dnppy import raster
 
 __all__=['ndvi_8',                  # complete
          'ndvi_457']                # complete
@@ -15,7 +12,8 @@ def ndvi_8(Band5, Band4, outdir = None):
     Simple calculator of Normalized difference vegetation index on some Landsat 8 OLI
     data. Output file will have same name as inputs with "NDVI" in place of "B5", so
     inputs of files "LC80140342014347LGN00_B5.tif" and "LC80140342014347LGN00_B4.tif"
-    will generate a file named "LC80140342014347LGN00_NDVI.tif"
+    will generate a file named "LC80140342014347LGN00_NDVI.tif". The index is computed
+    block by block with ``raster.expr``, so Spatial Analyst is not required.
 
     :param Band5:   The full filepath to the band 5 tiff file, the OLI NIR band
     :param Band4:   The full filepath to the band 4 tiff file, the OLI Visible Red band
@@ -28,8 +26,8 @@ def ndvi_8(Band5, Band4, outdir = None):
     Band5 = os.path.abspath(Band5)
 
     #Set the input bands to float
-    Red = arcpy.sa.Float(Band4)
-    NIR = arcpy.sa.Float(Band5)
+    Red = raster.expr(Band4, "float32")
+    NIR = raster.expr(Band5, "float32")
 
     #Calculate the NDVI
     L8_NDVI = (NIR - Red)/(NIR + Red)
@@ -53,7 +51,8 @@ def ndvi_457(Band4, Band3, outdir = None):
     Simple calculator of Normalized difference vegetation index on some Landsat 4/5/7 TM/ETM+
     data. Output file will have same name as inputs with "NDVI" in place of "B5", so
     inputs of files "LC70140342014347LGN00_B4.tif" and "LC70140342014347LGN00_B3.tif"
-    will generate a file named "LC70140342014347LGN00_NDVI.tif"
+    will generate a file named "LC70140342014347LGN00_NDVI.tif". The index is computed
+    block by block with ``raster.expr``, so Spatial Analyst is not required.
 
     :param Band4:   The full filepath to the band 4 tiff file, the TM/ETM+ NIR band
     :param Band3:   The full filepath to the band 3 tiff file, the TM/ETM+ Visible Red band
@@ -66,8 +65,8 @@ def ndvi_457(Band4, Band3, outdir = None):
     Band4 = os.path.abspath(Band4)
 
     #Set the input bands to float
-    Red = arcpy.sa.Float(Band3)
-    NIR = arcpy.sa.Float(Band4)
+    Red = raster.expr(Band3, "float32")
+    NIR = raster.expr(Band4, "float32")
 
     #Calculate the NDVI
     L457_NDVI = (NIR - Red)/(NIR + Red)
@@ -5,7 +5,7 @@ for use with functions in the raster module. The modules capabilities include st
 generation, subsetting, reprojecting, null data management, correction functions, and others.
 Top level functions in the raster module should all have batch processing capabilities bult in.
 
-Requires ``arcpy``
+Requires ``arcpy`` and ``gdal``
 """
 
 __author__ = ["Jwely",
@@ -13,24 +13,31 @@ __author__ = ["Jwely",
 
 
 from apply_linear_correction import *
+from block_cache import *
+from build_stats import *
 from clip_and_snap import *
 from clip_to_shape import *
 from degree_days import *
 from degree_days_accum import *
 from enf_rastlist import *
+from expr import *
 from from_numpy import *
 from gap_fill_temporal import *
 from gap_fill_interpolate import *
 from in_dir import *
 from is_rast import *
+from iter_blocks import *
 from many_stats import *
 from metadata import *
 from new_mosaic import *
 from null_define import *
 from null_set_range import *
+from output_profile import *
+from progress import *
 from project_resample import *
 from raster_fig import *
 from raster_overlap import *
+from read_metadata import *
 from spatially_match import *
 from to_numpy import *
 
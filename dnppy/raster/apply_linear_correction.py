@@ -1,15 +1,23 @@
-
-
-from enf_rastlist import *
-from from_numpy import *
-from to_numpy import *
+__author__ = "jwely"
+__all__ = ["apply_linear_correction"]
+
+from enf_rastlist import enf_rastlist
+from read_metadata import read_metadata, _open_gdal
+from to_numpy import _read_window
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from iter_blocks import _block_windows
+from build_stats import build_stats
 from dnppy import core
+
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import numpy
+import time
 import os
 
-__all_ = ["apply_linear_correction"]
 
 def apply_linear_correction(rasterlist, factor, offset, suffix = 'lc',
-                            outdir = None, floor = -999999):
+                            outdir = None, floor = -999999, workers = None):
     """
     Applies a linear correction to a raster dataset.
     New offset rasters are saved in the output directory with a suffix of "lc"
@@ -18,6 +26,11 @@ def apply_linear_correction(rasterlist, factor, offset, suffix = 'lc',
     Also useful when ground truthing satellite data and discovering linear errors.
     All outputs are 32 bit floating point values.
 
+    Each raster is streamed one block at a time, and the correction is applied in
+    place on float32 blocks, so no temporary arrays are made. Files are processed
+    concurrently in a pool of threads, since gdal releases the interpreter lock
+    while reading and writing. Statistics for all outputs are built at the end.
+
     :param rasterlist:  list of rasters, a single raster, or a directory full of tiffs to
                         Have a linear correction applied to them.
     :param factor:      every pixel in the raster will be MULTIPLIED by this value.
@@ -28,7 +41,7 @@ def apply_linear_correction(rasterlist, factor, offset, suffix = 'lc',
                         in the same folder as the input images.
     :param floor:       Used to manage NoData. All values less than floor are set to floor
                         then floor is set to the new NoData value. defaults to -999,999
-
+    :param workers:     number of files to process at once. defaults to the number of cpus.
 
     return outputpath:  filepath to output files created by this function
 
@@ -47,24 +60,91 @@ def apply_linear_correction(rasterlist, factor, offset, suffix = 'lc',
     celsius!
     """
 
-    output_filelist = []
-
     if outdir is not None and not os.path.isdir(outdir):
         os.makedirs(outdir)
     rasterlist = enf_rastlist(rasterlist)
 
+    if len(rasterlist) == 0:
+        return []
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    jobs = []
     for raster in rasterlist:
-        print("applying a linear correction to " + raster)
-        image, metadata = to_numpy(raster, "float32")
-        new_NoData = floor
-        
-        output = image * factor + offset
-        low_value_indices = output < new_NoData
-        output[low_value_indices] = new_NoData
-
-        outname = core.create_outname(outdir,raster,suffix)
-        from_numpy(output, metadata, outname, new_NoData)
-        output_filelist.append(outname)
+        outname = core.create_outname(outdir, raster, suffix)
+        jobs.append((raster, outname, factor, offset, floor))
 
+    start = time.time()
+
+    pool = ThreadPool(min(workers, len(jobs)))
+    try:
+        results = pool.map(_correct_raster, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = max(time.time() - start, 1e-6)
+    output_filelist = [outname for outname, _ in results]
+    megabytes = sum(nbytes for _, nbytes in results) / 1048576.0
+
+    build_stats(output_filelist, workers)
+
+    print("Corrected {0} rasters in {1:.1f}s ({2:.1f} files/s, {3:.1f} MB/s)".format(
+        len(output_filelist), elapsed, len(output_filelist) / elapsed, megabytes / elapsed))
     print("Finished! \n ")
     return output_filelist
+
+
+def _correct_raster(job):
+    """
+    applies a linear correction to one raster, block by block.
+
+    :param job:         tuple of (raster, outname, factor, offset, floor)
+    :return:            tuple of (outname, number of float32 bytes processed)
+    """
+
+    raster, outname, factor, offset, floor = job
+    print("applying a linear correction to " + raster)
+
+    meta    = read_metadata(raster, cache = False)
+    dataset = _open_gdal(raster)
+    zs      = dataset.RasterCount
+    native  = dataset.GetRasterBand(1).GetBlockSize()
+
+    out_dataset = _create_dataset(outname, meta, meta.Xsize, meta.Ysize, zs, "float32", floor)
+
+    for window in _block_windows(meta.Xsize, meta.Ysize, native):
+        block = _read_window(dataset, window, "float32", cache = False)
+        _correct_block(block, factor, offset, floor, meta.NoData_Value)
+        _write_array(out_dataset, block, floor, window[0], window[1])
+
+    dataset = None
+    _close_dataset(out_dataset, outname, stats = "deferred")
+
+    return outname, meta.Xsize * meta.Ysize * zs * 4
+
+
+def _correct_block(block, factor, offset, floor, NoData_Value = None):
+    """
+    applies ``block * factor + offset`` in place, with values below floor (and
+    input NoData values) set to floor.
+
+    :param block:           float32 array, modified in place
+    :param factor:          multiplicative factor
+    :param offset:          additive offset
+    :param floor:           minimum value, and the NoData value of the output
+    :param NoData_Value:    NoData value of the input, or None
+    """
+
+    nodata = None
+    if NoData_Value is not None:
+        nodata = block == NoData_Value
+
+    numpy.multiply(block, factor, out = block)
+    numpy.add(block, offset, out = block)
+    numpy.maximum(block, floor, out = block)
+
+    if nodata is not None:
+        numpy.copyto(block, floor, where = nodata)
+    return
@@ -0,0 +1,179 @@
+__author__ = "jwely"
+__all__ = ["block_cache_info", "set_block_cache", "clear_block_cache"]
+
+from collections import OrderedDict
+from osgeo import gdal_array
+from dnppy.core._geotiff_output import _register_cache
+import threading
+import numpy
+import os
+
+# process wide least recently used cache of decoded raster blocks
+_cache          = OrderedDict()
+_cache_lock     = threading.Lock()
+_cache_budget   = 256 * 1048576
+_cache_bytes    = 0
+_counters       = {"hits": 0, "misses": 0, "evictions": 0}
+
+# native blocks smaller than this many pixels are grouped into larger cache blocks
+_MIN_BLOCK_PIXELS = 65536
+
+
+def block_cache_info():
+    """
+    Returns the state of the process wide raster block cache, used by every raster
+    reader in this module. Decoded blocks are kept in memory, keyed on the filepath,
+    modification time, band and block index, so repeated reads of the same parts of
+    a raster (like a reference grid) only decode them once.
+
+    :return info:   dict with "hits", "misses" and "evictions" counts, along with the
+                    number of cached "blocks", the cached "bytes", and the "budget"
+                    in bytes.
+    """
+
+    with _cache_lock:
+        info = dict(_counters)
+        info["blocks"] = len(_cache)
+        info["bytes"]  = _cache_bytes
+        info["budget"] = _cache_budget
+    return info
+
+
+def set_block_cache(max_bytes):
+    """
+    Sets the memory budget of the raster block cache. Least recently used blocks
+    are evicted as soon as the cache grows past it. Use 0 to disable the cache.
+
+    :param max_bytes:   size of the cache in bytes. defaults to 256MB
+    """
+
+    global _cache_budget
+    with _cache_lock:
+        _cache_budget = int(max_bytes)
+        _evict()
+    return
+
+
+def clear_block_cache():
+    """ empties the raster block cache and resets its counters """
+
+    global _cache_bytes
+    with _cache_lock:
+        _cache.clear()
+        _cache_bytes = 0
+        for counter in _counters:
+            _counters[counter] = 0
+    return
+
+
+def _cached_read(dataset, band_number, window):
+    """
+    reads a window of one band of an open gdal.Dataset through the block cache.
+
+    :param dataset:         gdal.Dataset object
+    :param band_number:     band to read, starting at 1
+    :param window:          tuple of (xoff, yoff, xsize, ysize)
+
+    :return numpy_rast:     2d array of the window, in the native datatype of the band.
+                            it is always a new array, safe to modify.
+    """
+
+    xoff, yoff, xsize, ysize = window
+    band = dataset.GetRasterBand(band_number)
+
+    file_key = _file_key(dataset)
+    dtype    = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+
+    # windows which would flush most of the cache are read straight from disk
+    if file_key is None or xsize * ysize * numpy.dtype(dtype).itemsize * 2 > _cache_budget:
+        return band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+    bw, bh = _cache_block_size(band)
+    xs, ys = band.XSize, band.YSize
+
+    out = numpy.empty((ysize, xsize), dtype = dtype)
+
+    for by in range(yoff // bh, (yoff + ysize - 1) // bh + 1):
+        for bx in range(xoff // bw, (xoff + xsize - 1) // bw + 1):
+
+            block = _get_block(file_key, band, band_number, bx, by, bw, bh, xs, ys)
+
+            # overlap of this block and the window, in raster coordinates
+            x0, x1 = max(xoff, bx * bw), min(xoff + xsize, (bx + 1) * bw)
+            y0, y1 = max(yoff, by * bh), min(yoff + ysize, (by + 1) * bh)
+
+            out[y0 - yoff : y1 - yoff, x0 - xoff : x1 - xoff] = \
+                block[y0 - by * bh : y1 - by * bh, x0 - bx * bw : x1 - bx * bw]
+
+    return out
+
+
+def _get_block(file_key, band, band_number, bx, by, bw, bh, xs, ys):
+    """ returns one cached block, reading and caching it on a miss """
+
+    global _cache_bytes
+    key = file_key + (band_number, bx, by)
+
+    with _cache_lock:
+        if key in _cache:
+            block = _cache.pop(key)
+            _cache[key] = block
+            _counters["hits"] += 1
+            return block
+        _counters["misses"] += 1
+
+    block = band.ReadAsArray(bx * bw, by * bh, min(bw, xs - bx * bw), min(bh, ys - by * bh))
+    block.setflags(write = False)
+
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = block
+            _cache_bytes += block.nbytes
+            _evict()
+    return block
+
+
+def _evict():
+    """ drops least recently used blocks until the cache is within budget. needs the lock """
+
+    global _cache_bytes
+    while _cache and _cache_bytes > _cache_budget:
+        _, block = _cache.popitem(last = False)
+        _cache_bytes -= block.nbytes
+        _counters["evictions"] += 1
+    return
+
+
+def _invalidate(raster):
+    """ drops every cached block of a raster, called when it is written to """
+
+    global _cache_bytes
+    path = os.path.abspath(raster)
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == path]:
+            _cache_bytes -= _cache.pop(key).nbytes
+    return
+
+
+_register_cache(_invalidate)
+
+
+def _file_key(dataset):
+    """ (path, mtime, size) of the file behind a dataset, or None if it isn't a plain file """
+
+    path = dataset.GetDescription()
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+
+def _cache_block_size(band):
+    """ native block size of a band, with small blocks (like single row strips) grouped """
+
+    bw, bh = band.GetBlockSize()
+    if bw * bh < _MIN_BLOCK_PIXELS:
+        bh *= -(-_MIN_BLOCK_PIXELS // (bw * bh))
+    return bw, min(bh, band.YSize)
+
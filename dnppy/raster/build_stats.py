@@ -0,0 +1,100 @@
+__author__ = "jwely"
+__all__ = ["build_stats"]
+
+from enf_rastlist import enf_rastlist
+from output_profile import _build_overviews
+
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import gdal
+
+# outputs saved with stats = "deferred" wait here until build_stats is called
+_deferred = []
+
+
+def build_stats(rasterlist = None, workers = None):
+    """
+    Builds statistics and overviews (pyramids) for a batch of rasters in one
+    parallel pass. gdal releases the python interpreter lock while it computes,
+    so each raster is handled by its own thread.
+
+    Batch functions save their outputs with ``from_numpy(..., stats = "deferred")``
+    and call this function once at the end, instead of paying for statistics and
+    pyramids on every intermediate as it is written.
+
+    :param rasterlist:  list of rasters, a single raster, or a directory of rasters.
+                        Leave None to build statistics for every output that has been
+                        saved with ``stats = "deferred"`` and not yet processed.
+    :param workers:     number of threads to use. defaults to the number of cpus.
+
+    :return rasterlist: list of rasters that statistics were built for
+    """
+
+    if rasterlist is None:
+        rasterlist = list(_deferred)
+    else:
+        rasterlist = enf_rastlist(rasterlist)
+
+    for raster in rasterlist:
+        if raster in _deferred:
+            _deferred.remove(raster)
+
+    if len(rasterlist) == 0:
+        return rasterlist
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    pool = ThreadPool(min(workers, len(rasterlist)))
+    try:
+        pool.map(_build_raster_stats, rasterlist)
+    finally:
+        pool.close()
+        pool.join()
+
+    print("Built statistics and pyramids for {0} rasters".format(len(rasterlist)))
+    return rasterlist
+
+
+def _apply_stats_policy(raster, stats):
+    """
+    handles the ``stats`` argument of raster writers for a newly saved raster
+
+    :param raster:  filepath to a newly saved raster
+    :param stats:   "now" to build statistics immediately, "deferred" to queue them
+                    for the next call to ``build_stats``, or "none" to skip them.
+    """
+
+    if stats == "now":
+        _build_raster_stats(raster)
+
+    elif stats == "deferred":
+        if raster not in _deferred:
+            _deferred.append(raster)
+
+    elif stats != "none":
+        raise ValueError("stats must be 'now', 'deferred' or 'none', not '{0}'".format(stats))
+    return
+
+
+def _build_raster_stats(raster):
+    """
+    computes exact statistics for every band of a raster and builds
+    power of two overviews down to roughly 256 pixels on the long side,
+    unless the raster was written with internal overviews already.
+
+    :param raster:  filepath to raster
+    """
+
+    dataset = gdal.Open(raster, gdal.GA_Update)
+    if dataset is None:
+        raise Exception("Could not open '{0}' to build statistics".format(raster))
+
+    for z in range(dataset.RasterCount):
+        dataset.GetRasterBand(z + 1).ComputeStatistics(False)
+
+    if dataset.GetRasterBand(1).GetOverviewCount() == 0:
+        _build_overviews(dataset, "NEAREST")
+
+    dataset = None
+    return
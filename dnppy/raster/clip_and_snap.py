@@ -1,12 +1,12 @@
 
 __all__ = ["clip_and_snap"]
 
-from to_numpy import to_numpy
-from from_numpy import from_numpy
+from read_metadata import read_metadata, _open_gdal
+from to_numpy import _read_window
+from from_numpy import _create_dataset, _write_array, _close_dataset
 
-import os
-import arcpy
-import shutil
+import copy
+import numpy
 
 
 def clip_and_snap(snap_raster, rastname, outname, NoData_Value = None):
@@ -22,62 +22,80 @@ def clip_and_snap(snap_raster, rastname, outname, NoData_Value = None):
     extents are identical. This is important when performing numpy manipulations on matrices
     derived from different datasets manipulated in different ways to ensure alignment.
 
-    This script makes modifications to the original raster file, so save a backup if you are
-    unsure how to use this.
+    The pixel window of the snap_raster extent within rastname is computed directly from
+    the geotransforms of the two rasters, and only that window is read. Any part of
+    the window that falls outside of rastname is padded with NoData, and the output
+    is written once, without any temporary files, on exactly the grid (extent and
+    geotransform) of the snap_raster.
 
     :param snap_raster:     filepath and name of reference raster whos extent will be taken on by
                             the input rastername.
     :param rastname:        name of raster which should be snapped to the snap_raster
+    :param outname:         filepath to save the snapped raster at
     :param NoData_Value:    Value desired to represent NoData in the saved image.
 
     :return snap_meta:      metadata of the snap_raster file as output by to_numpy
-    :return meta:           metadata of the rastername file as output by to_numpy
+    :return meta:           metadata of the output file
     """
 
     # grab metadata for rastname
-    _,snap_meta = to_numpy(snap_raster)
-    _,meta      = to_numpy(rastname)
+    snap_meta   = read_metadata(snap_raster)
+    meta        = read_metadata(rastname, cache = False)
 
-    if NoData_Value is None:
+    if NoData_Value is None or NoData_Value is False:
         NoData_Value = meta.NoData_Value
 
-    head, tail   = os.path.split(outname)
-    tempdir     = os.path.join(head, 'temp')
+    print("Clipping {0}".format(rastname))
 
-    if not os.path.isdir(tempdir):
-        os.makedirs(tempdir)
+    xoff, yoff, xs, ys = _snap_window(meta, snap_meta)
 
-    # set the snap raster environment in arcmap
-    arcpy.env.snapRaster = snap_raster
+    # the output takes the exact grid of the snap raster, the rounded offsets
+    # above are only used to find which pixels of rastname to read
+    out_meta = copy.copy(meta)
+    for attr in ["Xsize", "Ysize", "cellWidth", "cellHeight", "Xmin", "Ymin",
+                 "Xmax", "Ymax", "rectangle", "geotransform"]:
+        setattr(out_meta, attr, getattr(snap_meta, attr))
+    out_meta.window = None
 
-    # remove data that is outside the bounding box and snap the image
-    print("Clipping {0}".format(rastname))
+    dataset = _open_gdal(rastname)
+    zs      = dataset.RasterCount
+
+    # fill with NoData, then drop in whatever part of the window overlaps rastname
+    if NoData_Value is None:
+        out_rast = numpy.zeros((zs, ys, xs), dtype = meta.numpy_datatype)
+    else:
+        out_rast = numpy.full((zs, ys, xs), NoData_Value, dtype = meta.numpy_datatype)
 
-    tempout = os.path.join(tempdir,'tempclip.tif')
-    try:
-        arcpy.Clip_management(rastname, snap_meta.rectangle, tempout, "#", "#", "NONE", "MAINTAIN_EXTENT")
-    except:
-        arcpy.Clip_management(rastname, snap_meta.rectangle, tempout, "#", "#", "NONE")
+    x0, x1 = max(xoff, 0), min(xoff + xs, meta.Xsize)
+    y0, y1 = max(yoff, 0), min(yoff + ys, meta.Ysize)
 
-    # load the newly clipped raster, find any residual offsets (usually a single pixel or two)
-    raster, meta = to_numpy(tempout)
-    xloff   = int(round((meta.Xmin - snap_meta.Xmin)/meta.cellWidth,0))
-    yloff   = int(round((meta.Ymin - snap_meta.Ymin)/meta.cellHeight,0))
-    xhoff   = int(round((meta.Xmax - snap_meta.Xmax)/meta.cellWidth,0))
-    yhoff   = int(round((meta.Ymax - snap_meta.Ymax)/meta.cellHeight,0))
+    if x1 > x0 and y1 > y0:
+        inside = _read_window(dataset, (x0, y0, x1 - x0, y1 - y0), meta.numpy_datatype)
+        out_rast[:, y0 - yoff : y1 - yoff, x0 - xoff : x1 - xoff] = inside.reshape((zs, y1 - y0, x1 - x0))
+    dataset = None
 
-    # plop the snapped raster into the new output raster, alter the metadata, and save it
-    meta.Xmin   = snap_meta.Xmin
-    meta.Ymin   = snap_meta.Ymin
-    meta.Xmax   = snap_meta.Xmax
-    meta.Ymax   = snap_meta.Ymax
+    out_dataset = _create_dataset(outname, out_meta, xs, ys, zs, meta.numpy_datatype, NoData_Value)
+    _write_array(out_dataset, out_rast, NoData_Value)
+    _close_dataset(out_dataset, outname, stats = "now")
 
-    newraster = raster[(-yloff) : (meta.Ysize - yhoff), (-xloff) : (meta.Xsize - xhoff)]
+    out_meta.NoData_Value = NoData_Value
+    return snap_meta, out_meta
 
-    from_numpy(newraster, meta, outname, NoData_Value)
 
-    try:
-        shutil.rmtree(tempdir)
-    except: pass
+def _snap_window(meta, snap_meta):
+    """
+    finds the pixel window of a snap raster's extent within another raster of
+    the same projection and cell size, from the geotransforms of the two.
+    Offsets may be negative, or the window may extend past the raster edges.
+
+    :param meta:        metadata of the raster to be snapped
+    :param snap_meta:   metadata of the snap raster
+    :return window:     tuple of (xoff, yoff, xsize, ysize)
+    """
+
+    gt      = meta.geotransform
+    snap_gt = snap_meta.geotransform
+    xoff    = int(round((snap_gt[0] - gt[0]) / gt[1]))
+    yoff    = int(round((snap_gt[3] - gt[3]) / gt[5]))
 
-    return snap_meta, meta
\ No newline at end of file
+    return xoff, yoff, snap_meta.Xsize, snap_meta.Ysize
@@ -7,6 +7,7 @@ from enf_rastlist import enf_rastlist
 
 import os
 import arcpy
+arcpy.env.overwriteOutput = True
 from arcpy.sa import ExtractByMask
 
 
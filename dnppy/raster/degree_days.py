@@ -1,18 +1,22 @@
-
 __all__ = ["degree_days"]
 
-from to_numpy import to_numpy
-from from_numpy import from_numpy
+from dnppy import core
+from enf_rastlist import enf_rastlist
+from iter_blocks import iter_blocks
+from read_metadata import read_metadata
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from build_stats import build_stats
 
 import numpy
 
-def degree_days(T_base, Max, Min, NoData_Value, outpath = False, roof = False, floor = False):
+def degree_days(T_base, Max, Min, NoData_Value, outpath = False, roof = False, floor = False,
+                outdir = None):
     """
     Inputs rasters for maximum and minimum temperatures, calculates Growing Degree Days
 
-    this function is built to perform the common degree day calculation on either a pair
-    of raster filepaths, a pair of numpy arrays It requires, at minimum a maximum
-    temperature value, a minimum temperature value, and a base temperature. This
+    this function is built to perform the common degree day calculation on either
+    paired lists of raster filepaths, or a pair of numpy arrays. It requires, at minimum
+    a maximum temperature value, a minimum temperature value, and a base temperature. This
     equation could also be used to calculate Chill hours or anything similar.
 
     The equation is ``[(Max+Min)/2 + T_base]``
@@ -21,92 +25,123 @@ def degree_days(T_base, Max, Min, NoData_Value, outpath = False, roof = False, f
     where values in Min which are less than floor are set equal to floor
     consult [https://en.wikipedia.org/wiki/Growing_degree-day] for more information.
 
+    Raster inputs are processed as a batch, one output per day. Each pair of rasters
+    is streamed block by block, so scenes of any size are handled in bounded memory.
+
     :param T_base:          base temperature to ADD, be mindful of sign convention.
-    :param Max:             filepath, numpy array, or list of maximum temperatures
-    :param Min:             filepath, numpy array, or list of minimum temperatures
+    :param Max:             numpy array, filepath, list of filepaths, or rast_series of
+                            maximum temperatures
+    :param Min:             numpy array, filepath, list of filepaths, or rast_series of
+                            minimum temperatures, paired in order with those in Max
     :param NoData_Value:    values to ignore (must be int or float)
-    :param outpath:         filepath to which output should be saved. Only works if Max and Min inputs
-                            are raster filepaths with spatial referencing.
+    :param outpath:         filepath to which output should be saved, when only a single
+                            pair of rasters is input.
     :param roof:            roof value above which Max temps do not mater
     :param floor:           floor value below which Min temps do not mater
+    :param outdir:          directory to save outputs in when Max and Min are rasters.
+                            Leave None to save them next to the Max rasters. Outputs are
+                            named after the Max rasters with a "DD" suffix.
 
-    :return deg_days:       a numpy array of the output degree_days
+    :return deg_days:       a numpy array of the output degree_days for numpy array inputs,
+                            or a list of output filepaths for raster inputs.
     """
 
-    #FIXME: doesn't fit style guide. does not operate in batch and return list of output filepaths
-
-    output_filelist = []
-
     # format numerical inputs as floating point values
     T_base = float(T_base)
-    if roof:
+    if roof is not False and roof is not None:
         roof  = float(roof)
-    if floor:
+    else:
+        roof  = None
+    if floor is not False and floor is not None:
         floor = float(floor)
+    else:
+        floor = None
+
+    # numpy arrays (or lists of numbers) are calculated directly
+    if isinstance(Max, numpy.ndarray) or (isinstance(Max, list) and len(Max) > 0
+                                         and not isinstance(Max[0], basestring)):
+        highs = numpy.asarray(Max, dtype = "float64")
+        lows  = numpy.asarray(Min, dtype = "float64")
+
+        if highs.shape != lows.shape:
+            print('Images are not the same size!, Check inputs!')
+            return False
 
-    # Determine the type of input and convert to useful format for calculation
-    # acceptable input formats are filepaths to rasters, numpy arrays, or lists.
-    if type(Max) is list and type(Min) is list:
-        
-        # if the first entry in a list is a string, assume it is a filename that has
-        # been placed into a list.
-        if type(Max[0]) is str and type(Min[0]) is str:
-            Max = Max[0]
-            Min = Min[0]
-
-            # load in the min and max files.
-            highs, meta = to_numpy(Max)
-            lows, meta  = to_numpy(Min)
-
-            print('Found spatially referenced image pair!')
+        return _degree_days_array(highs, lows, T_base, NoData_Value, roof, floor)
+
+    # otherwise, we have a batch of raster filepaths
+    max_list = _enf_series(Max)
+    min_list = _enf_series(Min)
+
+    if len(max_list) != len(min_list):
+        raise Exception("Max and Min must contain the same number of rasters!")
+
+    output_filelist = []
+
+    for max_path, min_path in zip(max_list, min_list):
+
+        if outpath and len(max_list) == 1:
+            outname = outpath
         else:
-            highs = numpy.array(Max)
-            lows  = numpy.array(Min)
-            
-    # if they are already numpy arrays
-    elif type(Max) is numpy.ndarray:
-            highs = Max
-            lows  = Min
-    else:
-        raise Exception("invalid inputs!")
-            
-    # Begin to perform the degree day calculations
-
-    # apply roof and floor corrections if they have been specified
-    if roof:
-        highs[highs >= roof] = roof
-    if floor:
-        lows[lows <=floor] = floor
-
-    # find the shapes of high and low arrays
-    xsh, ysh = highs.shape
-    xsl, ysl = lows.shape
-
-    # only continue if min and max arrays have the same shape
-    if xsh == xsl and ysh == ysl:
-        
-        # set empty degree day matrix
-        deg_days = numpy.zeros((xsh,ysh))
-        
-        # perform the calculation
-        for x in range(xsh):
-            for y in range(ysh):
-                if round(highs[x,y]/NoData_Value,10) !=1 and round(lows[x,y]/NoData_Value,10) != 1:
-                    deg_days[x,y] =((highs[x,y] + lows[x,y])/2) + T_base
-                else:
-                    deg_days[x,y] = NoData_Value
-                
-    # print error if the arrays are not the same size
-    else:
-        print('Images are not the same size!, Check inputs!')
-        return False
-
-    # if an output path was specified, save it with the spatial referencing information.
-    if outpath and type(Max) is str and type(Min) is str:
-        from_numpy(deg_days, meta, outpath)
-        print('Output saved at : ' + outpath)
-        
-    return deg_days
+            outname = core.create_outname(outdir, max_path, "DD", "tif")
+
+        meta = read_metadata(max_path, cache = False)
+        dataset = _create_dataset(outname, meta, meta.Xsize, meta.Ysize, 1,
+                                  "float32", NoData_Value)
+
+        for (highs, lows), (block_meta, _) in iter_blocks([max_path, min_path],
+                                                          numpy_datatype = "float64",
+                                                          cache = False):
+            deg_days = _degree_days_array(highs, lows, T_base, NoData_Value, roof, floor)
+            _write_array(dataset, deg_days.astype("float32"), NoData_Value,
+                         block_meta.window[0], block_meta.window[1])
+
+        _close_dataset(dataset, outname, stats = "deferred")
+        output_filelist.append(outname)
+        print('Output saved at : ' + outname)
+
+    build_stats(output_filelist)
+    return output_filelist
 
 
+def _enf_series(rasters):
+    """ accepts a filepath, list of filepaths, or rast_series, returns a list of filepaths"""
+
+    if hasattr(rasters, "col_data"):
+        return list(rasters.col_data["filepaths"])
+    return enf_rastlist(rasters)
+
+
+def _degree_days_array(highs, lows, T_base, NoData_Value, roof = None, floor = None):
+    """
+    vectorized degree day calculation on a pair of arrays
 
+    :param highs:           float array (or masked array) of maximum temperatures
+    :param lows:            float array (or masked array) of minimum temperatures
+    :param T_base:          base temperature to add
+    :param NoData_Value:    value marking NoData in highs and lows, and in the output
+    :param roof:            roof value for highs, or None
+    :param floor:           floor value for lows, or None
+
+    :return deg_days:       float64 array of degree days
+    """
+
+    nodata = numpy.ma.getmaskarray(highs) | numpy.ma.getmaskarray(lows)
+    highs  = numpy.ma.getdata(highs)
+    lows   = numpy.ma.getdata(lows)
+
+    # NoData must be found before roof and floor can alter those values
+    nodata |= numpy.isclose(highs, NoData_Value, rtol = 1e-10, atol = 0)
+    nodata |= numpy.isclose(lows, NoData_Value, rtol = 1e-10, atol = 0)
+
+    if roof is not None:
+        highs = numpy.minimum(highs, roof)
+    if floor is not None:
+        lows  = numpy.maximum(lows, floor)
+
+    deg_days  = highs + lows
+    deg_days *= 0.5
+    deg_days += T_base
+    deg_days[nodata] = NoData_Value
+
+    return deg_days
@@ -4,6 +4,7 @@ from dnppy import core
 from enf_rastlist import enf_rastlist
 from to_numpy import to_numpy
 from from_numpy import from_numpy
+from build_stats import build_stats
 
 import os
 import numpy
@@ -22,11 +23,17 @@ def degree_days_accum(rasterlist, critical_values = None, outdir = None):
     of our 365 day sequence every pixel hits a value of 100. Input 100 as a critical value
     and that output raster will be generated.
 
+    Each input raster is read once and added to a running float64 sum with array
+    operations, and crossings of every critical value are found with a single masked
+    assignment per raster. Statistics for all the outputs are built in one pass at
+    the end, see ``raster.build_stats``.
+
     :param rasterlist:          list of files, or directory containing rasters to accumulate
     :param critical_values:     Values at which the user wishes to know WHEN the total accumulation
                                 value reaches this point. For every critical value, an output
                                 raster will be created. This raster contains integer values denoting
-                                the index number of the file at which the value was reached.
+                                the index number of the file at which the value was reached,
+                                starting at 0. Pixels which never reach it are NoData (-1).
                                 This input must be a list of ints or floats, not strings.
     :param outdir:              Desired output directory for all output files.
 
@@ -38,6 +45,8 @@ def degree_days_accum(rasterlist, critical_values = None, outdir = None):
 
     if critical_values:
         critical_values = core.enf_list(critical_values)
+    else:
+        critical_values = []
 
     # critical values of zero are problematic, so replace it with a small value.
     if 0 in critical_values:
@@ -47,47 +56,48 @@ def degree_days_accum(rasterlist, critical_values = None, outdir = None):
     if outdir is not None and not os.path.exists(outdir):
         os.makedirs(outdir)
 
+    Sum  = None
+    Crit = None
+
     for i, rast in enumerate(rasterlist):
 
-        image, meta = to_numpy(rast,"float32")
-        xs, ys = image.shape
+        image, meta = to_numpy(rast, "float32", cache = False)
 
-        if i == 0:
-            Sum  = numpy.zeros((xs,ys))
-            Crit = numpy.zeros((len(critical_values),xs,ys))
+        if Sum is None:
+            Sum  = numpy.zeros(image.shape, dtype = "float64")
+            Crit = numpy.full((len(critical_values),) + image.shape, -1, dtype = "int16")
 
         if image.shape == Sum.shape:
 
-            # only bother to proceed if at least one pixel is positive
-            if numpy.max(image) >= 0:
-                for x in range(xs):
-                    for y in range(ys):
-
-                        if image[x,y] >= 0:
-                            Sum[x,y] = Sum[x,y]+image[x,y]
+            # only positive, valid pixels are accumulated
+            valid = ~numpy.ma.getmaskarray(image)
+            valid &= numpy.ma.getdata(image) >= 0
+            numpy.add(Sum, numpy.ma.getdata(image), out = Sum, where = valid)
 
-                        if critical_values is not None:
-                            for z,critical_value in enumerate(critical_values):
-                                if Sum[x,y] >= critical_value and Crit[z,x,y]==0:
-                                    Crit[z,x,y] = i
+            # record the index of the first raster at which each critical value is reached,
+            # -1 marks pixels which have not reached it yet
+            for z, critical_value in enumerate(critical_values):
+                crossed = (Sum >= critical_value) & (Crit[z] == -1)
+                Crit[z][crossed] = i
         else:
-            print "Encountered an image of incorrect size! Skipping it!"
+            print("Encountered an image of incorrect size! Skipping it!")
 
-        Sum     = Sum.astype('float32')
         outname = core.create_outname(outdir, rast, "Accum")
-        from_numpy(Sum, meta, outname)
+        meta.numpy_datatype = "float32"
+        from_numpy(Sum.astype("float32"), meta, outname, stats = "deferred")
         output_filelist.append(outname)
 
         del image
 
     # output critical accumulation rasters using some data from the last raster in previous loop
-    Crit = Crit.astype('int16')
     crit_meta = meta
-    crit_meta.NoData_Value = 0
+    crit_meta.NoData_Value = -1
+    crit_meta.numpy_datatype = "int16"
     head , tail = os.path.split(outname)        # place these in the last raster output location
     for z, critical_value in enumerate(critical_values):
         outname = os.path.join(head, "Crit_Accum_Index_Val-{0}.tif".format(str(critical_value)))
         print("Saving {0}".format(outname))
         from_numpy(Crit[z,:,:], crit_meta, outname)
 
-    return output_filelist
\ No newline at end of file
+    build_stats(output_filelist)
+    return output_filelist
@@ -0,0 +1,390 @@
+__author__ = "jwely"
+__all__ = ["expr", "con", "set_null", "save_many"]
+
+from read_metadata import read_metadata, _open_gdal
+from to_numpy import _read_window, _mask_nodata
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from iter_blocks import _block_windows
+
+import operator
+import numpy
+import os
+
+
+class expr(object):
+    """
+    Lazy raster algebra. An ``expr`` made from a raster filepath may be combined with
+    other expressions and numbers using ordinary arithmetic and comparison operators,
+    along with ``raster.con`` (or ``expr.where``), ``raster.set_null``, and the
+    ``log``, ``exp`` and ``sqrt`` methods.
+    Nothing is read while an expression is built up, each operation only records a node
+    in an expression graph.
+
+    When the expression is saved or reduced, the graph is evaluated one block at a time.
+    Every operation for a block is done before moving on to the next block, so no full
+    size intermediate rasters are ever made, and identical subexpressions (including
+    rasters used more than once) are evaluated only once per block. NoData is carried
+    through just like with the masked arrays of ``to_numpy``, and every raster in an
+    expression must have the same dimensions.
+
+    :param raster:          filepath to a raster
+    :param numpy_datatype:  datatype to read the raster as, defaults to "float32"
+
+    Example usage
+
+    .. code-block:: python
+
+        from dnppy import raster
+
+        nir  = raster.expr(band5_path)
+        red  = raster.expr(band4_path)
+        ndvi = (nir - red) / (nir + red)
+
+        ndvi.save(ndvi_path)
+        print(ndvi.mean())
+    """
+
+    def __init__(self, raster, numpy_datatype = "float32"):
+
+        self.op   = "read"
+        self.args = (os.path.abspath(raster), numpy_datatype)
+        self.key  = ("read",) + self.args
+
+
+    @classmethod
+    def _node(cls, op, *args):
+        """ builds a new node of the expression graph from an operation and its arguments """
+
+        node = object.__new__(cls)
+        node.op   = op
+        node.args = args
+        node.key  = (op,) + tuple(_key(arg) for arg in args)
+        return node
+
+
+    # arithmetic
+    def __add__(self, other):       return expr._node("add", self, other)
+    def __radd__(self, other):      return expr._node("add", other, self)
+    def __sub__(self, other):       return expr._node("sub", self, other)
+    def __rsub__(self, other):      return expr._node("sub", other, self)
+    def __mul__(self, other):       return expr._node("mul", self, other)
+    def __rmul__(self, other):      return expr._node("mul", other, self)
+    def __truediv__(self, other):   return expr._node("div", self, other)
+    def __rtruediv__(self, other):  return expr._node("div", other, self)
+    def __pow__(self, other):       return expr._node("pow", self, other)
+    def __rpow__(self, other):      return expr._node("pow", other, self)
+    def __neg__(self):              return expr._node("neg", self)
+    def __abs__(self):              return expr._node("abs", self)
+    __div__  = __truediv__
+    __rdiv__ = __rtruediv__
+
+    # comparisons
+    def __lt__(self, other):        return expr._node("lt", self, other)
+    def __le__(self, other):        return expr._node("le", self, other)
+    def __gt__(self, other):        return expr._node("gt", self, other)
+    def __ge__(self, other):        return expr._node("ge", self, other)
+    def __eq__(self, other):        return expr._node("eq", self, other)
+    def __ne__(self, other):        return expr._node("ne", self, other)
+    __hash__ = object.__hash__
+
+    # logical
+    def __and__(self, other):       return expr._node("and", self, other)
+    def __rand__(self, other):      return expr._node("and", other, self)
+    def __or__(self, other):        return expr._node("or", self, other)
+    def __ror__(self, other):       return expr._node("or", other, self)
+    def __invert__(self):           return expr._node("not", self)
+
+    # elementwise functions
+    def log(self):                  return log(self)
+    def exp(self):                  return exp(self)
+    def sqrt(self):                 return sqrt(self)
+
+
+    def save(self, outpath, numpy_datatype = "float32", NoData_Value = -9999,
+             block_shape = None, stats = "now"):
+        """
+        evaluates the expression block by block, writing each block straight to outpath
+
+        :param outpath:         output filepath
+        :param numpy_datatype:  numpy datatype of the output raster
+        :param NoData_Value:    NoData value of the output raster
+        :param block_shape:     optional (rows, cols) size of blocks to evaluate at once
+        :param stats:           "now", "deferred" or "none", see ``from_numpy``
+
+        :return outpath:        filepath to the output raster
+        """
+
+        save_many([(self, outpath)], numpy_datatype, NoData_Value, block_shape, stats)
+        return outpath
+
+
+    def to_numpy(self, numpy_datatype = "float32"):
+        """
+        evaluates the entire expression into memory
+
+        :return numpy_rast:     masked numpy array of the result
+        :return metadata:       metadata object of the first raster in the expression
+        """
+
+        meta = read_metadata(_leaves([self])[0])
+        out  = numpy.ma.masked_all((meta.Ysize, meta.Xsize), dtype = numpy_datatype)
+
+        for window, (block,) in _evaluate_blocks([self]):
+            xoff, yoff, xsize, ysize = window
+            out[yoff:yoff + ysize, xoff:xoff + xsize] = block
+
+        return out, meta
+
+
+    def sum(self):
+        """ sum of all the data values in the evaluated expression """
+        return self._reduce()[0]
+
+    def count(self):
+        """ number of pixels with data in the evaluated expression """
+        return self._reduce()[1]
+
+    def mean(self):
+        """ mean of all the data values in the evaluated expression """
+        total, count, _, _ = self._reduce()
+        return total / count if count else None
+
+    def min(self):
+        """ minimum data value in the evaluated expression """
+        return self._reduce()[2]
+
+    def max(self):
+        """ maximum data value in the evaluated expression """
+        return self._reduce()[3]
+
+
+    def _reduce(self):
+        """ streams the expression once, returning (sum, count, min, max) """
+
+        total, count, low, high = 0.0, 0, None, None
+
+        for _, (block,) in _evaluate_blocks([self]):
+            values = numpy.ma.asarray(block, dtype = "float64").compressed()
+            if values.size == 0:
+                continue
+
+            total += values.sum()
+            count += values.size
+            low    = values.min() if low is None else min(low, values.min())
+            high   = values.max() if high is None else max(high, values.max())
+
+        return total, count, low, high
+
+
+def con(condition, true_value, false_value = None):
+    """
+    conditional expression. Takes true_value where condition is True, and false_value
+    elsewhere. When false_value is None, pixels where condition is False are NoData.
+
+    :param condition:   expression which evaluates to True or False
+    :param true_value:  expression or number to use where condition is True
+    :param false_value: expression or number to use where condition is False, or None
+
+    :return expr:       lazy expression
+    """
+    return expr._node("con", condition, true_value, false_value)
+
+
+# numpy style name for con
+where = con
+expr.where = staticmethod(con)
+
+
+def set_null(condition, value):
+    """
+    sets pixels of value to NoData where condition is True.
+
+    :param condition:   expression which evaluates to True or False
+    :param value:       expression or number
+
+    :return expr:       lazy expression
+    """
+    return expr._node("set_null", condition, value)
+
+
+def log(value):
+    """ natural logarithm of an expression. values <= 0 become NoData """
+    return expr._node("log", value)
+
+
+def exp(value):
+    """ exponential of an expression """
+    return expr._node("exp", value)
+
+
+def sqrt(value):
+    """ square root of an expression. negative values become NoData """
+    return expr._node("sqrt", value)
+
+
+def save_many(outputs, numpy_datatype = "float32", NoData_Value = -9999,
+              block_shape = None, stats = "now"):
+    """
+    evaluates several expressions in a single pass over their input rasters, sharing
+    any subexpressions they have in common, and writes each of them to its own file.
+
+    :param outputs:         list of (expr, outpath) tuples
+    :param numpy_datatype:  numpy datatype of the output rasters
+    :param NoData_Value:    NoData value of the output rasters
+    :param block_shape:     optional (rows, cols) size of blocks to evaluate at once
+    :param stats:           "now", "deferred" or "none", see ``from_numpy``
+
+    :return outpaths:       list of output filepaths
+    """
+
+    exprs    = [e for e, _ in outputs]
+    outpaths = [path for _, path in outputs]
+    meta     = read_metadata(_leaves(exprs)[0])
+
+    datasets = [_create_dataset(path, meta, meta.Xsize, meta.Ysize, 1,
+                                numpy_datatype, NoData_Value) for path in outpaths]
+
+    for window, blocks in _evaluate_blocks(exprs, block_shape):
+        for dataset, block in zip(datasets, blocks):
+            block = numpy.ma.asarray(block).astype(numpy_datatype)
+            _write_array(dataset, block, NoData_Value, window[0], window[1])
+
+    for dataset, path in zip(datasets, outpaths):
+        _close_dataset(dataset, path, stats)
+        print("Saved output file as {0}".format(path))
+
+    return outpaths
+
+
+# functions applied to evaluated arguments for each operation
+_OPERATIONS = {"add":       operator.add,
+               "sub":       operator.sub,
+               "mul":       operator.mul,
+               "div":       operator.truediv,
+               "pow":       operator.pow,
+               "neg":       operator.neg,
+               "abs":       abs,
+               "lt":        operator.lt,
+               "le":        operator.le,
+               "gt":        operator.gt,
+               "ge":        operator.ge,
+               "eq":        operator.eq,
+               "ne":        operator.ne,
+               "and":       operator.and_,
+               "or":        operator.or_,
+               "not":       operator.invert,
+               "log":       numpy.ma.log,
+               "exp":       numpy.ma.exp,
+               "sqrt":      numpy.ma.sqrt,
+               "con":       lambda c, t, f: _con(c, t, f),
+               "set_null":  lambda c, v: _set_null(c, v)}
+
+
+def _key(arg):
+    """ structural key of an expression argument, equal for identical subexpressions """
+
+    if isinstance(arg, expr):
+        return arg.key
+    return ("const", arg)
+
+
+def _leaves(exprs):
+    """ filepaths of every raster read by a list of expressions, in order of appearance """
+
+    paths = []
+    stack = list(reversed(exprs))
+    seen  = set()
+
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, expr) or node.key in seen:
+            continue
+        seen.add(node.key)
+
+        if node.op == "read":
+            if node.args[0] not in paths:
+                paths.append(node.args[0])
+        else:
+            stack.extend(reversed(node.args))
+
+    if not paths:
+        raise Exception("expression does not contain any rasters!")
+    return paths
+
+
+def _evaluate_blocks(exprs, block_shape = None):
+    """
+    evaluates a list of expressions together, one block at a time
+
+    :return generator:  yields (window, list of masked array blocks) tuples
+    """
+
+    paths    = _leaves(exprs)
+    metas    = dict((path, read_metadata(path)) for path in paths)
+    datasets = dict((path, _open_gdal(path)) for path in paths)
+    first    = metas[paths[0]]
+
+    for path in paths:
+        if (metas[path].Xsize, metas[path].Ysize) != (first.Xsize, first.Ysize):
+            raise Exception("'{0}' does not have the same dimensions as '{1}'".format(
+                path, paths[0]))
+
+    native = datasets[paths[0]].GetRasterBand(1).GetBlockSize()
+
+    for window in _block_windows(first.Xsize, first.Ysize, native, block_shape):
+
+        # results of every node evaluated for this block, keyed on structure
+        memo = {}
+        blocks = [_evaluate(e, window, datasets, metas, memo) for e in exprs]
+        yield window, blocks
+
+    datasets = None
+
+
+def _evaluate(node, window, datasets, metas, memo):
+    """ evaluates one node of an expression graph for a single block """
+
+    if not isinstance(node, expr):
+        return node
+
+    if node.key in memo:
+        return memo[node.key]
+
+    if node.op == "read":
+        path, dtype = node.args
+        block  = _read_window(datasets[path], window, dtype)
+        result = _mask_nodata(block, metas[path].NoData_Value, dtype)
+    else:
+        args   = [_evaluate(arg, window, datasets, metas, memo) for arg in node.args]
+        result = _OPERATIONS[node.op](*args)
+
+    memo[node.key] = result
+    return result
+
+
+def _con(condition, true_value, false_value):
+    """ blockwise conditional, NoData in the condition stays NoData """
+
+    mask = numpy.ma.getmaskarray(condition)
+    cond = numpy.ma.getdata(condition).astype("bool")
+
+    if false_value is None:
+        result = numpy.ma.where(cond, true_value, 0)
+        mask   = mask | ~cond
+    else:
+        result = numpy.ma.where(cond, true_value, false_value)
+
+    return numpy.ma.masked_array(numpy.ma.getdata(result), numpy.ma.getmaskarray(result) | mask)
+
+
+def _set_null(condition, value):
+    """ blockwise set null, NoData in the condition stays NoData """
+
+    mask = numpy.ma.getmaskarray(condition)
+    cond = numpy.ma.getdata(condition).astype("bool")
+
+    if numpy.isscalar(value):
+        value = numpy.full(cond.shape, value)
+
+    return numpy.ma.masked_array(numpy.ma.getdata(value),
+                                 numpy.ma.getmaskarray(value) | cond | mask)
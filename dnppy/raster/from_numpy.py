@@ -1,24 +1,39 @@
 __author__ = "jwely"
 __all__ = ["from_numpy"]
 
-import arcpy
-arcpy.env.overwriteOutput = True
+from build_stats import _apply_stats_policy
+from output_profile import _resolve_profile, _stage_geotiff, _finish_geotiff
+from dnppy.core._geotiff_output import _invalidate
+
+import gdal
 import numpy
+import os
 
 
-def from_numpy(numpy_rast, metadata, outpath, NoData_Value = None):
+def from_numpy(numpy_rast, metadata, outpath, NoData_Value = None, stats = "now",
+               profile = None):
     """
-    Wrapper for arcpy.NumPyArrayToRaster function with better metadata handling
+    Saves a numpy array to a raster with gdal, with better metadata handling
 
-    this is just a wrapper for the NumPyArrayToRaster function within arcpy. It is used in
-    conjunction with to_numpy to streamline reading image files in and out of numpy
-    arrays. It also ensures that all spatial referencing and projection info is preserved
-    between input and outputs of numpy manipulations.
+    It is used in conjunction with to_numpy to streamline reading image files in and
+    out of numpy arrays. It also ensures that all spatial referencing and projection
+    info is preserved between input and outputs of numpy manipulations. The projection,
+    geotransform and NoData value are all set when the file is created, so the
+    raster is written in a single pass.
 
     :param numpy_rast:      The numpy array version of the input raster
     :param metadata:        The variable exactly as output from "to_numpy"
     :param outpath:         Output filepath of the individual raster
     :param NoData_Value:    The no data value of the output raster
+    :param stats:           policy for building statistics and overviews (pyramids).
+                            "now" builds them right away, "none" skips them entirely,
+                            and "deferred" queues the output so that statistics for a
+                            whole batch of outputs are built in one parallel pass by
+                            ``raster.build_stats``. Use "deferred" for outputs written
+                            in loops, and "none" for short lived intermediates.
+    :param profile:         layout of GeoTiff outputs, an ``output_profile`` or one of
+                            "striped", "tiled" or "cog". Defaults to the profile set with
+                            ``raster.set_output_profile``, which is "striped" unless changed.
 
     :return outpath:        Same as input outpath, filepath to created file.
 
@@ -32,44 +47,169 @@ def from_numpy(numpy_rast, metadata, outpath, NoData_Value = None):
 
     if NoData_Value is None:
         NoData_Value = metadata.NoData_Value
-            
-    llcorner = arcpy.Point(metadata.Xmin, metadata.Ymin)
-    
-    # save the output.
-    if isinstance(numpy_rast, numpy.ma.core.MaskedArray):
-        mask = numpy_rast.mask
-        data = numpy_rast.data
-        data[mask] = metadata.NoData_Value
-
-        OUT = arcpy.NumPyArrayToRaster(data, llcorner, metadata.cellWidth ,metadata.cellHeight)
-        OUT.save(outpath)
 
-    elif isinstance(numpy_rast, numpy.ndarray):
-        OUT = arcpy.NumPyArrayToRaster(numpy_rast, llcorner, metadata.cellWidth ,metadata.cellHeight)
-        OUT.save(outpath)
+    if numpy_rast.ndim == 3:
+        zs, ys, xs = numpy_rast.shape
+    else:
+        ys, xs = numpy_rast.shape
+        zs = 1
 
-    # define its projection
-    try:
-        arcpy.DefineProjection_management(outpath, metadata.projection)
-    except:
-        Warning("Unable to define the projection on {0}".format(outpath))
+    dataset = _create_dataset(outpath, metadata, xs, ys, zs,
+                              metadata.numpy_datatype, NoData_Value, profile = profile)
+    _write_array(dataset, numpy_rast, NoData_Value)
+    _close_dataset(dataset, outpath, stats, profile)
 
-    # reset the NoData_Values
-    try:
-        arcpy.SetRasterProperties_management(
-            outpath,
-            data_type = "#",
-            statistics = "#",
-            stats_file = "#",
-            nodata = "1 " + str(NoData_Value))
-
-    except:
-        Warning("Unable to establish NoData profile on {0}".format(outpath))
-    
-    # calculate statistics and pyramids
-    arcpy.CalculateStatistics_management(outpath)
-    arcpy.BuildPyramids_management(outpath)
-    
     print("Saved output file as {0}".format(outpath))
 
     return outpath
+
+
+# maps file extensions to gdal drivers, everything else is written as a GeoTiff
+_DRIVERS = {"img": "HFA",
+            "bil": "EHdr",
+            "bip": "EHdr",
+            "bsq": "EHdr",
+            "png": "PNG",
+            "jp2": "JP2OpenJPEG"}
+
+# maps numpy datatype strings to gdal datatypes
+# int8 is stored as a signed byte, see _create_dataset
+_GDAL_DATATYPES = {"bool_":   gdal.GDT_Byte,
+                   "bool":    gdal.GDT_Byte,
+                   "int8":    gdal.GDT_Byte,
+                   "uint8":   gdal.GDT_Byte,
+                   "uint16":  gdal.GDT_UInt16,
+                   "int16":   gdal.GDT_Int16,
+                   "uint32":  gdal.GDT_UInt32,
+                   "int32":   gdal.GDT_Int32,
+                   "float32": gdal.GDT_Float32,
+                   "float64": gdal.GDT_Float64}
+
+
+def _create_dataset(outpath, metadata, xs, ys, zs, numpy_datatype, NoData_Value,
+                    options = None, profile = None):
+    """
+    creates an empty gdal dataset on disk with the projection, geotransform and
+    NoData value of the output already set. Pixel data is written separately,
+    all at once with ``_write_array`` or block by block with its offsets.
+
+    :param outpath:         output filepath
+    :param metadata:        metadata object with the spatial referencing of the output
+    :param xs:              number of columns
+    :param ys:              number of rows
+    :param zs:              number of bands
+    :param numpy_datatype:  numpy datatype string of the output pixels
+    :param NoData_Value:    NoData value to set in the header, or None
+    :param options:         optional list of gdal creation options, such as ["NBITS=1"]
+    :param profile:         ``output_profile`` or profile name, used for the creation
+                            options of GeoTiffs when no options are given
+
+    :return dataset:        a writable gdal.Dataset object
+    """
+
+    outdir = os.path.dirname(outpath)
+    if outdir and not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    ext    = outpath.split(".")[-1].lower()
+    driver = gdal.GetDriverByName(_DRIVERS.get(ext, "GTiff"))
+    use_profile = options is None and driver.ShortName == "GTiff"
+
+    if use_profile:
+        options = _resolve_profile(profile).creation_options(numpy_datatype, xs, ys, zs)
+
+    # gdal has no signed 8 bit type, only a signed byte flag on some drivers
+    if str(numpy_datatype) == "int8":
+        if driver.ShortName not in ["GTiff", "HFA"]:
+            raise ValueError("int8 rasters can only be saved as .tif or .img, not {0}".format(outpath))
+        options = list(options or []) + ["PIXELTYPE=SIGNEDBYTE"]
+
+    # cloud optimized profiles write to a staging file first
+    createpath = outpath
+    if use_profile:
+        createpath, options = _stage_geotiff(outpath, options, profile)
+
+    dataset = driver.Create(createpath, xs, ys, zs, _GDAL_DATATYPES[str(numpy_datatype)],
+                            options or [])
+    if dataset is None:
+        raise Exception("Could not create output raster {0}".format(outpath))
+
+    # llcorner based geotransform, rasters are always saved north up
+    Ymax = metadata.Ymin + ys * metadata.cellHeight
+    dataset.SetGeoTransform((metadata.Xmin, metadata.cellWidth, 0.0,
+                             Ymax, 0.0, -metadata.cellHeight))
+
+    try:
+        wkt = _projection_wkt(metadata.projection)
+    except (AttributeError, TypeError, IndexError):
+        wkt = None
+
+    if not wkt or dataset.SetProjection(wkt) != 0:
+        print("Warning: Unable to define the projection on {0}".format(outpath))
+
+    if NoData_Value is not None:
+        for z in range(zs):
+            dataset.GetRasterBand(z + 1).SetNoDataValue(float(NoData_Value))
+
+    return dataset
+
+
+def _write_array(dataset, numpy_rast, NoData_Value, xoff = 0, yoff = 0):
+    """
+    writes a 2d or 3d (band, y, x) array into an open gdal dataset at an offset.
+    Masked pixels are filled with the NoData_Value as they are written.
+
+    :param dataset:         writable gdal.Dataset object
+    :param numpy_rast:      numpy array or masked array to write
+    :param NoData_Value:    value to write at masked pixels
+    :param xoff:            column offset to write the array at
+    :param yoff:            row offset to write the array at
+    """
+
+    if isinstance(numpy_rast, numpy.ma.core.MaskedArray):
+        if NoData_Value is not None:
+            numpy_rast = numpy_rast.filled(NoData_Value)
+        else:
+            numpy_rast = numpy_rast.data
+
+    if numpy_rast.ndim == 2:
+        numpy_rast = numpy_rast.reshape((1,) + numpy_rast.shape)
+
+    # signed bytes are written bit for bit into the byte band
+    if numpy_rast.dtype == numpy.int8:
+        numpy_rast = numpy_rast.view("uint8")
+
+    for z in range(numpy_rast.shape[0]):
+        dataset.GetRasterBand(z + 1).WriteArray(numpy_rast[z], xoff, yoff)
+    return
+
+
+def _close_dataset(dataset, outpath, stats, profile = None):
+    """
+    flushes and closes a gdal dataset, then applies the statistics policy. Internal
+    overviews are built first, while the dataset is still open, if the output
+    profile asks for them, and cloud optimized outputs are copied from their
+    staging file to outpath.
+
+    :param dataset:     writable gdal.Dataset object
+    :param outpath:     filepath of the dataset
+    :param stats:       "now", "deferred" or "none". see ``from_numpy``
+    :param profile:     ``output_profile`` or profile name the dataset was created with
+    """
+
+    _finish_geotiff(dataset, profile)
+    dataset = None
+    _invalidate(outpath)
+    _apply_stats_policy(outpath, stats)
+    return
+
+
+def _projection_wkt(projection):
+    """
+    returns the well known text of a projection, which may be an
+    arcpy SpatialReference object or already a wkt string
+    """
+
+    if hasattr(projection, "exportToString"):
+        return projection.exportToString().split(";")[0]
+    return projection
@@ -1,32 +1,44 @@
-
 __author__ = 'jwely'
 __all__ = ["gap_fill_interpolate"]
 
-from dnppy import core
-from to_numpy import to_numpy
+from read_metadata import read_metadata, _open_gdal
+from to_numpy import _read_window, _mask_nodata
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from iter_blocks import _block_windows
 from is_rast import is_rast
-import arcpy
-import os
+
+from scipy import ndimage
+from scipy.spatial import cKDTree
+import numpy
+
+# number of gap pixels interpolated at once, bounds memory used by kriging systems
+_CHUNK_SIZE = 16384
+
+# (rows, cols) of the blocks the raster is filled in, not counting their halo
+_BLOCK_SHAPE = (1024, 1024)
 
 
 def gap_fill_interpolate(in_rasterpath, out_rasterpath, model = None,
                          max_cell_dist = None, min_points = None):
     """
-    Fills gaps in raster data by spatial kriging interpolation. This should only
+    Fills gaps in raster data by spatial interpolation. This should only
     be used to fill small gaps in continuous datasets (like a DEM), and in
-    instances where it makes sense. This function creates a feature class
-    layer of points where pixels are not NoData, then performs a "kriging"
-    interpolation on the point data to rebuild a uniform grid with a value
-    at every location, thus filling gaps.
-
-    WARNING: This script is processing intensive and may take a while to run
-    even for modestly sized datasets.
+    instances where it makes sense. The raster is processed one block at a
+    time, each read with a halo as wide as the search radius, so memory use
+    does not grow with the size of the raster. Within a block, NoData pixels
+    are found, and only the valid pixels within ``max_cell_dist`` cells of a
+    gap are gathered into a KD-tree. Each gap pixel is then estimated from its
+    nearest neighbors by ordinary kriging or inverse distance weighting, a chunk
+    of gap pixels at a time, so the cost scales with the area of the gaps, not
+    of the raster. The sill of the kriging variogram is estimated from the
+    points near the gaps of each block. The output keeps the datatype of the
+    input, interpolated values are rounded to fit integer datatypes.
 
     :param in_rasterpath:   input filepath to raster to fill gaps
     :param out_rasterpath:  filepath to store output gap filled raster in
-    :param model:           type of kriging model to run, options include
-                            "SPHERICAL", "CIRCULAR", "EXPONENTIAL",
-                            "GAUSSIAN", and "LINEAR"
+    :param model:           type of interpolation to run. Kriging models include
+                            "SPHERICAL", "CIRCULAR", "EXPONENTIAL", "GAUSSIAN",
+                            and "LINEAR". Use "IDW" for inverse distance weighting.
     :param max_cell_dist:   The maximum number of cells to interpolate between,
                             data gaps which do not have at least "min_points"
                             points within this distance will not be filled.
@@ -49,78 +61,228 @@ def gap_fill_interpolate(in_rasterpath, out_rasterpath, model = None,
     if model is None:
         model = "SPHERICAL"
 
-    # set environments
-    arcpy.env.overwriteOutput = True
-    arcpy.env.snapRaster = in_rasterpath
-    arcpy.CheckOutExtension("Spatial")
-
-
-    # make a point shapefile version of input raster
-    print("Creating point grid from input raster")
-    head, tail = os.path.split(in_rasterpath)
-    shp_path = core.create_outname(head, tail, "shp", "shp")
-    dbf_path = shp_path.replace(".shp",".dbf")
-    field = "GRID_CODE"
-
-    arcpy.RasterToPoint_conversion(in_rasterpath, shp_path, "VALUE")
-
-    # find the bad rows who GRID_CODE is 1, these should be NoData
-    print("Finding points with NoData entries")
-    bad_row_FIDs = []
-
-    rows = arcpy.UpdateCursor(dbf_path)
-
-    for row in rows:
-        grid_code = getattr(row, field)
-        if grid_code == 1:
-            bad_row_FIDs.append(row.FID)
-    del rows
-
-    # go back through the list and perform the deletions
-    numbad = len(bad_row_FIDs)
-    print("Deleting {0} points with NoData values".format(numbad))
-    rows = arcpy.UpdateCursor(dbf_path)
-    for i, row in enumerate(rows):
-        if row.FID in bad_row_FIDs:
-            rows.deleteRow(row)
-
-    # set up the parameters for kriging
-    print("Setting up for kriging")
-
-    _, meta = to_numpy(in_rasterpath)
-
-    model       = model
-    cell_size   = meta.cellHeight                           # from input raster
-    lagSize     = None
-    majorRange  = None
-    partialSill = None
-    nugget      = None
-    distance    = float(cell_size) * float(max_cell_dist)   # fn input
-    min_points  = min_points                                # fn input
-
-    a = arcpy.sa.KrigingModelOrdinary()
-    kmodel = arcpy.sa.KrigingModelOrdinary("SPHERICAL",
-                                           lagSize = lagSize,
-                                           majorRange = majorRange,
-                                           partialSill = partialSill,
-                                           nugget = nugget)
-
-    kradius = arcpy.sa.RadiusFixed(distance = distance,
-                                   minNumberOfPoints = min_points)
-
-    # execute kriging
-    print("Performing interpolation by kriging, this may take a while!")
-    outkriging = arcpy.sa.Kriging(shp_path, field, kmodel,
-                                  cell_size = cell_size,
-                                  search_radius = kradius)
-    outkriging.save(out_rasterpath)
+    model = model.upper()
+    if model != "IDW" and model not in _VARIOGRAMS:
+        raise ValueError("unknown interpolation model '{0}'".format(model))
+
+    meta    = read_metadata(in_rasterpath, cache = False)
+    dataset = _open_gdal(in_rasterpath)
+    native  = dataset.GetRasterBand(1).GetBlockSize()
+    dtype   = meta.numpy_datatype
+    xs, ys  = meta.Xsize, meta.Ysize
+
+    # the search radius in map units, and the halo of cells it spans around each block
+    radius = float(meta.cellHeight) * float(max_cell_dist)
+    halo_x = int(numpy.ceil(radius / float(meta.cellWidth)))
+    halo_y = int(numpy.ceil(max_cell_dist))
+
+    out_dataset = _create_dataset(out_rasterpath, meta, xs, ys, 1, dtype, meta.NoData_Value)
+
+    print("Interpolating gaps from data within {0} cells with model {1}".format(
+        max_cell_dist, model))
 
+    num_gaps   = 0
+    num_filled = 0
+
+    for xoff, yoff, xsize, ysize in _block_windows(xs, ys, native, _BLOCK_SHAPE):
+
+        x0, y0 = max(0, xoff - halo_x), max(0, yoff - halo_y)
+        x1, y1 = min(xs, xoff + xsize + halo_x), min(ys, yoff + ysize + halo_y)
+
+        block = _read_window(dataset, (x0, y0, x1 - x0, y1 - y0), dtype, cache = False)
+        block = _mask_nodata(block, meta.NoData_Value, dtype)
+        core  = (slice(yoff - y0, yoff - y0 + ysize), slice(xoff - x0, xoff - x0 + xsize))
+
+        filled, still_gaps, block_gaps = _fill_block(numpy.ma.getdata(block),
+                                                     numpy.ma.getmaskarray(block), core,
+                                                     meta, model, radius, max_cell_dist,
+                                                     min_points)
+
+        num_gaps   += block_gaps
+        num_filled += block_gaps - int(still_gaps.sum())
+
+        _write_array(out_dataset, numpy.ma.masked_array(filled, still_gaps),
+                     meta.NoData_Value, xoff, yoff)
+
+    dataset = None
+    _close_dataset(out_dataset, out_rasterpath, stats = "now")
+
+    print("Filled {0} of {1} gap pixels".format(num_filled, num_gaps))
     return out_rasterpath
 
 
+def _fill_block(values, gaps, core, meta, model, radius, max_cell_dist, min_points):
+    """
+    interpolates the gaps in the core of a block, from the valid pixels of
+    the block and its halo.
+
+    :param values:          2d array of the block and its halo, in the raster datatype
+    :param gaps:            2d boolean array, True at NoData pixels of ``values``
+    :param core:            (rows, cols) tuple of slices locating the core in ``values``
+    :param meta:            metadata of the raster, for its cell sizes
+    :param model:           interpolation model name, see ``gap_fill_interpolate``
+    :param radius:          search radius in map units
+    :param max_cell_dist:   search radius in cells
+    :param min_points:      minimum number of neighbors needed to fill a gap
+
+    :return filled:         core sized array of values with gaps filled, in the raster datatype
+    :return still_gaps:     core sized boolean array, True where gaps could not be filled
+    :return num_gaps:       number of gap pixels in the core
+    """
+
+    rows, cols = core
+    filled     = values[core].copy()
+    still_gaps = gaps[core].copy()
+
+    gap_y, gap_x = numpy.nonzero(still_gaps)
+    if len(gap_y) == 0:
+        return filled, still_gaps, 0
+
+    # find the valid pixels close enough to a gap to take part in filling it
+    dist_to_gap = ndimage.distance_transform_edt(~gaps)
+    halo = ~gaps & (dist_to_gap <= max_cell_dist)
+    halo_y, halo_x = numpy.nonzero(halo)
+
+    if len(halo_y) < min_points:
+        return filled, still_gaps, len(gap_y)
+
+    # coordinates in map units, so non square cells are handled properly
+    halo_xy   = numpy.column_stack((halo_x * meta.cellWidth, halo_y * meta.cellHeight))
+    halo_vals = values[halo_y, halo_x].astype("float64")
+    tree      = cKDTree(halo_xy)
+
+    k         = min(max(min_points, 12), len(halo_y))
+    sill      = numpy.var(halo_vals)
+
+    for start in range(0, len(gap_y), _CHUNK_SIZE):
+        gy = gap_y[start:start + _CHUNK_SIZE]
+        gx = gap_x[start:start + _CHUNK_SIZE]
+        gap_xy = numpy.column_stack(((gx + cols.start) * meta.cellWidth,
+                                     (gy + rows.start) * meta.cellHeight))
+
+        dists, index = tree.query(gap_xy, k = k, distance_upper_bound = radius)
+        dists = dists.reshape((len(gy), k))
+        index = index.reshape((len(gy), k))
+
+        found = numpy.isfinite(dists)
+        ok    = found.sum(axis = 1) >= min_points
+        if not ok.any():
+            continue
+
+        dists, index, found = dists[ok], index[ok], found[ok]
+        index[~found] = 0           # placeholder, these neighbors get zero weight
+
+        if model == "IDW" or sill == 0:
+            estimates = _idw(dists, halo_vals[index], found)
+        else:
+            estimates = _ordinary_kriging(halo_xy[index], gap_xy[ok], halo_vals[index],
+                                          found, _VARIOGRAMS[model], sill, radius)
+
+        # integer rasters get estimates rounded to the nearest value they can hold
+        if filled.dtype.kind in "iu":
+            limits    = numpy.iinfo(filled.dtype)
+            estimates = numpy.clip(numpy.round(estimates), limits.min, limits.max)
+
+        filled[gy[ok], gx[ok]] = estimates
+        still_gaps[gy[ok], gx[ok]] = False
+
+    return filled, still_gaps, len(gap_y)
+
+
+def _idw(dists, neighbor_vals, found, power = 2):
+    """
+    inverse distance weighted estimates
+
+    :param dists:           (n, k) distances to neighbors
+    :param neighbor_vals:   (n, k) values at neighbors
+    :param found:           (n, k) boolean, False for missing neighbors
+    :param power:           power of the inverse distance weights
+
+    :return estimates:      (n,) array of estimates
+    """
+
+    weights = numpy.zeros(dists.shape)
+    weights[found] = 1.0 / (dists[found] ** power)
+    return (weights * neighbor_vals).sum(axis = 1) / weights.sum(axis = 1)
+
+
+def _ordinary_kriging(neighbor_xy, target_xy, neighbor_vals, found, variogram, sill, radius):
+    """
+    ordinary kriging estimates for a batch of target points, solving one small
+    kriging system per target point all at once. Missing neighbors get rows of
+    the identity so their weights are forced to zero.
+
+    :param neighbor_xy:     (n, k, 2) coordinates of neighbors
+    :param target_xy:       (n, 2) coordinates of the points to estimate
+    :param neighbor_vals:   (n, k) values at neighbors
+    :param found:           (n, k) boolean, False for missing neighbors
+    :param variogram:       function of (lag, sill, range) returning semivariance
+    :param sill:            sill of the variogram
+    :param radius:          range of the variogram
+
+    :return estimates:      (n,) array of estimates
+    """
+
+    n, k = found.shape
+
+    lags = numpy.sqrt(((neighbor_xy[:, :, None, :] - neighbor_xy[:, None, :, :]) ** 2).sum(axis = 3))
+    target_lags = numpy.sqrt(((neighbor_xy - target_xy[:, None, :]) ** 2).sum(axis = 2))
+
+    pair_found = found[:, :, None] & found[:, None, :]
+
+    A = numpy.zeros((n, k + 1, k + 1))
+    A[:, :k, :k] = numpy.where(pair_found, variogram(lags, sill, radius), 0.0)
+    A[:, :k, k] = found
+    A[:, k, :k] = found
+
+    # missing neighbors are decoupled from the system with a unit diagonal
+    diag = numpy.arange(k)
+    A[:, diag, diag] = numpy.where(found, 0.0, 1.0)
+
+    b = numpy.zeros((n, k + 1))
+    b[:, :k] = numpy.where(found, variogram(target_lags, sill, radius), 0.0)
+    b[:, k] = 1.0
+
+    try:
+        weights = numpy.linalg.solve(A, b[:, :, None])[:, :k, 0]
+    except numpy.linalg.LinAlgError:
+        return _idw(target_lags, neighbor_vals, found)
+
+    return (weights * neighbor_vals).sum(axis = 1)
+
+
+def _spherical(h, sill, a):
+    r = numpy.minimum(h / a, 1.0)
+    return sill * (1.5 * r - 0.5 * r ** 3)
+
+
+def _circular(h, sill, a):
+    r = numpy.minimum(h / a, 1.0)
+    return sill * (1 - (2 / numpy.pi) * numpy.arccos(r) + (2 / numpy.pi) * r * numpy.sqrt(1 - r ** 2))
+
+
+def _exponential(h, sill, a):
+    return sill * (1 - numpy.exp(-3.0 * h / a))
+
+
+def _gaussian(h, sill, a):
+    return sill * (1 - numpy.exp(-3.0 * (h / a) ** 2))
+
+
+def _linear(h, sill, a):
+    return sill * numpy.minimum(h / a, 1.0)
+
+
+_VARIOGRAMS = {"SPHERICAL":     _spherical,
+               "CIRCULAR":      _circular,
+               "EXPONENTIAL":   _exponential,
+               "GAUSSIAN":      _gaussian,
+               "LINEAR":        _linear}
+
+
 # testing area
 if __name__ == "__main__":
 
     inraster  = r"C:\Users\jwely\Desktop\Team_Projects\2015_sumer_CO_water\LiDAR_Format_Trial\mosaic\test_mosaic_gaps.tif"
     outraster = r"C:\Users\jwely\Desktop\Team_Projects\2015_sumer_CO_water\LiDAR_Format_Trial\mosaic\test_mosaic_filled.tif"
-    gap_fill_interpolate(inraster, outraster)
\ No newline at end of file
+    gap_fill_interpolate(inraster, outraster)
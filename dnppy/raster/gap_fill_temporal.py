@@ -2,25 +2,43 @@ __author__ = ["jwely", "djjensen"]
 __all__ = ["gap_fill_temporal"]
 
 import os
+import numpy
 
 from dnppy import core
 from enf_rastlist import *
 from to_numpy import *
 from from_numpy import *
-from raster_fig import *
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from build_stats import *
+from iter_blocks import *
+from read_metadata import *
+from progress import log_progress
+
+# age value given to pixels that have never had good data
+AGE_NODATA = 65535
+
+# most time steps whose outputs are held open at once when filling block by block
+_MAX_OPEN_STEPS = 32
 
 
 def gap_fill_temporal(rasterlist, outdir = None, continuous = True,
-                      NoData_Value = None, numpy_datatype = "float32"):
+                      NoData_Value = None, numpy_datatype = "float32", block_shape = None,
+                      progress = None, save_ages = False):
     """
     This function is designed to input a time sequence of rasters with partial voids and
     output a copy of each input image with every pixel equal to the last good value taken.
     This function will step forward in time through each raster and fill voids from the values
     of previous rasters. The resulting output image will contain all the data that was in the
-    original image, with the voids filled with older data. A second output image will be
-    generated where the pixel values are equal to the age of each pixel in the image. So
-    if a void was filled with data that's 5 days old, the "age" raster will have a value of
-    "5" at that location.
+    original image, with the voids filled with older data. If ``save_ages`` is True, a second
+    output image will be generated where the pixel values are equal to the age of each pixel
+    in the image. So if a void was filled with data that's 5 days old, the "age" raster will
+    have a value of "5" at that location. Ages are counted in time steps (rasters) of the input
+    series, and saved as 16 bit unsigned integers, with 65535 marking pixels that have never
+    had data.
+
+    Only a single array of last good values and a single array of ages are carried from one
+    time step to the next, so each step costs one read of the input and one write of each
+    output.
 
     :param rasterlist:      A list of filepaths for rasters with which to fill gaps. THESE IMAGES
                             MUST BE ORDERED FROM OLDEST TO NEWEST (ascending time).
@@ -33,53 +51,226 @@ def gap_fill_temporal(rasterlist, outdir = None, continuous = True,
                             output raster 2, which might contain some fill values from raster 1, and so
                             forth. If "False" an output raster will only be generated for the LAST raster
                             in the input rasterlist.
+    :param NoData_Value:    NoData value of the gap filled outputs. defaults to that of the inputs.
     :param numpy_datatype:  the numpy datatype of the output raster. usually "float32"
+    :param block_shape:     optional (rows, cols) block size. If given, the whole series is
+                            processed one block at a time instead of one full raster at a time,
+                            which bounds memory for very large rasters. Outputs are written in
+                            batches of at most 32 time steps, each batch resuming from the last
+                            outputs of the one before it, so only a few files are open at once.
+    :param progress:        progress sink to report to, such as ``raster.preview_progress()``
+                            to display the gap filled rasters as they are made. Defaults
+                            to ``raster.log_progress()``. see ``raster.progress``
+    :param save_ages:       set True to also save an "age" raster next to every gap filled output.
 
-    :return output_filelist: returns a list of filepaths to new files created by this function.
+    :return output_filelist: returns a list of filepaths to the gap filled ("gft") rasters.
+                             If ``save_ages`` is True, a tuple of the gft list and a list of
+                             filepaths to the matching "age" rasters is returned instead.
     """
 
     # enforce the list of rasters to ensure it's sanitized
     rasterlist = enf_rastlist(rasterlist)
 
-    # create an empty list to store output arrays in
-    output_filelist = []
+    # find which time steps to save, and where
+    saved_steps = []
+    for i, araster in enumerate(rasterlist[1:]):
+        if continuous is True or i == (len(rasterlist[1:]) - 1):
+
+            if outdir is None:
+                this_outdir = os.path.dirname(araster)
+            else:
+                this_outdir = outdir
+
+            gft_path = core.create_outname(this_outdir, araster, "gft", "tif")
+            if save_ages:
+                age_path = core.create_outname(this_outdir, araster, "age", "tif")
+            else:
+                age_path = None
+            saved_steps.append((i + 1, gft_path, age_path))
+
+    if progress is None:
+        progress = log_progress()
+
+    if block_shape is None:
+        _fill_rasters(rasterlist, saved_steps, NoData_Value, numpy_datatype, progress)
+    else:
+        for start in range(0, len(saved_steps), _MAX_OPEN_STEPS):
+            _fill_blocks(rasterlist, saved_steps, start, NoData_Value,
+                         numpy_datatype, block_shape, progress)
+
+    output_filelist = [gft_path for step, gft_path, age_path in saved_steps]
+    age_filelist    = [age_path for step, gft_path, age_path in saved_steps if age_path]
+
+    build_stats(output_filelist + age_filelist)
+    progress.finish()
+
+    if save_ages:
+        return output_filelist, age_filelist
+    else:
+        return output_filelist
+
+
+def _fill_rasters(rasterlist, saved_steps, NoData_Value, numpy_datatype, progress):
+    """ steps through the time series one full raster at a time """
+
+    saved = dict((step, (gft, age)) for step, gft, age in saved_steps)
 
     # grab the first raster, then start stepping through the list
-    old_rast, old_meta = to_numpy(rasterlist[0])
-    rastfig = raster_fig(old_rast)
+    first, meta = to_numpy(rasterlist[0], numpy_datatype, cache = False)
+    last, age, have = _init_state(first, numpy_datatype)
 
     for i, araster in enumerate(rasterlist[1:]):
+        step = i + 1
 
-        new_rast, new_meta = to_numpy(araster)
-
-        # combine new and old data and mask matrices
-        outrast = new_rast
-        outrast.data[new_rast.mask] = old_rast.data[new_rast.mask]
-        outrast.mask[new_rast.mask] = old_rast.mask[new_rast.mask]
+        new_rast, new_meta = to_numpy(araster, numpy_datatype, cache = False)
+        _fill_step(last, age, have, new_rast)
+        progress.update("fill", pixels = new_rast.size, bytes_read = new_rast.nbytes)
 
         # only save output if continuous is true or is last raster in series
-        if continuous is True or i == (len(rasterlist[1:]) - 1):
+        if step in saved:
+            gft_path, age_path = saved[step]
 
-            # create output name and save it
-            if outdir is None:
-                this_outdir = os.path.dirname(araster)
+            if NoData_Value is None:
+                out_NoData = new_meta.NoData_Value
             else:
-                this_outdir = outdir
+                out_NoData = NoData_Value
+
+            out_meta = new_meta
+            out_meta.numpy_datatype = numpy_datatype
+            from_numpy(numpy.ma.masked_array(last, ~have), out_meta, gft_path,
+                       out_NoData, stats = "deferred")
+            progress.update("write", files = 1, pixels = last.size,
+                            bytes_written = last.nbytes, preview = last)
 
-            # update the figure
-            rastfig.update_fig(outrast)
+            if age_path is not None:
+                age_meta = read_metadata(araster, cache = False)
+                age_meta.numpy_datatype = "uint16"
+                from_numpy(numpy.ma.masked_array(age, ~have), age_meta, age_path,
+                           AGE_NODATA, stats = "deferred")
+                progress.update("write", files = 1, pixels = age.size,
+                                bytes_written = age.nbytes)
 
-            outpath = core.create_outname(this_outdir, araster, "gft", "tif")
             print("Filled gaps in {0}".format(os.path.basename(araster)))
-            outrast = outrast.astype(numpy_datatype)
-            from_numpy(outrast, new_meta, outpath, NoData_Value)
-            output_filelist.append(outpath)
 
-        # prepare for next time step by setting current to old
-        old_rast = new_rast
+    return
+
+
+def _fill_blocks(rasterlist, saved_steps, start, NoData_Value, numpy_datatype, block_shape,
+                 progress):
+    """
+    steps through one batch of the time series one block at a time. The batch writes the
+    outputs of ``saved_steps[start:start + _MAX_OPEN_STEPS]``, and resumes from the outputs
+    of the step saved just before it, so that no more than one batch of outputs is open.
+    """
+
+    batch = saved_steps[start:start + _MAX_OPEN_STEPS]
+    datasets = {}
+
+    # create every output of this batch up front, so blocks can be written as they are filled
+    for step, gft_path, age_path in batch:
+        meta = read_metadata(rasterlist[step], cache = False)
+
+        if NoData_Value is None:
+            out_NoData = meta.NoData_Value
+        else:
+            out_NoData = NoData_Value
+
+        gft = _create_dataset(gft_path, meta, meta.Xsize, meta.Ysize, 1,
+                              numpy_datatype, out_NoData)
+        if age_path is not None:
+            age = _create_dataset(age_path, meta, meta.Xsize, meta.Ysize, 1,
+                                  "uint16", AGE_NODATA)
+        else:
+            age = None
+        datasets[step] = (gft, age, out_NoData)
+
+    # the first batch starts from the first raster, later ones from the previous outputs
+    if start == 0:
+        first_step = 0
+        resume     = [rasterlist[0]]
+    else:
+        first_step, gft_path, age_path = saved_steps[start - 1]
+        resume     = [gft_path] + ([age_path] if age_path else [])
+
+    last_step = batch[-1][0]
+    inputs    = resume + rasterlist[first_step + 1:last_step + 1]
+
+    for blocks, metas in iter_blocks(inputs, block_shape, numpy_datatype, cache = False):
+        xoff, yoff = metas[0].window[:2]
+
+        last, age, have = _init_state(blocks[0], numpy_datatype)
+        if len(resume) == 2:
+            age[have] = numpy.ma.getdata(blocks[1])[have]
+
+        for step, block in enumerate(blocks[len(resume):], first_step + 1):
+            _fill_step(last, age, have, block)
+            progress.update("fill", files = 0, pixels = block.size, bytes_read = block.nbytes)
+
+            if step in datasets:
+                gft_dataset, age_dataset, out_NoData = datasets[step]
+                _write_array(gft_dataset, numpy.ma.masked_array(last, ~have),
+                             out_NoData, xoff, yoff)
+                progress.update("write", files = 0, pixels = last.size,
+                                bytes_written = last.nbytes)
+
+                if age_dataset is not None:
+                    _write_array(age_dataset, numpy.ma.masked_array(age, ~have),
+                                 AGE_NODATA, xoff, yoff)
+                    progress.update("write", files = 0, pixels = age.size,
+                                    bytes_written = age.nbytes)
+
+    # each input of the batch is counted once, after all of its blocks are filled
+    progress.update("fill", files = last_step - first_step)
+
+    for step, gft_path, age_path in batch:
+        gft_dataset, age_dataset, _ = datasets.pop(step)
+        _close_dataset(gft_dataset, gft_path, stats = "deferred")
+        progress.update("write", files = 1)
+
+        if age_dataset is not None:
+            _close_dataset(age_dataset, age_path, stats = "deferred")
+            progress.update("write", files = 1)
+
+        print("Filled gaps in {0}".format(os.path.basename(rasterlist[step])))
+
+    return
+
+
+def _init_state(first, numpy_datatype):
+    """
+    builds the state carried through the time series from the first raster
+
+    :param first:       masked array of the first raster in the series
+    :return last:       array of last good values
+    :return age:        uint16 array of time steps since the last good value
+    :return have:       boolean array, True where a good value has been seen
+    """
+
+    have = ~numpy.ma.getmaskarray(first)
+    last = numpy.array(numpy.ma.getdata(first), dtype = numpy_datatype)
+    age  = numpy.zeros(first.shape, dtype = "uint16")
+    return last, age, have
+
+
+def _fill_step(last, age, have, new_rast):
+    """
+    updates the gap filling state in place with the next raster in the series
+
+    :param last:        array of last good values
+    :param age:         uint16 array of time steps since the last good value
+    :param have:        boolean array, True where a good value has been seen
+    :param new_rast:    masked array of the next raster in the series
+    """
+
+    good = ~numpy.ma.getmaskarray(new_rast)
 
-    return output_filelist
+    # stale pixels age by one step, (capped to stay below the NoData value)
+    numpy.add(age, 1, out = age, where = ~good & (age < AGE_NODATA - 1))
+    age[good] = 0
 
+    numpy.copyto(last, numpy.ma.getdata(new_rast), where = good)
+    have |= good
+    return
 
 
 if __name__ == "__main__":
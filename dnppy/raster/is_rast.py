@@ -10,8 +10,8 @@ def is_rast(filename):
     :return <bool>: returns True if filename is valid accessible raster. False otherwise.
     """
 
-    rast_types=['bil','bip','bmp','bsq','dat','gif','img','jpg','jp2','png','tif',
-                'BIL','BIP','BMP','BSQ','DAT','GIF','IMG','JPG','JP2','PNG','TIF']
+    rast_types=['bil','bip','bmp','bsq','dat','gif','img','jpg','jp2','png','tif','vrt',
+                'BIL','BIP','BMP','BSQ','DAT','GIF','IMG','JPG','JP2','PNG','TIF','VRT']
     ext = filename[-3:]
 
     if os.path.isfile(filename):
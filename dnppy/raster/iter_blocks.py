@@ -0,0 +1,117 @@
+__author__ = "jwely"
+__all__ = ["iter_blocks"]
+
+from read_metadata import read_metadata, _open_gdal
+from to_numpy import _read_window, _mask_nodata
+from block_cache import _MIN_BLOCK_PIXELS
+
+
+def iter_blocks(rasters, block_shape = None, numpy_datatype = None, mask_mode = "bool",
+                cache = True):
+    """
+    Steps through a raster one block at a time, so that whole scenes and
+    mosaics may be processed in bounded memory.
+
+    Blocks are aligned to the native tiling (or strips) of the file, so every
+    read touches only whole blocks on disk. Each block is yielded as a masked
+    numpy array, just like ``to_numpy``, along with a metadata object whose
+    extents and geotransform are offset to that block, and whose ``window``
+    attribute holds the ``(xoff, yoff, xsize, ysize)`` pixel window of the block.
+
+    :param rasters:         filepath to a raster, or a list of filepaths to rasters
+                            with identical dimensions. When a list is given, a list
+                            of co-located blocks (one per raster) is yielded for
+                            each window, tiled according to the first raster.
+    :param block_shape:     optional (rows, cols) size of blocks to read. It is
+                            rounded up to a whole number of native blocks. By
+                            default, the native block size of the file is used,
+                            with small blocks (like single row strips) grouped
+                            into blocks of at least 65536 pixels.
+    :param numpy_datatype:  numpy datatype of the output blocks, defaults to the
+                            datatype of each raster. see ``to_numpy``
+    :param mask_mode:       "bool", "sentinel" or "nan", how NoData is represented in
+                            the output blocks. see ``to_numpy``
+    :param cache:           set False to read every block straight from disk, for
+                            single pass readers. see ``to_numpy``
+
+    :return generator:      yields ``(block, meta)`` tuples, or ``(blocks, metas)``
+                            tuples of lists when ``rasters`` is a list.
+
+    Example usage
+
+    .. code-block:: python
+
+        for block, meta in raster.iter_blocks(my_raster):
+            print(meta.window, block.mean())
+    """
+
+    if isinstance(rasters, list):
+        paths  = rasters
+    else:
+        paths  = [rasters]
+
+    datasets = [_open_gdal(path) for path in paths]
+    metas    = []
+
+    for path in paths:
+        meta = read_metadata(path, cache)
+        metas.append(meta)
+
+        if (meta.Xsize, meta.Ysize) != (metas[0].Xsize, metas[0].Ysize):
+            raise Exception("'{0}' does not have the same dimensions as '{1}'".format(
+                path, paths[0]))
+
+    native_block = datasets[0].GetRasterBand(1).GetBlockSize()
+
+    for window in _block_windows(metas[0].Xsize, metas[0].Ysize, native_block, block_shape):
+
+        blocks      = []
+        block_metas = []
+
+        for dataset, meta in zip(datasets, metas):
+            if numpy_datatype is None:
+                dtype = meta.numpy_datatype
+            else:
+                dtype = numpy_datatype
+
+            block = _read_window(dataset, window, dtype, cache)
+            blocks.append(_mask_nodata(block, meta.NoData_Value, dtype, mask_mode))
+            block_metas.append(meta.offset_window(*window))
+
+        if isinstance(rasters, list):
+            yield blocks, block_metas
+        else:
+            yield blocks[0], block_metas[0]
+
+    datasets = None
+
+
+def _block_windows(xs, ys, native_block, block_shape = None):
+    """
+    generates (xoff, yoff, xsize, ysize) windows that tile a raster, aligned
+    to its native block size. Edge windows are trimmed to the raster extent.
+
+    :param xs:              number of columns in the raster
+    :param ys:              number of rows in the raster
+    :param native_block:    (xsize, ysize) of the native blocks, as returned by
+                            gdal.Band.GetBlockSize()
+    :param block_shape:     optional (rows, cols) desired block size. Without it,
+                            small native blocks are grouped into taller windows
+                            so each read covers at least _MIN_BLOCK_PIXELS pixels.
+
+    :return generator:      yields window tuples
+    """
+
+    bx, by = native_block
+
+    if block_shape is not None:
+        rows, cols = block_shape
+        by = max(1, -(-int(rows) // by)) * by
+        bx = max(1, -(-int(cols) // bx)) * bx
+
+    elif bx * by < _MIN_BLOCK_PIXELS:
+        by *= -(-_MIN_BLOCK_PIXELS // (bx * by))
+
+    for yoff in range(0, ys, by):
+        for xoff in range(0, xs, bx):
+            yield (xoff, yoff, min(bx, xs - xoff), min(by, ys - yoff))
@@ -5,28 +5,51 @@ from dnppy import core
 from enf_rastlist import enf_rastlist
 from to_numpy import to_numpy
 from from_numpy import from_numpy
-from raster_fig import raster_fig
+from read_metadata import read_metadata
+from progress import log_progress
 
 # other imports
+import multiprocessing
 import numpy
 import os
 
-# FIXME: this function has an outstanding bug report against it. check issues
 
 def many_stats(rasterlist, outdir, outname, saves = None, low_thresh = None,
-                    high_thresh = None, numtype = 'float32', NoData_Value = -9999):
+                    high_thresh = None, numtype = 'float32', NoData_Value = -9999,
+                    workers = None, progress = None):
     """
     Take statistics across many input rasters. This function is used to take
     statistics on large groups of rasters with identical spatial extents.
 
+    Statistics are accumulated in a single streaming pass over the input rasters,
+    so each input is read exactly once and memory use depends only on the size
+    of one raster, no matter how many rasters are in the stack. Running float64
+    accumulators are used (Welford's method for the mean and standard deviation,
+    and Kahan compensated summation for the sum) so precision holds up over
+    thousands of inputs.
+
+    With ``workers`` greater than 1, the output grid is split into strips of rows,
+    and each strip is reduced over the entire rasterlist by its own process.
+    The strips are then stitched back together into the full outputs. On windows,
+    scripts calling this with multiple workers must be guarded by
+    ``if __name__ == "__main__":``.
+
     :param rasterlist:      list of raster filepaths for which to take statistics
     :param outdir:          directory where output should be stored.
     :param outname:         output name filename string that will be used in output filenames
     :param saves:           which statistics to save in a raster. Defaults to all
-                            three ['AVG','NUM','STD'].
+                            four ['AVG','NUM','STD','SUM']. 'MIN' and 'MAX' are also
+                            available.
     :param low_thresh:      values below low_thresh are assumed erroneous and set to NoData
     :param high_thresh:     values above high_thresh are assumed erroneous and set to NoData.
     :param numtype:         type of numerical value. defaults to 32bit float.
+    :param NoData_Value:    NoData value of the outputs. Pixels without a single good value
+                            are NoData in every output except NUM and SUM, where they are 0.
+    :param workers:         number of processes to split the work between. Leave None to
+                            process the whole stack in this process.
+    :param progress:        progress sink to report to, such as ``raster.preview_progress()``
+                            to display the rasters as they are read. Defaults to
+                            ``raster.log_progress()``. see ``raster.progress``
 
     This function does not return anything.
     """
@@ -35,99 +58,242 @@ def many_stats(rasterlist, outdir, outname, saves = None, low_thresh = None,
         saves = ['AVG','NUM','STD','SUM']
     if not os.path.isdir(outdir):
         os.makedirs(outdir)
-    
+
     rasterlist = enf_rastlist(rasterlist)
 
-    # build the empty numpy array based on size of first raster
-    temp_rast, metadata = to_numpy(rasterlist[0])
-    xs, ys              = temp_rast.shape
-    zs                  = len(rasterlist)
-    rast_3d             = numpy.zeros((xs,ys,zs))
-
-    metadata.NoData_Value = numpy.nan
-
-    # open up the initial figure
-    rastfig = raster_fig(temp_rast)
-
-    # populate the 3d matrix with values from all rasters
-    for i, raster in enumerate(rasterlist):
-
-        # print a status and open a figure
-        print('working on file {0}'.format(os.path.basename(raster)))
-        new_rast, new_meta  = to_numpy(raster, numtype)
-
-        new_rast = new_rast.data
-
-        if not new_rast.shape == (xs, ys):
-            print new_rast.shape
-
-        # set rasters to have 'nan' NoData_Value
-        if new_meta.NoData_Value != metadata.NoData_Value:
-            new_rast[new_rast == new_meta.NoData_Value] = metadata.NoData_Value
-            
-        # set values outside thresholds to nodata values
-        if not low_thresh is None:
-            new_rast[new_rast < low_thresh] = metadata.NoData_Value
-        if not high_thresh is None:
-            new_rast[new_rast > high_thresh] = metadata.NoData_Value
-
-        new_rast = numpy.ma.masked_array(new_rast, numpy.isnan(new_rast))
-
-        # display a figure
-        rastfig.update_fig(new_rast)
-
-        rast_3d[:,:,i] = new_rast
-
-    # build up our statistics by masking nan values and performing matrix operations
-    rastfig.close_fig()
-    rast_3d_masked  = numpy.ma.masked_array(rast_3d, numpy.isnan(rast_3d))
-
-    if "AVG" in saves:
-        avg_rast        = numpy.mean(rast_3d_masked, axis = 2)
-        avg_rast        = numpy.array(avg_rast)
-        rastfig         = raster_fig(avg_rast, title = "Average")
-
-        avg_name = core.create_outname(outdir, outname, 'AVG', 'tif')
-        print("Saving AVERAGE output raster as {0}".format(avg_name))
-        from_numpy(avg_rast, metadata, avg_name, NoData_Value = NoData_Value)
-        rastfig.close_fig()
-        del avg_rast
-
-    if "STD" in saves:
-        std_rast        = numpy.std(rast_3d_masked, axis = 2)
-        std_rast        = numpy.array(std_rast)
-        rastfig         = raster_fig(std_rast, title = "Standard Deviation")
-
-        std_name = core.create_outname(outdir, outname, 'STD', 'tif')
-        print("Saving STANDARD DEVIATION output raster as {0}".format(std_name))
-        from_numpy(std_rast, metadata, std_name, NoData_Value = NoData_Value)
-        rastfig.close_fig()
-        del std_rast
-        
-    if "NUM" in saves:
-        num_rast        = (numpy.zeros((xs,ys)) + zs) - numpy.sum(rast_3d_masked.mask, axis = 2)
-        num_rast        = numpy.array(num_rast)
-        rastfig         = raster_fig(num_rast, title =  "Good pixel count (NUM)")
-        rastfig.close_fig()
-
-        num_name = core.create_outname(outdir, outname, 'NUM', 'tif')
-        print("Saving NUMBER output raster as {0}".format(num_name))
-        from_numpy(num_rast, metadata, num_name, NoData_Value = NoData_Value)
-        rastfig.close_fig()
-        del num_rast
-
-    if "SUM" in saves:
-        sum_rast        = numpy.sum(rast_3d_masked, axis = 2)
-        sum_rast        = numpy.array(sum_rast)
-        rastfig         = raster_fig(sum_rast, title = "Sum Total")
-        rastfig.close_fig()
-
-        sum_name = core.create_outname(outdir, outname, 'SUM', 'tif')
-        print("Saving SUM output raster as {0}".format(sum_name))
-        from_numpy(sum_rast, metadata, sum_name, NoData_Value = NoData_Value)
-        rastfig.close_fig()
-        del sum_rast
-                   
-    rastfig.close_fig()
+    if progress is None:
+        progress = log_progress()
+
+    if workers is not None and workers > 1:
+        outputs, meta = _parallel_stats(rasterlist, saves, low_thresh, high_thresh,
+                                        numtype, NoData_Value, workers, progress)
+    else:
+        # reduce the entire stack of rasters into running statistics
+        stats, meta = _reduce_stack(rasterlist, numtype, low_thresh, high_thresh,
+                                    progress = progress)
+        outputs = _finalize_stats(stats, saves, NoData_Value)
+
+    meta.NoData_Value   = NoData_Value
+    meta.numpy_datatype = numtype
 
+    names = {"AVG": "AVERAGE",
+             "STD": "STANDARD DEVIATION",
+             "NUM": "NUMBER",
+             "SUM": "SUM",
+             "MIN": "MINIMUM",
+             "MAX": "MAXIMUM"}
+
+    for save in saves:
+        out_rast = outputs[save]
+
+        out_name = core.create_outname(outdir, outname, save, 'tif')
+        print("Saving {0} output raster as {1}".format(names[save], out_name))
+        from_numpy(out_rast, meta, out_name, NoData_Value = NoData_Value)
+        progress.update("write", pixels = out_rast.size,
+                        bytes_written = out_rast.size * numpy.dtype(numtype).itemsize,
+                        preview = out_rast)
+
+    progress.finish()
     return
+
+
+class _running_stats():
+    """
+    Float64 running accumulators for per pixel statistics over a stack of rasters.
+    Every update touches one raster sized slice, so memory is O(xs*ys).
+
+    :param shape:   (rows, cols) shape of the rasters being accumulated
+    """
+
+    def __init__(self, shape):
+
+        self.num  = numpy.zeros(shape, dtype = "int32")     # count of good values
+        self.mean = numpy.zeros(shape, dtype = "float64")   # welford running mean
+        self.m2   = numpy.zeros(shape, dtype = "float64")   # welford sum of squared deviations
+        self.sum  = numpy.zeros(shape, dtype = "float64")   # kahan running sum
+        self.comp = numpy.zeros(shape, dtype = "float64")   # kahan compensation term
+        self.min  = numpy.full(shape, numpy.inf, dtype = "float64")
+        self.max  = numpy.full(shape, -numpy.inf, dtype = "float64")
+
+
+    def update(self, values, valid):
+        """
+        adds one raster worth of values to the accumulators
+
+        :param values:  float64 array of values
+        :param valid:   boolean array, True where values should be counted
+        """
+
+        numpy.add(self.num, 1, out = self.num, where = valid)
+
+        # kahan compensated sum
+        y = values - self.comp
+        t = self.sum + y
+        numpy.copyto(self.comp, (t - self.sum) - y, where = valid)
+        numpy.copyto(self.sum, t, where = valid)
+
+        # welford mean and sum of squared deviations
+        delta = values - self.mean
+        numpy.add(self.mean, delta / numpy.maximum(self.num, 1), out = self.mean, where = valid)
+        numpy.add(self.m2, delta * (values - self.mean), out = self.m2, where = valid)
+
+        numpy.fmin(self.min, values, out = self.min, where = valid)
+        numpy.fmax(self.max, values, out = self.max, where = valid)
+        return
+
+
+def _parallel_stats(rasterlist, saves, low_thresh, high_thresh, numtype,
+                    NoData_Value, workers, progress):
+    """
+    Splits the output grid into strips of rows, reduces each strip over the entire
+    rasterlist in a pool of processes, and stitches the strips back together.
+
+    :return outputs:    dict of float64 arrays keyed by the entries in saves
+    :return meta:       metadata of the first raster
+    """
+
+    meta   = read_metadata(rasterlist[0])
+    xs, ys = meta.Xsize, meta.Ysize
+
+    # a few strips per worker keeps the pool busy when some strips finish early
+    num_strips = min(ys, workers * 4)
+    strip_rows = -(-ys // num_strips)
+
+    jobs = []
+    for yoff in range(0, ys, strip_rows):
+        window = (0, yoff, xs, min(strip_rows, ys - yoff))
+        jobs.append((rasterlist, saves, low_thresh, high_thresh, numtype, NoData_Value, window))
+
+    print("Taking statistics on {0} rasters in {1} strips with {2} workers".format(
+        len(rasterlist), len(jobs), workers))
+
+    outputs = {}
+    for save in saves:
+        outputs[save] = numpy.empty((ys, xs), dtype = "float64")
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        for window, strip_outputs in pool.imap_unordered(_reduce_strip, jobs):
+            xoff, yoff, xsize, ysize = window
+            for save in saves:
+                outputs[save][yoff:yoff + ysize, :] = strip_outputs[save]
+
+            # each strip is read from every raster in the stack, files are counted
+            # once every strip has been read
+            pixels = xsize * ysize * len(rasterlist)
+            progress.update("read", files = 0, pixels = pixels,
+                            bytes_read = pixels * numpy.dtype(numtype).itemsize)
+    finally:
+        pool.close()
+        pool.join()
+
+    progress.update("read", files = len(rasterlist))
+
+    return outputs, meta
+
+
+def _reduce_strip(job):
+    """
+    pool worker for _parallel_stats. Reduces one window over all rasters.
+
+    :param job:     tuple of (rasterlist, saves, low_thresh, high_thresh,
+                    numtype, NoData_Value, window)
+    :return:        tuple of (window, outputs dict for that window)
+    """
+
+    rasterlist, saves, low_thresh, high_thresh, numtype, NoData_Value, window = job
+
+    stats, _ = _reduce_stack(rasterlist, numtype, low_thresh, high_thresh,
+                             window = window, verbose = False)
+
+    return window, _finalize_stats(stats, saves, NoData_Value)
+
+
+def _reduce_stack(rasterlist, numtype, low_thresh = None, high_thresh = None,
+                  window = None, progress = None, verbose = True):
+    """
+    Reads every raster in rasterlist once, accumulating running statistics
+
+    :param rasterlist:      list of raster filepaths with identical dimensions
+    :param numtype:         numpy datatype to read the rasters as
+    :param low_thresh:      values below low_thresh are not counted
+    :param high_thresh:     values above high_thresh are not counted
+    :param window:          optional (xoff, yoff, xsize, ysize) pixel window to reduce
+    :param progress:        optional progress sink to report each raster read to
+    :param verbose:         set False to suppress printing a line per raster
+
+    :return stats:          a _running_stats object
+    :return metadata:       metadata of the first raster (or window of it)
+    """
+
+    stats    = None
+    metadata = None
+
+    for raster in rasterlist:
+
+        if verbose:
+            print('working on file {0}'.format(os.path.basename(raster)))
+        new_rast, new_meta = to_numpy(raster, numtype, window = window, cache = False)
+
+        if stats is None:
+            stats    = _running_stats(new_rast.shape)
+            metadata = new_meta
+
+        if new_rast.shape != stats.num.shape:
+            raise Exception("{0} has shape {1}, expected {2}".format(
+                raster, new_rast.shape, stats.num.shape))
+
+        values = numpy.asarray(new_rast.data, dtype = "float64")
+        valid  = ~numpy.ma.getmaskarray(new_rast) & ~numpy.isnan(values)
+
+        # values outside thresholds are treated as NoData
+        if low_thresh is not None:
+            valid &= values >= low_thresh
+        if high_thresh is not None:
+            valid &= values <= high_thresh
+
+        stats.update(values, valid)
+
+        if progress is not None:
+            progress.update("read", pixels = new_rast.size, bytes_read = new_rast.nbytes,
+                            preview = new_rast)
+
+    return stats, metadata
+
+
+def _finalize_stats(stats, saves, NoData_Value):
+    """
+    turns running statistics into output arrays
+
+    :param stats:           a _running_stats object
+    :param saves:           list of statistics to output, such as ['AVG','NUM']
+    :param NoData_Value:    value to use for pixels without any good values
+
+    :return outputs:        dict of float64 arrays keyed by the entries in saves
+    """
+
+    outputs = {}
+    empty   = stats.num == 0
+
+    for save in saves:
+        if save == "AVG":
+            out = stats.mean.copy()
+        elif save == "STD":
+            out = numpy.sqrt(stats.m2 / numpy.maximum(stats.num, 1))
+        elif save == "NUM":
+            out = stats.num.astype("float64")
+        elif save == "SUM":
+            out = stats.sum.copy()
+        elif save == "MIN":
+            out = stats.min.copy()
+        elif save == "MAX":
+            out = stats.max.copy()
+        else:
+            raise ValueError("'{0}' is not a valid statistic to save".format(save))
+
+        if save not in ["NUM", "SUM"]:
+            out[empty] = NoData_Value
+
+        outputs[save] = out
+
+    return outputs
@@ -2,6 +2,8 @@ __author__ = 'jwely'
 __all__ = ["metadata"]
 
 import arcpy
+import gdal
+import copy
 
 class metadata():
     """
@@ -31,6 +33,9 @@ class metadata():
     numpy_datatype  numpy accepted pixel type string. (ex "float32")
     projection      the projection of the raster (long string)
     NoData_Value    the value representing no data
+    geotransform    gdal style geotransform tuple (only set from gdal headers)
+    window          (xoff, yoff, xsize, ysize) pixel window within the source
+                    raster that this metadata describes, None for full rasters
     =============== ===========================================================
     """
 
@@ -44,6 +49,9 @@ class metadata():
         self.Ysize  = ys
         self.Zsize  = zs
 
+        self.geotransform   = None
+        self.window         = None
+
         # if a filepath to existing raster is input, build metadata from it
         if raster is not None:
             self._get_atts_from_raster(raster)
@@ -72,11 +80,114 @@ class metadata():
                                         str(self.Xmax),
                                         str(self.Ymax)])
 
-        self.projection     = arcpy.Describe(raster).spatialReference
-        self.NoData_Value   = arcpy.Describe(raster).noDataValue
+        self.projection     = desc.spatialReference
+        self.NoData_Value   = desc.noDataValue
+        return
+
+
+    def _get_atts_from_gdal(self, dataset):
+        """
+        sets all required metadata attributes from the header of an open
+        gdal.Dataset object. No pixel data is read.
+
+        :param dataset:     a gdal.Dataset object
+        """
+
+        band = dataset.GetRasterBand(1)
+        gt   = dataset.GetGeoTransform()
+
+        self.Xsize          = dataset.RasterXSize
+        self.Ysize          = dataset.RasterYSize
+        self.Zsize          = dataset.RasterCount
+        self.geotransform   = gt
+        self.cellWidth      = gt[1]
+        self.cellHeight     = abs(gt[5])
+        self.Xmin           = gt[0]
+        self.Ymax           = gt[3]
+        self.Xmax           = self.Xmin + (self.Xsize * self.cellWidth)
+        self.Ymin           = self.Ymax - (self.Ysize * self.cellHeight)
+
+        self.desc_pixelType = self._gdal_to_desc_pixelType(band.DataType)
+        self.pixel_type     = self._get_pixel_type
+        self.numpy_datatype = self._get_numpy_datatype
+
+        self.rectangle      = ' '.join([str(self.Xmin),
+                                        str(self.Ymin),
+                                        str(self.Xmax),
+                                        str(self.Ymax)])
+
+        self.projection     = dataset.GetProjection()
+        self.NoData_Value   = band.GetNoDataValue()
         return
 
 
+    @staticmethod
+    def _gdal_to_desc_pixelType(gdal_datatype):
+        """
+        translates a gdal data type into the arcpy.Describe() style "pixelType"
+        string, so that the pixel_type and numpy_datatype properties work the
+        same for gdal headers as they do for arcpy.
+
+        :param gdal_datatype:   gdal data type constant (ex gdal.GDT_Float32)
+        :return desc_pixelType: arcpy style pixel type (ex "F32")
+        """
+
+        name = gdal.GetDataTypeName(gdal_datatype)
+
+        if "Float" in name:
+            prefix = "F"
+        elif name == "Byte" or name.startswith("UInt"):
+            prefix = "U"
+        else:
+            prefix = "S"
+
+        bits = gdal.GetDataTypeSize(gdal_datatype)
+
+        return "{0}{1}".format(prefix, bits)
+
+
+    def offset_window(self, xoff, yoff, xsize, ysize):
+        """
+        Returns a new metadata object describing a pixel window within the raster
+        described by this metadata object. Extents and the geotransform are offset
+        so the window can be saved with ``from_numpy`` as a raster of its own.
+
+        :param xoff:        column offset of the window (pixels from the left)
+        :param yoff:        row offset of the window (pixels from the top)
+        :param xsize:       number of columns in the window
+        :param ysize:       number of rows in the window
+
+        :return metadata:   metadata object for the window
+        """
+
+        meta = copy.copy(self)
+
+        meta.Xsize  = xsize
+        meta.Ysize  = ysize
+        meta.Xmin   = self.Xmin + (xoff * self.cellWidth)
+        meta.Ymax   = self.Ymax - (yoff * self.cellHeight)
+        meta.Xmax   = meta.Xmin + (xsize * self.cellWidth)
+        meta.Ymin   = meta.Ymax - (ysize * self.cellHeight)
+
+        meta.rectangle = ' '.join([str(meta.Xmin),
+                                   str(meta.Ymin),
+                                   str(meta.Xmax),
+                                   str(meta.Ymax)])
+
+        if self.geotransform is not None:
+            gt = self.geotransform
+            meta.geotransform = (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+                                 gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+
+        # windows of windows are expressed relative to the source raster
+        if self.window is not None:
+            xoff += self.window[0]
+            yoff += self.window[1]
+
+        meta.window = (xoff, yoff, xsize, ysize)
+        return meta
+
+
     @property
     def _get_pixel_type(self):
         """
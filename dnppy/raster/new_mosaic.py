@@ -3,16 +3,37 @@ __all__ = ["new_mosaic"]
 
 from enf_rastlist import enf_rastlist
 from to_numpy import to_numpy
+from read_metadata import read_metadata, _open_gdal
 from from_numpy import from_numpy
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from iter_blocks import _block_windows
+from to_numpy import _read_window
+from spatially_match import _same_projection
+
+from multiprocessing.pool import ThreadPool
+import multiprocessing
 import numpy
 import arcpy
+arcpy.env.overwriteOutput = True
 import os
 
+# mosaic methods supported by the native engine
+_METHODS = ["FIRST", "LAST", "MEAN", "MINIMUM", "MAXIMUM", "BLEND"]
+
+# size of the output tiles computed in parallel by the native engine
+_TILE_SIZE = 1024
 
-def new_mosaic(rasterpaths, output_path, mosaic_method = None, cell_size = None, number_of_bands = None):
+
+def new_mosaic(rasterpaths, output_path, mosaic_method = None, cell_size = None,
+               number_of_bands = None, workers = None):
     """
-    Simply creates a new raster dataset mosaic of input rasters by wrapping the
-    arcpy.MosaicToNewRaster_management function. learn more about the fields here
+    Simply creates a new raster dataset mosaic of input rasters. When every input is a
+    single band raster with the same projection and cell size, on a common grid, the
+    mosaic is built by a native gdal and numpy engine. The extent of the output is found
+    from the raster headers alone, and the output is computed in tiles, in parallel, by
+    reading only the window of each input that falls within each tile. Memory use is
+    bounded by the tile size. Otherwise, this wraps the arcpy.MosaicToNewRaster_management
+    function. learn more about the fields here
 
     http://help.arcgis.com/en/arcgisdesktop/10.0/help/index.html#//001700000098000000
 
@@ -20,7 +41,10 @@ def new_mosaic(rasterpaths, output_path, mosaic_method = None, cell_size = None,
     :param output_path:     place to save new mosaic raster dataset
     :param mosaic_method:   options are "FIRST", "LAST", "BLEND", "MEAN", "MINIMUM","MAXIMUM"
     :param cell_size:       of format "[cellwidth] [cellheight]" in the appropriate linear units,
-                            usually meters.
+                            usually meters. Custom cell sizes always use arcpy.
+    :param number_of_bands: number of bands in the output. Multi band mosaics use arcpy.
+    :param workers:         number of threads computing output tiles with the native
+                            engine. defaults to the number of cpus.
 
     :return output_path:    returns filepath to new file, same as input ``output_path``
     """
@@ -28,6 +52,7 @@ def new_mosaic(rasterpaths, output_path, mosaic_method = None, cell_size = None,
     # set up input parameters
     if mosaic_method is None:
         mosaic_method = "FIRST"
+    mosaic_method = mosaic_method.upper()
 
     if cell_size is not None:
         print("using custom cell size of '{0}'".format(cell_size))
@@ -37,26 +62,215 @@ def new_mosaic(rasterpaths, output_path, mosaic_method = None, cell_size = None,
 
     rasterpaths = enf_rastlist(rasterpaths)
 
-    # get some metadata about the first raster in the mosaic
-    numpy, meta = to_numpy(rasterpaths[0])
+    # get some metadata about the rasters in the mosaic
+    metas = [read_metadata(path, cache = False) for path in rasterpaths]
 
     # check output directories and set up inputs for arcpy function
     outdir, outname = os.path.split(output_path)
 
-    if not os.path.exists(outdir):
+    if outdir and not os.path.exists(outdir):
         os.makedirs(outdir)
 
-    arcpy.MosaicToNewRaster_management(rasterpaths, outdir, outname,
-                                        None,                # coordinate system
-                                        meta.pixel_type,
-                                        cell_size,
-                                        str(number_of_bands),
-                                        mosaic_method = mosaic_method)
+    if (cell_size is None and number_of_bands == 1 and mosaic_method in _METHODS
+            and _on_common_grid(metas)):
+        _native_mosaic(rasterpaths, metas, output_path, mosaic_method, workers)
+
+    else:
+        arcpy.MosaicToNewRaster_management(rasterpaths, outdir, outname,
+                                            None,                # coordinate system
+                                            metas[0].pixel_type,
+                                            cell_size,
+                                            str(number_of_bands),
+                                            mosaic_method = mosaic_method)
 
     print("Created raster mosaic at {0}".format(output_path))
     return output_path
 
 
+def _on_common_grid(metas, tolerance = 1e-6):
+    """
+    checks that all rasters are single band, share a projection and cell size,
+    and have corners that line up on the same grid of cells.
+    """
+
+    first = metas[0]
+    for meta in metas:
+        if meta.Zsize != 1:
+            return False
+        if (abs(meta.cellWidth - first.cellWidth) > tolerance * first.cellWidth or
+                abs(meta.cellHeight - first.cellHeight) > tolerance * first.cellHeight):
+            return False
+
+        xshift = (meta.Xmin - first.Xmin) / first.cellWidth
+        yshift = (meta.Ymax - first.Ymax) / first.cellHeight
+        if abs(xshift - round(xshift)) > 1e-3 or abs(yshift - round(yshift)) > 1e-3:
+            return False
+
+        if meta is not first and not _same_projection(first.projection, meta.projection):
+            return False
+    return True
+
+
+def _native_mosaic(rasterpaths, metas, output_path, method, workers = None):
+    """
+    mosaics rasters on a common grid with gdal and numpy. Output tiles are computed
+    by a pool of threads, and written by this thread as they finish.
+    """
+
+    first = metas[0]
+
+    # union grid from the headers alone
+    Xmin = min(meta.Xmin for meta in metas)
+    Ymax = max(meta.Ymax for meta in metas)
+    xs   = int(round((max(meta.Xmax for meta in metas) - Xmin) / first.cellWidth))
+    ys   = int(round((Ymax - min(meta.Ymin for meta in metas)) / first.cellHeight))
+
+    out_meta = first.offset_window(int(round((Xmin - first.Xmin) / first.cellWidth)),
+                                   int(round((first.Ymax - Ymax) / first.cellHeight)), xs, ys)
+    out_meta.window = None
+
+    # (col, row) of the upper left corner of each input in the output grid
+    sources = []
+    for path, meta in zip(rasterpaths, metas):
+        col = int(round((meta.Xmin - Xmin) / first.cellWidth))
+        row = int(round((Ymax - meta.Ymax) / first.cellHeight))
+        sources.append((path, meta, col, row))
+
+    dtype  = first.numpy_datatype
+    NoData = _mosaic_nodata(metas, dtype)
+
+    dataset = _create_dataset(output_path, out_meta, xs, ys, 1, dtype, NoData,
+                              ["TILED=YES", "BIGTIFF=IF_SAFER"])
+
+    tiles = list(_block_windows(xs, ys, (_TILE_SIZE, _TILE_SIZE)))
+    jobs  = [(tile, sources, method, dtype, NoData) for tile in tiles]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    print("Mosaicing {0} rasters into {1} tiles with method {2}".format(
+        len(rasterpaths), len(tiles), method))
+
+    pool = ThreadPool(max(1, min(workers, len(jobs))))
+    try:
+        for tile, out_tile in pool.imap_unordered(_mosaic_tile, jobs):
+            _write_array(dataset, out_tile, NoData, tile[0], tile[1])
+    finally:
+        pool.close()
+        pool.join()
+
+    _close_dataset(dataset, output_path, stats = "now")
+    return
+
+
+def _mosaic_nodata(metas, dtype):
+    """
+    picks the NoData value of a native mosaic, which marks the cells no input covers.
+    The NoData value of the first input that has one is used, otherwise NaN for float
+    mosaics, or the extreme value of the datatype for integer mosaics.
+    """
+
+    for meta in metas:
+        if meta.NoData_Value is not None:
+            return meta.NoData_Value
+
+    if "float" in dtype:
+        NoData = numpy.nan
+    elif "uint" in dtype:
+        NoData = numpy.iinfo(dtype).max
+    else:
+        NoData = numpy.iinfo(dtype).min
+
+    print("No input defines a NoData value, using {0} in the mosaic".format(NoData))
+    return NoData
+
+
+def _mosaic_tile(job):
+    """
+    computes one output tile of a native mosaic
+
+    :param job:     tuple of (tile window, sources, method, numpy datatype, NoData)
+    :return:        tuple of (tile window, masked array of the tile)
+    """
+
+    tile, sources, method, dtype, NoData = job
+    txoff, tyoff, txsize, tysize = tile
+
+    # gdal handles are not thread safe, so each job opens (and closes) its own
+    datasets = {}
+
+    have = numpy.zeros((tysize, txsize), dtype = "bool")
+
+    if method in ["MEAN", "BLEND"]:
+        total  = numpy.zeros((tysize, txsize), dtype = "float64")
+        weight = numpy.zeros((tysize, txsize), dtype = "float64")
+    else:
+        out = numpy.zeros((tysize, txsize), dtype = "float64")
+
+    for path, meta, col, row in sources:
+
+        # intersection of this input with the tile, in output grid coordinates
+        x0, x1 = max(txoff, col), min(txoff + txsize, col + meta.Xsize)
+        y0, y1 = max(tyoff, row), min(tyoff + tysize, row + meta.Ysize)
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        if path not in datasets:
+            datasets[path] = _open_gdal(path)
+
+        window = (x0 - col, y0 - row, x1 - x0, y1 - y0)
+        values = _read_window(datasets[path], window, "float64", cache = False)
+        valid  = ~numpy.isnan(values)
+        if meta.NoData_Value is not None:
+            valid &= values != meta.NoData_Value
+
+        sub  = (slice(y0 - tyoff, y1 - tyoff), slice(x0 - txoff, x1 - txoff))
+        seen = have[sub]
+
+        if method == "FIRST":
+            numpy.copyto(out[sub], values, where = valid & ~seen)
+        elif method == "LAST":
+            numpy.copyto(out[sub], values, where = valid)
+        elif method == "MINIMUM":
+            numpy.copyto(out[sub], numpy.where(seen, numpy.fmin(out[sub], values), values),
+                         where = valid)
+        elif method == "MAXIMUM":
+            numpy.copyto(out[sub], numpy.where(seen, numpy.fmax(out[sub], values), values),
+                         where = valid)
+        else:
+            if method == "BLEND":
+                w = _edge_distance(x0 - col, y0 - row, x1 - x0, y1 - y0, meta.Xsize, meta.Ysize)
+            else:
+                w = 1.0
+            w = numpy.where(valid, w, 0.0)
+            total[sub]  += w * numpy.where(valid, values, 0.0)
+            weight[sub] += w
+
+        seen |= valid
+
+    datasets = None
+
+    if method in ["MEAN", "BLEND"]:
+        out = total / numpy.maximum(weight, 1e-300)
+
+    if "int" in dtype:
+        out = numpy.round(out)
+
+    return tile, numpy.ma.masked_array(out.astype(dtype), ~have)
+
+
+def _edge_distance(xoff, yoff, xsize, ysize, Xsize, Ysize):
+    """
+    distance in cells from each pixel of a window to the nearest edge of its
+    raster, plus one. Used to weight inputs in BLEND mosaics.
+    """
+
+    cols = numpy.arange(xoff, xoff + xsize)
+    rows = numpy.arange(yoff, yoff + ysize)
+    dx   = numpy.minimum(cols, Xsize - 1 - cols)
+    dy   = numpy.minimum(rows, Ysize - 1 - rows)
+    return numpy.minimum(dy[:, None], dx[None, :]) + 1.0
+
 
 if __name__ == "__main__":
 
@@ -69,4 +283,4 @@ if __name__ == "__main__":
     rast.data[(2452 >= rast.data) & (rast.data >= 2450)] = numpy.nan
     rast.data[(2430 >= rast.data) & (rast.data >= 2428)] = numpy.nan
     rast.data[(2350 >= rast.data) & (rast.data >= 2348)] = numpy.nan
-    from_numpy(rast, meta, outpath.replace(".tif","_gaps.tif"))
\ No newline at end of file
+    from_numpy(rast, meta, outpath.replace(".tif","_gaps.tif"))
@@ -1,8 +1,10 @@
 __author__ = 'jwely'
 __all__ = ["null_define"]
 
-import arcpy
 from enf_rastlist import enf_rastlist
+from dnppy.core._geotiff_output import _invalidate
+
+import gdal
 
 def null_define(rastlist, NoData_Value):
     """
@@ -10,7 +12,8 @@ def null_define(rastlist, NoData_Value):
 
     Function inputs a list of raster (usually tifs) files and sets no data values. This
     function does not actually change the raster values in any way, and simply defines which
-    numerical values to be considered NoData in metadata.
+    numerical values to be considered NoData in metadata. Only the file header is
+    rewritten, no pixel data is read.
 
     :param rastlist:        list of rasters for which to set nodata value
     :param NoData_Value:    Value to declare as NoData (usually 0 or -9999)
@@ -23,8 +26,14 @@ def null_define(rastlist, NoData_Value):
     # iterate through each file in the filelist and set nodata values
     for rastname in rastlist:
 
-        arcpy.SetRasterProperties_management(rastname,data_type="#",statistics="#",
-                    stats_file="#",nodata="1 "+str(NoData_Value))
+        dataset = gdal.Open(rastname, gdal.GA_Update)
+        if dataset is None:
+            raise Exception("Could not open '{0}' for editing".format(rastname))
+
+        for z in range(dataset.RasterCount):
+            dataset.GetRasterBand(z + 1).SetNoDataValue(float(NoData_Value))
+        dataset = None
+        _invalidate(rastname)
 
         print("Set nulls in {0}".format(rastname))
-    return rastlist
\ No newline at end of file
+    return rastlist
@@ -2,47 +2,109 @@ __author__ = 'jwely'
 __all__ = ["null_set_range"]
 
 from enf_rastlist import enf_rastlist
-from to_numpy import to_numpy
-from from_numpy import from_numpy
+from iter_blocks import _block_windows
+from build_stats import build_stats, _apply_stats_policy
+from dnppy.core._geotiff_output import _invalidate
 
-import arcpy
+import gdal
+import numpy
 
-def null_set_range(rastlist, high_thresh = None, low_thresh = None, NoData_Value = None):
+def null_set_range(rastlist, high_thresh = None, low_thresh = None, NoData_Value = None,
+                   stats = "deferred"):
     """
     Changes values within a certain range to NoData. similar to ``raster.null_define``,
     but can take an entire range of values to set to NoData. useful in filtering
     obviously erroneous high or low values from a raster dataset.
 
+    Rasters are edited in place. Each file is opened for writing and streamed one
+    native block at a time, and only the blocks that actually contain values to
+    change are written back, so a file with few bad pixels costs little more than
+    one read. The NoData value is set in the header once.
+
     :param rastlist:     list of rasters for which to set no dta values
     :param high_thresh:  will set all values above this to  NoData
     :param low_thresh:   will set all values below this to NoData
+    :param NoData_Value: NoData value to use. defaults to that of each raster.
+    :param stats:        statistics policy for modified rasters, see ``from_numpy``.
+                         "deferred" builds statistics for all modified rasters in one
+                         parallel pass at the end.
 
     :return rastlist:    list of all rasters modified by this function
     """
 
     # sanitize filelist input
     rastlist = enf_rastlist(rastlist)
+    modified = []
 
     # iterate through each file in the filelist and set nodata values
     for rastname in rastlist:
 
-        #load raster as numpy array and save spatial referencing.
-        rast, meta = to_numpy(rastname)
+        dataset = gdal.Open(rastname, gdal.GA_Update)
+        if dataset is None:
+            raise Exception("Could not open '{0}' for editing".format(rastname))
+
+        changed = False
+        for z in range(dataset.RasterCount):
+            band = dataset.GetRasterBand(z + 1)
+            changed |= _null_band(band, high_thresh, low_thresh, NoData_Value)
+
+        dataset.FlushCache()
+        dataset = None
+
+        if changed:
+            _invalidate(rastname)
+            _apply_stats_policy(rastname, stats)
+            modified.append(rastname)
+            print("Set nulls in {0}".format(rastname))
+
+    if stats == "deferred":
+        build_stats(modified)
+
+    return modified
+
+
+def _null_band(band, high_thresh, low_thresh, NoData_Value = None):
+    """
+    sets values outside thresholds to NoData in one band of a writable
+    dataset, rewriting only the blocks which change.
+
+    :param band:            gdal.Band of a dataset opened with GA_Update
+    :param high_thresh:     values at or above this are set to NoData, or None
+    :param low_thresh:      values at or below this are set to NoData, or None
+    :param NoData_Value:    NoData value, or None to use that of the band
+
+    :return changed:        True if any pixels or the NoData value were changed
+    """
+
+    old_NoData = band.GetNoDataValue()
+    if NoData_Value is None:
+        NoData_Value = old_NoData
+    if NoData_Value is None:
+        raise Exception("raster has no NoData value, one must be specified!")
+
+    # pixels which were NoData under an old value must be recoded as well
+    recode  = old_NoData is not None and old_NoData != NoData_Value
+    changed = recode or old_NoData is None
 
-        if not NoData_Value is None:
-            NoData_Value = meta.NoData_Value
+    if changed:
+        band.SetNoDataValue(float(NoData_Value))
 
-        if not high_thresh is None:
-            rast[rast >= high_thresh] = NoData_Value
+    xs, ys = band.XSize, band.YSize
+    for xoff, yoff, xsize, ysize in _block_windows(xs, ys, band.GetBlockSize()):
+        block = band.ReadAsArray(xoff, yoff, xsize, ysize)
 
-        if not low_thresh is None:
-            rast[rast <= low_thresh] = NoData_Value
+        bad = numpy.zeros(block.shape, dtype = "bool")
+        if high_thresh is not None:
+            bad |= block >= high_thresh
+        if low_thresh is not None:
+            bad |= block <= low_thresh
+        if recode:
+            bad |= block == old_NoData
+        bad &= block != NoData_Value
 
-        from_numpy(rast, meta, rastname)
-        try:
-            arcpy.SetRasterProperties_management(rastname, data_type = "#", statistics = "#",
-                    stats_file = "#", nodata = "1 " + str(NoData_Value))
-        except RuntimeError:
-            print("failed to set nodata in {0}".format(rastname))
+        if bad.any():
+            block[bad] = NoData_Value
+            band.WriteArray(block, xoff, yoff)
+            changed = True
 
-    return
\ No newline at end of file
+    return changed
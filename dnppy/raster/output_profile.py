@@ -0,0 +1,7 @@
+__author__ = "jwely"
+__all__ = ["output_profile", "set_output_profile", "get_output_profile"]
+
+# profiles live in core, so that the convert module shares them without importing raster
+from dnppy.core._geotiff_output import output_profile, set_output_profile, get_output_profile
+from dnppy.core._geotiff_output import _resolve_profile, _build_overviews
+from dnppy.core._geotiff_output import _stage_geotiff, _finish_geotiff
@@ -0,0 +1,177 @@
+__author__ = "jwely"
+__all__ = ["progress", "log_progress", "preview_progress"]
+
+import time
+
+
+class progress(object):
+    """
+    Progress and throughput sink for the batch functions of the raster module.
+    This base class only keeps count of what has been done, and reports nothing,
+    so it costs next to nothing on headless batch nodes. See ``log_progress`` and
+    ``preview_progress`` for sinks that report to the user.
+
+    Batch functions report their work by stage (such as "read" or "write") with
+    ``update``, and call ``finish`` once at the end.
+
+    Example usage
+
+    .. code-block:: python
+
+        raster.many_stats(rasters, outdir, "stats", progress = raster.log_progress(10))
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+
+    def update(self, stage, files = 1, pixels = 0, bytes_read = 0, bytes_written = 0,
+               preview = None):
+        """
+        reports work done in a stage of a batch function
+
+        :param stage:           name of the stage, such as "read" or "write"
+        :param files:           number of files (or file blocks) finished
+        :param pixels:          number of pixels processed
+        :param bytes_read:      number of bytes read
+        :param bytes_written:   number of bytes written
+        :param preview:         optional numpy array which may be displayed to the user.
+                                it is only referenced, not copied.
+        """
+
+        if stage not in self.stages:
+            self.stages[stage] = _stage_counter()
+        self.stages[stage].add(files, pixels, bytes_read, bytes_written)
+        return
+
+
+    def summary(self, stage):
+        """
+        returns a one line summary of the throughput of a stage
+
+        :param stage:   name of the stage
+        :return:        string
+        """
+
+        c = self.stages[stage]
+        elapsed = max(time.time() - c.start, 1e-6)
+
+        return ("{0}: {1} files, {2:.2f} Mpix/s, {3:.1f} MB read, {4:.1f} MB written "
+                "in {5:.1f}s").format(stage, c.files, c.pixels / elapsed / 1e6,
+                                      c.bytes_read / 1048576.0,
+                                      c.bytes_written / 1048576.0, elapsed)
+
+
+    def finish(self):
+        """ called once when the batch function is done """
+        return
+
+
+class log_progress(progress):
+    """
+    Progress sink which prints the throughput of each stage to the console,
+    at most once every ``interval`` seconds, and a summary when finished.
+
+    :param interval:    minimum number of seconds between progress lines
+    """
+
+    def __init__(self, interval = 5.0):
+        progress.__init__(self)
+        self.interval = interval
+        self.last_log = 0.0
+
+
+    def update(self, stage, files = 1, pixels = 0, bytes_read = 0, bytes_written = 0,
+               preview = None):
+
+        progress.update(self, stage, files, pixels, bytes_read, bytes_written)
+
+        now = time.time()
+        if now - self.last_log >= self.interval:
+            self.last_log = now
+            print(self.summary(stage))
+        return
+
+
+    def finish(self):
+        for stage in self.stages:
+            print(self.summary(stage))
+        return
+
+
+class preview_progress(log_progress):
+    """
+    Progress sink which logs like ``log_progress``, and also displays a quick look
+    figure of the most recent preview array. The preview is decimated to at most
+    ``max_size`` pixels on a side, and redrawn at most once every ``interval``
+    seconds, so drawing never keeps up with (or slows down) the actual work.
+
+    :param interval:    minimum number of seconds between redraws and progress lines
+    :param max_size:    maximum number of pixels on each side of the displayed preview
+    :param title:       title to put on the figure
+    """
+
+    def __init__(self, interval = 5.0, max_size = 512, title = False):
+        log_progress.__init__(self, interval)
+        self.max_size   = max_size
+        self.title      = title
+        self.rastfig    = None
+        self.last_draw  = 0.0
+
+
+    def update(self, stage, files = 1, pixels = 0, bytes_read = 0, bytes_written = 0,
+               preview = None):
+
+        log_progress.update(self, stage, files, pixels, bytes_read, bytes_written)
+
+        if preview is None:
+            return
+
+        now = time.time()
+        if now - self.last_draw >= self.interval:
+            self.last_draw = now
+            self._draw(preview)
+        return
+
+
+    def _draw(self, preview):
+        """ draws a decimated copy of the preview array """
+
+        # matplotlib is only needed once something is actually drawn
+        from raster_fig import raster_fig
+
+        step  = max(1, -(-max(preview.shape[-2:]) // self.max_size))
+        quick = preview[..., ::step, ::step]
+
+        if self.rastfig is None:
+            self.rastfig = raster_fig(quick, title = self.title)
+        else:
+            self.rastfig.update_fig(quick)
+        return
+
+
+    def finish(self):
+        log_progress.finish(self)
+        if self.rastfig is not None:
+            self.rastfig.close_fig()
+            self.rastfig = None
+        return
+
+
+class _stage_counter(object):
+    """ running totals for one stage of a batch function """
+
+    def __init__(self):
+        self.start          = time.time()
+        self.files          = 0
+        self.pixels         = 0
+        self.bytes_read     = 0
+        self.bytes_written  = 0
+
+
+    def add(self, files, pixels, bytes_read, bytes_written):
+        self.files          += files
+        self.pixels         += pixels
+        self.bytes_read     += bytes_read
+        self.bytes_written  += bytes_written
+        return
@@ -8,6 +8,7 @@ from is_rast import is_rast
 
 import os
 import arcpy
+arcpy.env.overwriteOutput = True
 
 def project_resample(filelist, reference_file, outdir = None,
                    resampling_type = None, cell_size = None):
@@ -2,42 +2,54 @@ __author__ = "Jwely"
 __all__ = ["raster_overlap"]
 
 
-from to_numpy import to_numpy
-from from_numpy import from_numpy
 from is_rast import is_rast
-from clip_and_snap import clip_and_snap
+from read_metadata import read_metadata, _open_gdal
+from from_numpy import _create_dataset, _write_array, _close_dataset
+from clip_and_snap import _snap_window
+from iter_blocks import _block_windows
+from block_cache import _cached_read
 
+import os
+import numpy
+import gdal
+from osgeo import ogr, osr
 
-import arcpy
+# creation options of the 1 bit overlap mask
+_MASK_OPTIONS = ["NBITS=1", "COMPRESS=DEFLATE", "TILED=YES"]
 
 
-def raster_overlap(file_A, file_B, outpath, NoData_A = None, NoData_B = None):
+def raster_overlap(file_A, file_B, outpath = None, NoData_A = None, NoData_B = None):
     """
     Finds overlaping area between two raster images. this function examines
     two images and outputs a raster identifying pixels where both rasters have
     non-NoData values. Output raster has 1's where both images have data and
-    0's where one or both images are missing data.
+    0's where one or both images are missing data. The two rasters must share a
+    projection and cell size, file_B is read on the grid of file_A.
+
+    The rasters are streamed one block at a time, and the output is a 1 bit,
+    deflate compressed GeoTiff, so overlap masks of very large mosaics are cheap
+    to compute and store. If outpath ends in ".shp", the mask is also turned into
+    polygons by merging runs of overlapping pixels into rectangles, and saved as
+    a shapefile next to the ".tif" mask.
 
     :param file_A:      the first file
     :param file_B:      the second file
     :param outpath:     the output filename for the desired output. must end in ".tif"
+                        or ".shp". Leave None to write nothing, and simply return the
+                        number of overlapping pixels and their bounding box.
     :param NoData_A:    the NoData value of file A
     :param NoData_B:    the NoData value of file B
 
-    :return outpath:    filepath to raster created by this function.
-
-    This function automatically invokes
-        * clip_and_snap
-        * null_define
+    :return outpath:    filepath to raster created by this function. If outpath is None,
+                        a tuple of (pixel count, bounding box) is returned instead, where
+                        the bounding box is (Xmin, Ymin, Xmax, Ymax) or None.
     """
-    
+
     if not is_rast(file_A) or not is_rast(file_B):
         raise Exception('both inputs must be rasters!')
 
-
-    # load the rasters as numpy arays.
-    a, metaA = to_numpy(file_A)
-    b, metaB = to_numpy(file_B)
+    metaA = read_metadata(file_A)
+    metaB = read_metadata(file_B)
 
     # set no_datas
     if NoData_A is None:
@@ -45,25 +57,177 @@ def raster_overlap(file_A, file_B, outpath, NoData_A = None, NoData_B = None):
     if NoData_B is None:
         NoData_B = metaB.NoData_Value
 
-    # spatially match the rasters
-    print('preparing input rasters!')
-    clip_and_snap(file_A, file_B, outpath.replace(".shp",".tif"), NoData_B)
+    # offset of file_A's grid within file_B
+    bxoff, byoff, _, _ = _snap_window(metaB, metaA)
 
-    # reload the rasters as numpy arrays now that spatial matching is done
-    a, metaA = to_numpy(file_A)
-    b, metaB = to_numpy(file_B)
+    dataset_A = _open_gdal(file_A)
+    dataset_B = _open_gdal(file_B)
+
+    if outpath is not None:
+        maskpath = outpath.replace(".shp", ".tif")
+        # a 1 bit mask has no room for a NoData value apart from its 0's and 1's
+        mask_dataset = _create_dataset(maskpath, metaA, metaA.Xsize, metaA.Ysize, 1,
+                                       "uint8", None, _MASK_OPTIONS)
 
-    # create work matrix and find the overlap
     print('Finding overlaping pixels!')
-    Workmatrix = a.mask + b.mask
-    Workmatrix = Workmatrix.astype('uint8')
-    Workmatrix[Workmatrix == 1] = 2
-                
+    count = 0
+    rows  = [None, None]
+    cols  = [None, None]
+
+    native_block = dataset_A.GetRasterBand(1).GetBlockSize()
+
+    for window in _block_windows(metaA.Xsize, metaA.Ysize, native_block):
+        xoff, yoff, xsize, ysize = window
+
+        overlap = _valid(_cached_read(dataset_A, 1, window), NoData_A)
+        overlap &= _valid_window(dataset_B, (xoff + bxoff, yoff + byoff, xsize, ysize),
+                                 metaB, NoData_B)
+
+        n = int(overlap.sum())
+        if n > 0:
+            count += n
+            ys = numpy.nonzero(overlap.any(axis = 1))[0]
+            xs = numpy.nonzero(overlap.any(axis = 0))[0]
+            rows = [_min(rows[0], yoff + ys[0]), _max(rows[1], yoff + ys[-1] + 1)]
+            cols = [_min(cols[0], xoff + xs[0]), _max(cols[1], xoff + xs[-1] + 1)]
+
+        if outpath is not None:
+            _write_array(mask_dataset, overlap.astype("uint8"), None, xoff, yoff)
+
+    dataset_A = dataset_B = None
+
+    if count > 0:
+        gt   = metaA.geotransform
+        bbox = (gt[0] + cols[0] * gt[1], gt[3] + rows[1] * gt[5],
+                gt[0] + cols[1] * gt[1], gt[3] + rows[0] * gt[5])
+    else:
+        bbox = None
+
+    print("Found {0} overlapping pixels within {1}".format(count, bbox))
+
+    if outpath is None:
+        return count, bbox
+
     print('Saving overlap file!')
-    metaA.numpy_datatype = 'uint8'
-    from_numpy(Workmatrix, metaA, outpath.replace(".shp",".tif"), NoData_Value = 2)
-    arcpy.RasterToPolygon_conversion(outpath.replace(".shp",".tif"),
-                                     outpath.replace(".tif",".shp"),
-                                     'NO_SIMPLIFY')
-    
+    _close_dataset(mask_dataset, maskpath, stats = "now")
+
+    if outpath.endswith(".shp"):
+        _polygonize_mask(maskpath, outpath)
+
     return outpath
+
+
+def _valid(block, NoData_Value):
+    """ boolean array of pixels in block with data """
+
+    if NoData_Value is None:
+        valid = numpy.ones(block.shape, dtype = "bool")
+    else:
+        valid = block != NoData_Value
+
+    if block.dtype.kind == "f":
+        valid &= ~numpy.isnan(block)
+    return valid
+
+
+def _valid_window(dataset, window, meta, NoData_Value):
+    """
+    boolean array of pixels with data within a window of a dataset, which may
+    extend past the edges of the raster. pixels outside the raster have no data.
+    """
+
+    xoff, yoff, xsize, ysize = window
+    valid = numpy.zeros((ysize, xsize), dtype = "bool")
+
+    x0, x1 = max(xoff, 0), min(xoff + xsize, meta.Xsize)
+    y0, y1 = max(yoff, 0), min(yoff + ysize, meta.Ysize)
+
+    if x1 > x0 and y1 > y0:
+        block = _cached_read(dataset, 1, (x0, y0, x1 - x0, y1 - y0))
+        valid[y0 - yoff : y1 - yoff, x0 - xoff : x1 - xoff] = _valid(block, NoData_Value)
+    return valid
+
+
+def _polygonize_mask(maskpath, shppath, strip_rows = 256):
+    """
+    turns the 1's in a mask raster into rectangular polygons in a shapefile.
+    Each row is split into runs of 1's, and runs spanning the same columns in
+    consecutive rows are merged into a single rectangle. The mask is read in
+    strips of full rows, so memory is bounded for any size of mask.
+
+    :param maskpath:    filepath to a single band mask raster
+    :param shppath:     filepath of the shapefile to create
+    :param strip_rows:  number of rows to read at once
+    """
+
+    dataset = _open_gdal(maskpath)
+    band    = dataset.GetRasterBand(1)
+    gt      = dataset.GetGeoTransform()
+    xs, ys  = dataset.RasterXSize, dataset.RasterYSize
+
+    driver = ogr.GetDriverByName("ESRI Shapefile")
+    if os.path.exists(shppath):
+        driver.DeleteDataSource(shppath)
+
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(dataset.GetProjection())
+
+    source = driver.CreateDataSource(shppath)
+    layer  = source.CreateLayer(os.path.basename(shppath)[:-4], srs, ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn("GRIDCODE", ogr.OFTInteger))
+
+    def write_rect(x0, x1, y0, y1):
+        ring = ogr.Geometry(ogr.wkbLinearRing)
+        for x, y in [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]:
+            ring.AddPoint_2D(gt[0] + x * gt[1], gt[3] + y * gt[5])
+        poly = ogr.Geometry(ogr.wkbPolygon)
+        poly.AddGeometry(ring)
+
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField("GRIDCODE", 1)
+        feature.SetGeometry(poly)
+        layer.CreateFeature(feature)
+        feature = None
+
+    # rectangles still growing downward, keyed on their (start, end) columns
+    open_rects = {}
+
+    for yoff in range(0, ys, strip_rows):
+        strip = band.ReadAsArray(0, yoff, xs, min(strip_rows, ys - yoff))
+
+        for i, row in enumerate(strip):
+            y    = yoff + i
+            runs = set(_row_runs(row))
+
+            for run in list(open_rects):
+                if run not in runs:
+                    write_rect(run[0], run[1], open_rects.pop(run), y)
+
+            for run in runs:
+                if run not in open_rects:
+                    open_rects[run] = y
+
+    for run, y0 in open_rects.items():
+        write_rect(run[0], run[1], y0, ys)
+
+    source = None
+    dataset = None
+    print("Saved overlap polygons as {0}".format(shppath))
+    return
+
+
+def _row_runs(row):
+    """ returns (start, end) column pairs of each run of nonzero values in a row """
+
+    edges  = numpy.diff(numpy.concatenate(([0], row != 0, [0])).astype("int8"))
+    starts = numpy.nonzero(edges == 1)[0]
+    ends   = numpy.nonzero(edges == -1)[0]
+    return zip(starts.tolist(), ends.tolist())
+
+
+def _min(a, b):
+    return b if a is None else min(a, b)
+
+
+def _max(a, b):
+    return b if a is None else max(a, b)
@@ -0,0 +1,93 @@
+__author__ = "jwely"
+__all__ = ["read_metadata"]
+
+from metadata import metadata
+from dnppy.core._geotiff_output import _register_cache
+
+from collections import OrderedDict
+import threading
+import copy
+import gdal
+import os
+
+# process wide least recently used cache of metadata objects
+_cache      = OrderedDict()
+_cache_max  = 4096
+_cache_lock = threading.Lock()
+
+
+def read_metadata(raster, cache = True):
+    """
+    Reads a ``raster.metadata`` object from the header of a raster file without
+    reading any of its pixel data. Use this instead of ``_, meta = to_numpy(raster)``
+    whenever only the metadata is needed.
+
+    Results are kept in a process wide least recently used cache, keyed on the
+    filepath along with the modification time and size of the file, so repeated
+    lookups of the same raster are nearly free, and a file that changes on disk
+    is simply read again. Each call returns its own copy of the metadata, so it
+    is safe to modify. Functions in this module which modify a raster in place
+    drop its cached metadata as they finish.
+
+    :param raster:      filepath to any raster readable by gdal
+    :param cache:       set False to read a raster that will not be looked up again,
+                        such as an input of a batch function, without adding it to
+                        the cache. An entry already cached is still used.
+    :return metadata:   a metadata object. see ``raster.metadata``
+    """
+
+    try:
+        stat = os.stat(raster)
+        key  = (os.path.abspath(raster), stat.st_mtime, stat.st_size)
+    except OSError:
+        key  = None     # not a plain file (gdal virtual path), don't cache it
+
+    if key is not None:
+        with _cache_lock:
+            if key in _cache:
+                meta = _cache.pop(key)
+                _cache[key] = meta
+                return copy.copy(meta)
+
+    meta = metadata()
+    meta._get_atts_from_gdal(_open_gdal(raster))
+
+    if key is not None and cache:
+        with _cache_lock:
+            _cache[key] = meta
+            while len(_cache) > _cache_max:
+                _cache.popitem(last = False)
+
+    return copy.copy(meta)
+
+
+def _invalidate(raster):
+    """
+    drops all cached metadata of a raster, to be called whenever it is written
+    or modified in place, since its modification time may not change.
+
+    :param raster:      filepath to raster
+    """
+
+    path = os.path.abspath(raster)
+    with _cache_lock:
+        for key in [key for key in _cache if key[0] == path]:
+            del _cache[key]
+    return
+
+
+_register_cache(_invalidate)
+
+
+def _open_gdal(raster):
+    """
+    opens a raster filepath as a read only gdal.Dataset
+
+    :param raster:      filepath to raster
+    :return dataset:    gdal.Dataset object
+    """
+
+    dataset = gdal.Open(raster)
+    if dataset is None:
+        raise Exception("Could not open '{0}' with gdal".format(raster))
+    return dataset
@@ -2,16 +2,31 @@ __author__ = 'jwely'
 __all__ = ["spatially_match"]
 
 from dnppy import core
-from to_numpy import to_numpy
+from read_metadata import read_metadata
 from enf_rastlist import enf_rastlist
-from clip_and_snap import clip_and_snap
+from clip_and_snap import clip_and_snap, _snap_window
 from project_resample import project_resample
 
+from xml.etree import ElementTree
+import threading
 import os
 import arcpy
+import gdal
+from osgeo import osr
+
+# reprojection plans (warped vrt xml) keyed on source and target grids
+_warp_plans      = {}
+_warp_plans_lock = threading.Lock()
+
+# maps arcpy style resampling names to gdal resampling algorithms
+_RESAMPLING = {"NEAREST":   gdal.GRA_NearestNeighbour,
+               "BILINEAR":  gdal.GRA_Bilinear,
+               "CUBIC":     gdal.GRA_Cubic,
+               "MAJORITY":  gdal.GRA_Mode}
+
 
 def spatially_match(snap_raster, rasterlist, outdir,
-                    NoData_Value = False, resamp_type = False):
+                    NoData_Value = False, resamp_type = False, virtual = False):
     """
     Prepares input rasters for further numerical processing.
     This function simply ensures all rasters in "rasterlist" are identically projected
@@ -24,61 +39,285 @@ def spatially_match(snap_raster, rasterlist, outdir,
     comparing different datasets from different sources outside arcmap, for example MODIS
     and Landsat data with an ASTER DEM.
 
+    With ``virtual = True``, no pixels are processed at all. A lightweight gdal virtual
+    raster (vrt) aligned to the grid of the snap raster is written for each input, which
+    reprojects, resamples and clips its source only when it is read (by ``to_numpy``,
+    ``iter_blocks``, or any other gdal or arcmap reader). Inputs which share a projection,
+    geotransform and size with one already matched reuse its reprojection plan, so
+    matching a whole stack of rasters on the same grid costs a single warp plan.
+
     :param snap_raster:     raster to which all other images will be snapped
     :param rasterlist:      list of rasters, a single raster, or a directory full of tiffs which
                             will be clipped to the extent of "snap_raster" and aligned such that
                             the cells are perfectly coincident.
     :param outdir:          the output directory to save newly created spatially matched tifs.
+    :param NoData_Value:    NoData value of the outputs, defaults to that of each input.
     :param resamp_type:     The resampling type to use if images are not identical cell sizes.
                             "NEAREST","BILINEAR",and "CUBIC" are the most common.
+    :param virtual:         set True to write virtual rasters (vrt) instead of tifs.
+
+    :return output_filelist: list of spatially matched rasters created by this function
 
     this function automatically invokes
         * clip_and_snap
         * project_resample
     """
 
-    # import modules and sanitize inputs
-    tempdir = os.path.join(outdir, 'temp')
-
     if not os.path.isdir(outdir):
         os.makedirs(outdir)
-    if not os.path.isdir(tempdir):
-        os.makedirs(tempdir)
 
     rasterlist = enf_rastlist(rasterlist)
     core.exists(snap_raster)
 
-    usetemp = False
-    tempname = None
+    print('Loading snap raster {0}'.format(snap_raster))
+    snap_meta = read_metadata(snap_raster)
+    print('Bounds of rectangle to define boundaries: [{0}]'.format(snap_meta.rectangle))
+
+    if virtual:
+        output_filelist = []
+        for rastname in rasterlist:
+            outname = core.create_outname(outdir, rastname, "sm", "vrt")
+            _match_virtual(snap_meta, rastname, outname, NoData_Value, resamp_type)
+            output_filelist.append(outname)
+            print('Finished matching raster {0}'.format(rastname))
+
+        return output_filelist
+
+    # import modules and sanitize inputs
+    tempdir = os.path.join(outdir, 'temp')
+    if not os.path.isdir(tempdir):
+        os.makedirs(tempdir)
 
     # set the snap raster environment in arcmap.
     arcpy.env.snapRaster = snap_raster
 
-    print('Loading snap raster {0}'.format(snap_raster))
-    _,snap_meta = to_numpy(snap_raster)
-    print('Bounds of rectangle to define boundaries: [{0}]'.format(snap_meta.rectangle))
+    output_filelist = []
 
     # for every raster in the raster list, snap rasters and clip.
     for rastname in rasterlist:
 
-        _,meta      = to_numpy(rastname)
+        meta        = read_metadata(rastname, cache = False)
         head,tail   = os.path.split(rastname)
+        tempname    = None
 
-        if snap_meta.projection.projectionName != meta.projection.projectionName:
+        if not _same_projection(snap_meta.projection, meta.projection):
             print('Projection discrepancy found. Reprojecting...')
             project_resample(rastname, snap_raster, tempdir, resamp_type)
             tempname    = core.create_outname(tempdir,tail,"p")
-            usetemp     = True
 
         # define an output name and run the Clip_ans_Snap_Raster function on formatted tifs
         outname      = core.create_outname(outdir, rastname, "sm")
 
         # if a temporary file was created in previous steps, use that one for clip and snap
-        if usetemp and tempname is not None:
+        if tempname is not None:
             clip_and_snap(snap_raster, tempname, outname, NoData_Value)
         else:
             clip_and_snap(snap_raster, rastname, outname, NoData_Value)
+        output_filelist.append(outname)
 
         print('Finished matching raster {0}'.format(rastname))
 
+    return output_filelist
+
+
+def _match_virtual(snap_meta, rastname, outname, NoData_Value = False, resamp_type = False):
+    """
+    writes a virtual raster of rastname on the grid of the snap raster.
+    Rasters on the same grid as the snap raster are simply windowed, all others
+    are warped with a reprojection plan which is cached per source and target grid.
+    Only gdal 1.11 APIs are used, the vrt xml is edited with ElementTree.
+
+    :param snap_meta:       metadata of the snap raster
+    :param rastname:        filepath of the raster to match
+    :param outname:         filepath of the output vrt
+    :param NoData_Value:    NoData value of the output, False or None to use that of rastname
+    :param resamp_type:     arcpy style resampling name, such as "BILINEAR"
+    """
+
+    meta = read_metadata(rastname, cache = False)
+    if NoData_Value is None or NoData_Value is False:
+        NoData_Value = meta.NoData_Value
+
+    source = os.path.abspath(rastname)
+
+    same_grid = (_same_projection(snap_meta.projection, meta.projection)
+                 and abs(meta.cellWidth - snap_meta.cellWidth) < 1e-9 * snap_meta.cellWidth
+                 and abs(meta.cellHeight - snap_meta.cellHeight) < 1e-9 * snap_meta.cellHeight)
+
+    if same_grid:
+        vrt = _window_vrt(source, meta, snap_meta, NoData_Value)
+        ElementTree.ElementTree(vrt).write(outname)
+        return
+
+    if resamp_type:
+        if resamp_type.upper() not in _RESAMPLING:
+            raise ValueError("unknown resampling type '{0}', use one of {1}".format(
+                resamp_type, sorted(_RESAMPLING.keys())))
+        resampling = resamp_type.upper()
+    else:
+        resampling = "NEAREST"
+
+    key = (meta.projection, meta.geotransform, meta.Xsize, meta.Ysize, meta.Zsize,
+           meta.numpy_datatype, meta.NoData_Value, snap_meta.projection,
+           snap_meta.geotransform, snap_meta.Xsize, snap_meta.Ysize, resampling, NoData_Value)
+
+    with _warp_plans_lock:
+        plan = _warp_plans.get(key)
+
+    if plan is None:
+        plan = _warp_plan(source, snap_meta, resampling, NoData_Value)
+        with _warp_plans_lock:
+            _warp_plans[key] = plan
+
+    # point a copy of the cached plan at this raster
+    vrt = ElementTree.fromstring(plan)
+    for element in vrt.iter("SourceDataset"):
+        element.text = source
+        element.set("relativeToVRT", "0")
+
+    ElementTree.ElementTree(vrt).write(outname)
+    return
+
+
+def _window_vrt(source, meta, snap_meta, NoData_Value):
+    """
+    builds a vrt of source clipped (or padded) to the extent of the snap raster,
+    for a source with the same projection and cell size as the snap raster.
+
+    :return vrt:    ElementTree Element of the vrt
+    """
+
+    dataset = gdal.Open(source)
+    vrt_dataset = gdal.GetDriverByName("VRT").CreateCopy("", dataset)
+    if vrt_dataset is None:
+        raise Exception("Could not build a virtual raster of {0}".format(source))
+
+    vrt = ElementTree.fromstring(vrt_dataset.GetMetadata("xml:VRT")[0])
+    vrt_dataset = None
+    dataset = None
+
+    # the part of the snap window that overlaps the source
+    xoff, yoff, xs, ys = _snap_window(meta, snap_meta)
+    x0, x1 = max(xoff, 0), min(xoff + xs, meta.Xsize)
+    y0, y1 = max(yoff, 0), min(yoff + ys, meta.Ysize)
+
+    vrt.set("rasterXSize", str(xs))
+    vrt.set("rasterYSize", str(ys))
+    vrt.find("GeoTransform").text = _geotransform_text(snap_meta.geotransform)
+
+    for band in vrt.findall("VRTRasterBand"):
+        if NoData_Value is not None:
+            _set_text(band, "NoDataValue", repr(float(NoData_Value)))
+
+        for source_element in list(band):
+            if not source_element.tag.endswith("Source"):
+                continue
+
+            if x1 <= x0 or y1 <= y0:
+                band.remove(source_element)
+                continue
+
+            source_element.find("SourceFilename").text = source
+            source_element.find("SourceFilename").set("relativeToVRT", "0")
+            _set_rect(source_element, "SrcRect", x0, y0, x1 - x0, y1 - y0)
+            _set_rect(source_element, "DstRect", x0 - xoff, y0 - yoff, x1 - x0, y1 - y0)
+
+    return vrt
+
+
+def _warp_plan(source, snap_meta, resampling, NoData_Value):
+    """
+    builds a warped vrt of source on the snap raster grid, in memory. The
+    warped vrt gdal picks for the source is moved onto the snap raster grid
+    by replacing its size and destination geotransforms.
+
+    :return plan:   vrt xml string
+    """
+
+    dataset = gdal.Open(source)
+    warped  = gdal.AutoCreateWarpedVRT(dataset, dataset.GetProjection(), snap_meta.projection,
+                                       _RESAMPLING[resampling], 0.125)
+    if warped is None:
+        raise Exception("Could not build a reprojection plan for {0}".format(source))
+
+    vrt = ElementTree.fromstring(warped.GetMetadata("xml:VRT")[0])
+    warped  = None
+    dataset = None
+
+    gt = snap_meta.geotransform
+    vrt.set("rasterXSize", str(snap_meta.Xsize))
+    vrt.set("rasterYSize", str(snap_meta.Ysize))
+    vrt.find("GeoTransform").text = _geotransform_text(gt)
+
+    for element in vrt.iter("DstGeoTransform"):
+        element.text = _geotransform_text(gt)
+    for element in vrt.iter("DstInvGeoTransform"):
+        element.text = _geotransform_text(_invert_geotransform(gt))
+
+    if NoData_Value is not None:
+        for band in vrt.findall("VRTRasterBand"):
+            _set_text(band, "NoDataValue", repr(float(NoData_Value)))
+
+        for mapping in vrt.iter("BandMapping"):
+            _set_text(mapping, "DstNoDataReal", repr(float(NoData_Value)))
+            _set_text(mapping, "DstNoDataImag", "0")
+
+        # areas outside the source are initialized to NoData
+        options = vrt.find("GDALWarpOptions")
+        for option in options.findall("Option"):
+            if option.get("name") == "INIT_DEST":
+                options.remove(option)
+        init = ElementTree.SubElement(options, "Option", name = "INIT_DEST")
+        init.text = "NO_DATA"
+
+    return ElementTree.tostring(vrt)
+
+
+def _set_text(parent, tag, text):
+    """ sets the text of a child element of parent, creating it if needed """
+
+    element = parent.find(tag)
+    if element is None:
+        element = ElementTree.SubElement(parent, tag)
+    element.text = text
     return
+
+
+def _set_rect(parent, tag, xoff, yoff, xsize, ysize):
+    """ sets a SrcRect or DstRect element of a vrt source """
+
+    element = parent.find(tag)
+    if element is None:
+        element = ElementTree.SubElement(parent, tag)
+    element.set("xOff", str(xoff))
+    element.set("yOff", str(yoff))
+    element.set("xSize", str(xsize))
+    element.set("ySize", str(ysize))
+    return
+
+
+def _geotransform_text(gt):
+    """ formats a geotransform the way vrt files store them """
+    return ", ".join(repr(float(value)) for value in gt)
+
+
+def _invert_geotransform(gt):
+    """ inverts a geotransform, mapping georeferenced coordinates to pixel coordinates """
+
+    det = gt[1] * gt[5] - gt[2] * gt[4]
+    return ((gt[2] * gt[3] - gt[0] * gt[5]) / det, gt[5] / det, -gt[2] / det,
+            (gt[0] * gt[4] - gt[1] * gt[3]) / det, -gt[4] / det, gt[1] / det)
+
+
+def _same_projection(wkt_a, wkt_b):
+    """
+    checks if two well known text projection strings describe the same
+    coordinate system, regardless of formatting differences.
+    """
+
+    srs_a = osr.SpatialReference()
+    srs_a.ImportFromWkt(wkt_a)
+    srs_b = osr.SpatialReference()
+    srs_b.ImportFromWkt(wkt_b)
+
+    return bool(srs_a.IsSame(srs_b))
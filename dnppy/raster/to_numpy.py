@@ -4,30 +4,80 @@ __all__ = ["to_numpy"]
 
 from is_rast import is_rast
 from metadata import metadata
+from read_metadata import read_metadata, _open_gdal
+from block_cache import _cached_read
 
 import os
 import arcpy
 import numpy
 
-def to_numpy(raster, numpy_datatype = None):
+def to_numpy(raster, numpy_datatype = None, window = None, mask_mode = "bool", cache = True):
 
     """
-    Wrapper for arcpy.RasterToNumpyArray with better metadata handling
+    Reads a raster into a numpy array with better metadata handling
 
-    This is just a wraper for the RasterToNumPyArray function within arcpy, but it also
+    Rasters are read with gdal, through the block cache of this module (see
+    ``raster.block_cache_info``), so reading the same raster again is nearly free. It also
     extracts out all the spatial referencing information that will probably be needed
     to save the raster after desired manipulations have been performed.
-    also see raster.from_numpy function in this module.
+    also see raster.from_numpy function in this module. Raster formats that gdal cannot
+    read are handled by the RasterToNumPyArray function within arcpy.
 
-    :param raster:         Any raster supported by the arcpy.RasterToNumPyArray function
+    When a ``window`` is given, only that block of pixels is read from disk,
+    and the returned metadata describes the window (offset extents and geotransform),
+    so it may be saved with ``from_numpy`` as a raster of its own. See also
+    ``raster.iter_blocks`` for stepping through an entire raster in bounded memory.
+
+    :param raster:         Any raster supported by gdal or the arcpy.RasterToNumPyArray function
     :param numpy_datatype: must be a string equal to any of the types listed at the following
                            address [http://docs.scipy.org/doc/numpy/user/basics.types.html]
                            for example: 'uint8' or 'int32' or 'float32'
+    :param window:         optional pixel window to read, as a tuple of
+                           ``(xoff, yoff, xsize, ysize)`` counted from the upper left corner.
+    :param mask_mode:      how NoData is represented in the output.
+                           "bool" (default) returns a masked array with a one byte per
+                           pixel boolean mask, made with a single comparison.
+                           "sentinel" returns the plain array with no mask at all, NoData
+                           pixels simply keep the value of ``Metadata.NoData_Value``.
+                           "nan" returns a plain float array with NoData pixels set to NaN
+                           in place, and requires a floating point ``numpy_datatype``.
+    :param cache:          set False for rasters that are read only once, such as the
+                           inputs of batch functions, to read them without filling the
+                           block and metadata caches.
 
     :return numpy_rast:   the numpy array version of the input raster
     :return Metadata:     a metadata object. see ``raster.metadata``
     """
 
+    if window is not None:
+        meta    = read_metadata(raster, cache).offset_window(*window)
+        dataset = _open_gdal(raster)
+
+        if numpy_datatype is None:
+            numpy_datatype = meta.numpy_datatype
+
+        numpy_rast = _read_window(dataset, meta.window, numpy_datatype, cache)
+        dataset = None
+
+        return _mask_nodata(numpy_rast, meta.NoData_Value, numpy_datatype, mask_mode), meta
+
+    if is_rast(raster):
+        meta    = read_metadata(raster, cache)
+        dataset = _open_gdal(raster)
+
+        if numpy_datatype is None:
+            numpy_datatype = meta.numpy_datatype
+
+        numpy_rast = _read_window(dataset, (0, 0, meta.Xsize, meta.Ysize), numpy_datatype, cache)
+        dataset = None
+
+        # multi band rasters get a metadata object for each band
+        if numpy_rast.ndim == 3:
+            meta = [read_metadata(raster, cache) for z in range(numpy_rast.shape[0])]
+            return _mask_nodata(numpy_rast, meta[0].NoData_Value, numpy_datatype, mask_mode), meta
+
+        return _mask_nodata(numpy_rast, meta.NoData_Value, numpy_datatype, mask_mode), meta
+
     # perform some checks to convert to supported data format
     if not is_rast(raster):
         try:
@@ -65,22 +115,95 @@ def to_numpy(raster, numpy_datatype = None):
         if numpy_datatype is None:
             numpy_datatype = meta.numpy_datatype
 
-    numpy_rast = numpy_rast.astype(numpy_datatype)
+    numpy_rast = numpy_rast.astype(numpy_datatype, copy = False)
+
+    return _mask_nodata(numpy_rast, meta.NoData_Value, numpy_datatype, mask_mode), meta
+
+
+def _read_window(dataset, window, numpy_datatype, cache = True):
+    """
+    reads a pixel window from every band of an open gdal.Dataset, through
+    the block cache.
+
+    :param dataset:         gdal.Dataset object
+    :param window:          tuple of (xoff, yoff, xsize, ysize)
+    :param numpy_datatype:  numpy datatype string of the output array
+    :param cache:           set False to read straight from disk, for windows that
+                            are read only once, so they don't evict reused blocks
+
+    :return numpy_rast:     2d array for single band rasters, 3d (band, y, x) otherwise
+    """
+
+    xoff, yoff, xsize, ysize = window
+    zs = dataset.RasterCount
+
+    if not cache:
+        bands = [dataset.GetRasterBand(z + 1).ReadAsArray(xoff, yoff, xsize, ysize)
+                 for z in range(zs)]
+        if zs == 1:
+            return bands[0].astype(numpy_datatype, copy = False)
+        return numpy.array(bands, dtype = numpy_datatype)
+
+    numpy_rast = numpy.empty((zs, ysize, xsize), dtype = numpy_datatype)
+    for z in range(zs):
+        numpy_rast[z] = _cached_read(dataset, z + 1, window)
+
+    if zs == 1:
+        return numpy_rast[0]
+    return numpy_rast
+
+
+def _mask_nodata(numpy_rast, NoData_Value, numpy_datatype, mask_mode = "bool"):
+    """
+    marks NoData values in a numpy array, without copying the array
+
+    :param numpy_rast:      numpy array already of type numpy_datatype
+    :param NoData_Value:    the value representing NoData in numpy_rast
+    :param numpy_datatype:  numpy datatype string of numpy_rast
+    :param mask_mode:       "bool", "sentinel" or "nan". see ``to_numpy``
+
+    :return numpy_rast:     numpy.ma.MaskedArray for "bool", numpy array otherwise
+    """
+
+    is_float = 'float' in str(numpy_datatype)
 
-    # mask NoData values from the array
-    if 'float' in numpy_datatype:
-        numpy_rast[numpy_rast == meta.NoData_Value] = numpy.nan
-        numpy_rast = numpy.ma.masked_array(numpy_rast, numpy.isnan(numpy_rast),
-                                           dtype = numpy_datatype)
+    if mask_mode == "sentinel":
+        return numpy_rast
 
-    elif 'int' in numpy_datatype: # (numpy.nan not supported by ints)
-        mask = numpy.zeros(numpy_rast.shape)
-        mask[numpy_rast != meta.NoData_Value] = False    # do not mask
-        mask[numpy_rast == meta.NoData_Value] = True     # mask
-        numpy_rast = numpy.ma.masked_array(numpy_rast, mask,
-                                           dtype = numpy_datatype)
+    elif mask_mode == "nan":
+        if not is_float:
+            raise ValueError("mask_mode 'nan' requires a float numpy_datatype")
+        if NoData_Value is not None:
+            _where_nodata(numpy_rast, NoData_Value, numpy_rast, numpy.nan)
+        return numpy_rast
+
+    elif mask_mode != "bool":
+        raise ValueError("mask_mode must be 'bool', 'sentinel' or 'nan', not '{0}'".format(mask_mode))
+
+    if is_float:
+        mask = numpy.isnan(numpy_rast)
+        if NoData_Value is not None:
+            _where_nodata(numpy_rast, NoData_Value, mask, True)
+
+    elif NoData_Value is not None:
+        mask = numpy_rast == NoData_Value
+
+    else:
+        mask = numpy.ma.nomask
+
+    return numpy.ma.masked_array(numpy_rast, mask, copy = False)
+
+
+def _where_nodata(numpy_rast, NoData_Value, out, value, chunk_rows = 256):
+    """
+    sets out to value wherever a 2d or 3d numpy_rast equals NoData_Value. Works through
+    the array in chunks of rows, so the comparison never makes a full size temporary.
+    """
 
-    return numpy_rast, meta
+    for start in range(0, numpy_rast.shape[-2], chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        out[..., rows, :][numpy_rast[..., rows, :] == NoData_Value] = value
+    return
 
 
 # testing area
@@ -6,13 +6,14 @@ from dnppy import textio
 # standard imports
 import numpy
 import os
+import weakref
 from datetime import datetime, timedelta
 from calendar import monthrange, isleap
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 
 
-class time_series():
+class time_series(object):
     """
     A subsettable time series object
 
@@ -32,9 +33,19 @@ class time_series():
     time series, where the steps of the method depend on weather the time
     series is at its smallest subset or not.
 
-    MEMORY WARNING. The entirety of the dataset is represented in every layer
-    of subsetting, so watch out for exploding memory consumption by
-    excessive subsetting of gigantic datasets.
+    Data is stored column wise, as one numpy array per column, with the time
+    column held as a datetime64 array. Numeric columns are kept as numbers, and
+    text columns as compact numpy strings, which are converted to floats only
+    once when statistics are first taken on them. The ``row_data``, ``col_data``,
+    ``time_dom``, ``time_seconds`` and ``time_dec_days`` attributes are views of
+    these columns which are built the first time they are used.
+
+    Subsets are lightweight views of the rows of their parent. A subset only
+    holds the range or array of row indices it was made from, and takes its
+    columns from the top level time series when they are first used, so nested
+    subsetting copies no data and parses no time strings. Ranges of rows are
+    numpy views and are never copied. A subset gets its own copy of its rows
+    only before the parent's rows change.
     """
 
     def __init__(self, name = "name", units = None, subsetted = False,
@@ -52,6 +63,7 @@ class time_series():
             self.headers        # one header for each col in dataset
 
             self.time_col       # index of data column with time info
+            self.time_header    # header of data column with time info
             self.time           # separate copy of data[time_col]
             self.time_dom       # self.time converted to list of datetime objs
             self.time_dec_days  # self.time converted to mono rising decimal days
@@ -79,18 +91,19 @@ class time_series():
         self.headers        = []          # one header for each col in dataset (list of strings)
 
         self.time_col       = 0           # index of data column with time info (int)
-        self.time           = []          # separate copy of data[time_col] (list of strings)
-        self.time_dom       = False       # self.time converted to (list of datetime objs)
-        self.time_dec_days  = []          # self.time converted to (mono rising decimal days floats)
-        self.time_seconds   = []          # self.time converted to (mono rising seconds floats)
+        self.time_header    = None        # header of data column with time info (string)
         self.center_time    = []          # time around which data in a subset it centered (dto)
         self.start_dto      = []          # datetime_object that mono rising times start from (dto)
         self.mean_interval  = 0           # average number of seconds between data points (float)
 
         self.subsets        = []          # object list containing constituent time_series
 
-        self.row_data       = []          # row wise dataset
-        self.col_data       = []          # column wise dataset, built as dict
+        self._own_columns   = {}          # column wise dataset (dict of numpy arrays)
+        self._own_time64    = None        # time column as datetime64 (numpy array)
+        self._views         = {}          # lazily built views of the columns, see build_col_data
+
+        self._source        = None        # (time_series, row index) a subset views, if any
+        self._viewers       = weakref.WeakSet()   # subsets viewing the rows of this time series
 
         self.bad_rows       = []          # subset from data attribute with "bad rows"
 
@@ -166,6 +179,225 @@ class time_series():
             raise Exception("Unrecognized argument type! use int, slice, or string!")
 
 
+    @property
+    def row_data(self):
+        """ row wise dataset, a list of rows built from the columns when first used """
+
+        if "row_data" not in self._views:
+            columns = [self._columns[header].tolist() for header in self.headers
+                       if header in self._columns]
+            self._views["row_data"] = [list(row) for row in zip(*columns)]
+        return self._views["row_data"]
+
+
+    @row_data.setter
+    def row_data(self, rows):
+        self._set_rows(rows)
+
+
+    @property
+    def col_data(self):
+        """ column wise dataset, a dict of lists built from the columns when first used """
+
+        if "col_data" not in self._views:
+            self._views["col_data"] = dict((header, self._columns[header].tolist())
+                                           for header in self.headers if header in self._columns)
+        return self._views["col_data"]
+
+
+    @property
+    def time(self):
+        """ contents of the time column """
+
+        if self.time_header not in self._columns:
+            return []
+        return self.col_data[self.time_header]
+
+
+    @property
+    def time_dom(self):
+        """ time column as a list of datetime objects, False until define_time is called """
+
+        if self._time64 is None:
+            return False
+        if "time_dom" not in self._views:
+            self._views["time_dom"] = self._time64.tolist()
+        return self._views["time_dom"]
+
+
+    @property
+    def time_seconds(self):
+        """ numpy array of seconds since start_dto for every row """
+
+        if self._time64 is None:
+            return numpy.array([], dtype = "float64")
+        if "time_seconds" not in self._views:
+            delta = self._time64 - numpy.datetime64(self.start_dto, "us")
+            self._views["time_seconds"] = delta.astype("int64") / 1e6
+        return self._views["time_seconds"]
+
+
+    @property
+    def time_dec_days(self):
+        """ numpy array of decimal days since start_dto for every row """
+        return self.time_seconds / 86400.0
+
+
+    @property
+    def _columns(self):
+        """ dict of numpy arrays, one per column. Views take them from their source when first used """
+
+        if self._own_columns is None:
+            source, index = self._source
+            self._own_columns = dict((header, source._columns[header][index])
+                                     for header in self.headers if header in source._columns)
+            self._release_source()
+        return self._own_columns
+
+
+    @_columns.setter
+    def _columns(self, columns):
+        self._own_columns = columns
+
+
+    @property
+    def _time64(self):
+        """ datetime64 array of the time column, or None if time is not yet defined """
+
+        if self._own_time64 is None and self._source is not None:
+            source, index = self._source
+            if source._time64 is not None:
+                self._own_time64 = source._time64[index]
+            self._release_source()
+        return self._own_time64
+
+
+    @_time64.setter
+    def _time64(self, times):
+        self._own_time64 = times
+
+
+    def _release_source(self):
+        """ forgets the source of a view once it holds both its columns and times """
+
+        if self._own_columns is not None and self._own_time64 is not None:
+            if self._source is not None:
+                self._source[0]._viewers.discard(self)
+            self._source = None
+        return
+
+
+    def _detach_views(self):
+        """
+        gives every subset which still views the rows of this time series its own
+        columns and times, which must be done before these rows change. Rows in a
+        range stay numpy views of the old arrays, so they are still not copied.
+        """
+
+        for view in list(self._viewers):
+            view._columns
+            view._time64
+            view._source = None
+
+        self._viewers = weakref.WeakSet()
+        return
+
+
+    def _subset_view(self, index, units):
+        """
+        creates a subset of the same class as this time series, which is a view of
+        some of its rows. Nothing is copied or parsed, views of views refer straight
+        to the rows of the top level time series.
+
+        :param index:   slice of rows, or sorted array of row indices
+        :param units:   units of the subset
+
+        :return subset: new time_series
+        """
+
+        source = self
+        if self._own_columns is None and self._source is not None:
+            source, outer = self._source
+            index = _compose_index(outer, index)
+
+        subset = type(self)(units = units, parent = self)
+        subset._own_columns = None
+        subset._source = (source, index)
+        source._viewers.add(subset)
+
+        # same time domain information as define_time, from the already sorted times
+        times = subset._time64
+        subset.start_dto     = times[0].astype("datetime64[D]").astype("datetime64[us]").tolist()
+        subset.span          = (times[-1] - times[0]).tolist()
+        subset.mean_interval = subset.span.total_seconds() / len(times)
+        return subset
+
+
+    def _nrows(self):
+        """ number of rows in the dataset """
+
+        if self._time64 is not None:
+            return len(self._time64)
+        for column in self._columns.values():
+            return len(column)
+        return 0
+
+
+    def _set_rows(self, rows):
+        """ stores a list of rows as one typed numpy array per column """
+
+        rows    = list(rows)
+        columns = zip(*rows) if rows else [[]] * len(self.headers)
+
+        self._detach_views()
+        if self._source is not None:
+            self._source[0]._viewers.discard(self)
+            self._source = None
+
+        self._columns = {}
+        for header, column in zip(self.headers, columns):
+            self._columns[header] = _as_column(column)
+
+        self._time64 = None
+        self._views  = {}
+        return
+
+
+    def _take(self, index):
+        """ keeps only the rows at index, an array of row indices, in that order """
+
+        self._detach_views()
+        for header in self._columns:
+            self._columns[header] = self._columns[header][index]
+
+        if self._time64 is not None:
+            self._time64 = self._time64[index]
+
+        self._views = {}
+        return
+
+
+    def _numeric(self, col_header):
+        """ float64 array of a column, parsed once. Invalid numbers are NaN """
+
+        if not col_header in self._columns:
+            raise LookupError("{0} header not in dataset!".format(col_header))
+
+        key = ("numeric", col_header)
+        if key not in self._views:
+            values, invalid = _parse_floats(self._columns[col_header])
+            self._views[key] = values
+            self._views[("invalid", col_header)] = invalid
+        return self._views[key]
+
+
+    def _invalid(self, col_header):
+        """ boolean array of a column, True where a value is not a number at all """
+
+        self._numeric(col_header)
+        return self._views[("invalid", col_header)]
+
+
     def _get_atts_from(self, parent_time_series):
         """
         Allows bulk setting of attributes. Useful for allowing a subset to inherit
@@ -175,7 +407,7 @@ class time_series():
         """
 
         self.fmt            = parent_time_series.fmt
-        self.headers        = parent_time_series.headers
+        self.headers        = list(parent_time_series.headers)
         self.time_col       = parent_time_series.time_col
         self.time_header    = parent_time_series.time_header
         self.disc_level     = parent_time_series.disc_level + 1
@@ -233,11 +465,9 @@ class time_series():
         """  special case of "extract_column" method for time domain. """
 
         self.time_header = time_header
-        self.build_col_data()
 
         if time_header in self.headers:
                 self.time_col   = self.headers.index(time_header)
-                self.time       = self.col_data[time_header]
         else:
             raise LookupError("Time header not in dataset!")
 
@@ -245,7 +475,7 @@ class time_series():
             for subset in self.subsets:
                 subset._extract_time(time_header)
 
-        return self.time
+        return self._columns.get(time_header)
 
     @staticmethod
     def _center_datetime(datetime_obj, units):
@@ -263,6 +493,12 @@ class time_series():
 
         dto = datetime_obj
         
+        if units == "minute":
+            return datetime(dto.year, dto.month, dto.day, dto.hour, dto.minute, 29, 999)
+
+        if units == "hour":
+            return datetime(dto.year, dto.month, dto.day, dto.hour, 29, 59, 999)
+
         if units == "day":
             # noon minus 1 millisecond. (better handles daily data with no hour info)
             return datetime(dto.year, dto.month, dto.day, 11, 59, 59, 999)
@@ -344,7 +580,7 @@ class time_series():
         if isinstance(self.center_time, datetime):
             datetime_obj = self.center_time
         else:
-            datetime_obj = self.time_dom[0]
+            datetime_obj = self._time64[0].tolist()
 
         if binned:
             self.name = datetime_obj.strftime(self._units_to_fmt(self.units))
@@ -381,9 +617,14 @@ class time_series():
 
         if header_name in self.headers:
             self.headers[self.headers.index(header_name)] = new_header_name
-            
-            self.col_data[new_header_name] = self.col_data[header_name]
-            del self.col_data[header_name]
+
+        if header_name in self._columns:
+            self._detach_views()
+            self._columns[new_header_name] = self._columns.pop(header_name)
+            self._views = {}
+
+            if self.time_header == header_name:
+                self.time_header = new_header_name
 
         if self.subsetted:
             for subset in self.subsets:
@@ -399,12 +640,9 @@ class time_series():
         :param tdo:     a dnppy.text_data_class object containing time data
         """
 
-        self.headers  = tdo.headers
-        self.enf_unique_headers()
-        
+        # text_data objects already have unique headers
+        self.headers  = list(tdo.headers)
         self.row_data = tdo.row_data
-
-        self.build_col_data()
         return
 
 
@@ -438,7 +676,7 @@ class time_series():
             csv_path = csv_path.replace(".csv", "_out.csv")
 
         print("Saved time series '{0}' with {1} rows and {2} columns".format(
-                                    self.name, len(self.row_data), len(self.col_data)))
+                                    self.name, self._nrows(), len(self.headers)))
 
         tdo = textio.text_data( text_filepath   = csv_path,
                                 headers         = self.headers,
@@ -458,23 +696,29 @@ class time_series():
         :param fmt:             the format of data in that time column
         """
 
+        self.headers  = list(headers)
         self.row_data = data
-        self.headers  = headers
 
         # populates self.time with time series
-        self.define_time(self.time_header, self.fmt)
-        self.build_col_data()
+        self.define_time(time_header, fmt)
         return
 
 
     def build_col_data(self):
-        """ builds columnwise data matrix with an actual dict """
+        """
+        Rebuilds the columns from ``row_data``, so rows edited or appended in place
+        take effect. If a time domain was defined, it is parsed again from the new rows.
+        The ``col_data`` view is rebuilt from the columns when next used.
+        """
 
-        temp_col = zip(*self.row_data)
+        if "row_data" in self._views:
+            timed = self._time64 is not None
+            self._set_rows(self._views["row_data"])
 
-        self.col_data = {}
-        for i, col in enumerate(temp_col):
-            self.col_data[self.headers[i]] = list(col)
+            if timed:
+                self._build_time(self.time_header, self.fmt, self.start_dto)
+
+        self._views = {}
         return
 
 
@@ -496,46 +740,29 @@ class time_series():
                 
         # clean for just one input column header
         else:
-            if not col_header in self.headers:
-                raise LookupError("{0} header not in dataset!".format(col_header))
-
-            col_index = self.headers.index(col_header)
-            temp_data = self.row_data
-            self.row_data = []
-
-            bad_count = 0
-            for row in temp_data:
+            # only values which can't be read as numbers are bad, NaN values are kept
+            # unless a threshold is given, which they never satisfy
+            values  = self._numeric(col_header)
+            invalid = self._invalid(col_header)
+            keep    = ~invalid
+            bad     = numpy.nonzero(invalid)[0]
+
+            with numpy.errstate(invalid = "ignore"):
+                if high_thresh != False:
+                    keep[keep] = values[keep] <= high_thresh
+                if low_thresh != False:
+                    keep[keep] = values[keep] >= low_thresh
+
+            if len(bad) > 0:
+                rows = self.row_data
+                self.bad_rows += [rows[i] for i in bad]
 
-                try:
-                    test = float(row[col_index])
-                    
-                    if   high_thresh == False and low_thresh == False:
-                        self.row_data.append(row)
-                        
-                    elif high_thresh == False and low_thresh != False:
-                        if test >= low_thresh:
-                            self.row_data.append(row)
-
-                    elif high_thresh != False and low_thresh == False:
-                        if test <= high_thresh:
-                            self.row_data.append(row)
-                        
-                    elif high_thresh != False and low_thresh != False:
-                        if test >= low_thresh and test <= high_thresh:
-                            self.row_data.append(row)
-                            
-                except:
-                    bad_count += 1
-                    self.bad_rows.append(row)
-                    continue
-
-            if bad_count >0:
                 print("Removed {0} rows from '{1}' with invalid '{2}'".format(
-                    bad_count, self.name, col_header))
-                
+                    len(bad), self.name, col_header))
 
-            # since rows have been removed, we must redefine the time domain. (sloppy, but concise)
-            self.define_time(self.time_header, self.fmt, self.start_dto)
+            # rows keep their time order, so the time domain needs no redefinition
+            if not keep.all():
+                self._take(numpy.nonzero(keep)[0])
 
             if self.subsetted:
                 for subset in self.subsets:
@@ -559,10 +786,11 @@ class time_series():
 
         else:
             if self.subsetted:
-                self.row_data = []
-                for subset in self.subsets:
-                    for row in subset.row_data:
-                        self.row_data.append(row)
+                self._detach_views()
+                for header in self.headers:
+                    self._columns[header] = numpy.concatenate(
+                        [subset._columns[header] for subset in self.subsets])
+                self._views = {}
 
                 self.define_time(self.time_header, self.fmt)
 
@@ -584,14 +812,13 @@ class time_series():
 
         new_header  = "_".join([header1, header2])
 
-        for i, entry in enumerate(self.row_data):
-                new_field   = "".join([self.col_data[header1][i], self.col_data[header2][i]])
-
-                self.row_data[i].append(new_field)
+        self._columns[new_header] = numpy.char.add(_as_text(self._columns[header1]),
+                                                   _as_text(self._columns[header2]))
 
         # updates column and row data
-        self.headers.append(new_header)
-        self.build_col_data()
+        if new_header not in self.headers:
+            self.headers.append(new_header)
+        self._views = {}
 
         print("merged '{0}' and '{1}' columns into new column '{2}'".format(header1, header2, new_header))
 
@@ -603,12 +830,9 @@ class time_series():
 
     def _build_time(self, time_header, fmt, start_date = False):
         """
-        This internal use function is called twice by "define_time". Once to turn
-        all the datestamps into datetime objects, then a second time once the entire
-        dataset has been sorted in ascending time order by those datetime objects.
-
-        This is to ensure all time values are in terms of the correct start time,
-        which can be no later than the earliest entry in the dataset.
+        This internal use function is called by "define_time" to turn all the
+        datestamps into a datetime64 array. Unless a start date is given, time
+        values count up from the start of the day of the earliest entry in the dataset.
 
         :param time_header: name of column with time data in it
         :param fmt:         the fmt string to interpret time data into datetime objects
@@ -625,6 +849,10 @@ class time_series():
         if isinstance(time_header, int):
             time_header = self.headers[time_header]
 
+        # convert datestamps into a datetime64 array
+        times = _parse_times(self._columns[self.time_header], fmt)
+        self._detach_views()
+
         # use manual start date (str or dto) or set to begining of first day on record
         if isinstance(start_date, str):
             start = datetime.strptime(start_date, fmt)
@@ -633,33 +861,11 @@ class time_series():
             start = start_date
 
         else:
-            earliest = datetime.strptime(self.time[0], fmt)
-            start = datetime(earliest.year, earliest.month, earliest.day, 0,0,0,0)
-
-        # convert datestamps into datetime objects
-        datestamp_list      = self.time
-        
-        self.time_dom       = []
-        self.time_dec_days  = []
-        self.time_seconds   = []
-
-        for i,datestamp in enumerate(datestamp_list):
+            start = times.min().astype("datetime64[D]").astype("datetime64[us]").tolist()
 
-            # If error, give user information about the line on which the error occurs
-            try:
-                t = datetime.strptime(datestamp, fmt)
-            except:
-                raise Exception("Input '{0}' in line {1} is not of format {2}".format(
-                                datestamp, i+2 , fmt))
-            
-            # initial absolute time ordering to help with sorting.
-            self.time_dom.append(t)
-            delta = t - start
-            delta = float(delta.total_seconds())
-            self.time_seconds.append(float(delta))
-            self.time_dec_days.append(float(delta / 86400))
-
-        self.start_dto = start
+        self._time64    = times
+        self.start_dto  = start
+        self._views     = {}
         return
 
         
@@ -685,23 +891,11 @@ class time_series():
         self._build_time(time_header, fmt, start_date)
         
         # sort data such that it is in ascending order by time.
-        sorted_rows = range(len(self.row_data))
-        indices     = range(len(self.row_data))
-        indices     = sorted(indices, key = self.time_seconds.__getitem__)
-        
-        for i,j in enumerate(indices):
-            sorted_rows[i] = self.row_data[j]
-
-        self.row_data = sorted_rows
-        self.build_col_data()
-        
-        # recalculate time domain information now that rows are in proper order
-        if min(self.time_seconds) < 0:
-            self._build_time(time_header, fmt, start_date)
+        self._take(numpy.argsort(self._time64, kind = "mergesort"))
 
         # calculate the mean_interval in seconds
-        self.span           = self.time_dom[-1] - self.time_dom[0]
-        self.mean_interval  = self.span.total_seconds()/len(self.time_dom)
+        self.span           = (self._time64[-1] - self._time64[0]).tolist()
+        self.mean_interval  = self.span.total_seconds()/len(self._time64)
             
         # perform same operation on each subset
         if self.subsetted:
@@ -776,90 +970,113 @@ class time_series():
         else:
             
             self.subsetted = True
+            subset_units = self._fmt_to_units(subset_units)
 
-            # sanitize overlap
-            if overlap_width < 0:
-                print("overlap_width must be 0 or more, setting it to 0!")
-                overlap_width = 0
+            for center_time, first, last in self._subset_windows(subset_units, overlap_width,
+                                                                 cust_center_time):
+                new_subset = self._subset_view(slice(first, last), subset_units)
+                new_subset.center_time = center_time
+                new_subset._name_as_subset()
+                self.subsets.append(new_subset)
 
-            # convert units into subset units and into terms of seconds
-            # timedelta objects can only have units of days or seconds, so we use seconds
-            subset_units = self._fmt_to_units(subset_units)
+        return
 
-            # initial step width
-            step_width = self._units_to_seconds(subset_units)
 
-            if subset_units not in ['year','month','day','minute']:
-               raise Exception("Data is too high resolution to subset by {0}".format(subset_units))
+    def _subset_windows(self, subset_units, overlap_width = 0, cust_center_time = False):
+        """
+        Finds the rows of every subset made by ``make_subsets``. Since rows are sorted
+        by time, the rows within a window around each center time are a contiguous
+        range, and its edges are found with a binary search of the time column.
 
-            print("Subsetting data by {0}".format(subset_units))
+        :return windows:    list of (center_time, first row, last row + 1) tuples, for
+                            every window with at least one row in it.
+        """
 
-            if self.time_dom == False:
-                raise Exception("must call 'define_time' method before taking subsets!")
-            
-            # determine subset lists starting, end points and increment
-            time_s = self.time_dom[0]
-            time_f = self.time_dom[-1]
+        # sanitize overlap
+        if overlap_width < 0:
+            print("overlap_width must be 0 or more, setting it to 0!")
+            overlap_width = 0
 
-            # set up starttime with custom center times.
-            if cust_center_time:
-                
-                print("using custom center time")
-                
-                if subset_units == "month":
-                    ustart  = datetime(time_s.year, time_s.month,
-                                       cust_center_time.day, cust_center_time.hour,
-                                       cust_center_time.minute, cust_center_time.second,
-                                       cust_center_time.microsecond)
-                elif subset_units == "hour":
-                    ustart  = datetime(time_s.year, time_s.month, time_s.day, time_s.hour,
-                                       cust_center_time.minute, cust_center_time.second,
-                                       cust_center_time.microsecond)
-                elif subset_units == "minute":
-                    ustart  = datetime(time_s.year, time_s.month, time_s.day, time_s.hour, time_s.minute,
-                                       cust_center_time.second, cust_center_time.microsecond)
-                else: #subset_units == "day":
-                    ustart  = datetime(time_s.year, time_s.month, time_s.day,
-                                       cust_center_time.hour, cust_center_time.minute,
-                                       cust_center_time.second, cust_center_time.microsecond)
-
-                td      = time_f - time_s
-                uend    = cust_center_time + timedelta(seconds = td.total_seconds())
-
-            # otherwise, set the centers with no offset
-            else:
-                ustart  = self._center_datetime(time_s, subset_units)
-                uend    = self._center_datetime(time_f, subset_units) + timedelta(seconds = step_width)
+        # convert units into subset units and into terms of seconds
+        # timedelta objects can only have units of days or seconds, so we use seconds
+        subset_units = self._fmt_to_units(subset_units)
 
+        # initial step width
+        step_width = self._units_to_seconds(subset_units)
 
-            # Iterate through entire dataset one time step unit at a time.
-            delta = uend - ustart
-            center_time = ustart
+        if subset_units not in ['year','month','day','minute']:
+           raise Exception("Data is too high resolution to subset by {0}".format(subset_units))
 
-            while center_time < uend:
-                
-                step_width   = self._units_to_seconds(subset_units, center_time)
-                wind_seconds = step_width * (overlap_width + 0.5)
+        print("Subsetting data by {0}".format(subset_units))
 
-                temp_data = []
-                for j, current_time in enumerate(self.time_dom):
-                    dt = abs(center_time - current_time)
-                    
-                    if dt.total_seconds() < wind_seconds:
-                        temp_data.append(self.row_data[j])
-
-                # create the subset only if some data was found to populate it
-                if len(temp_data) > 0:
-                    new_subset = time_series(units = subset_units, parent = self)
-                    new_subset.center_time = center_time
-                    new_subset.from_list(temp_data, self.headers, self.time_header, self.fmt)
-                    new_subset.define_time(self.time_header, self.fmt)
-                    new_subset._name_as_subset()
-                    self.subsets.append(new_subset)
+        if self._time64 is None:
+            raise Exception("must call 'define_time' method before taking subsets!")
+        
+        # determine subset lists starting, end points and increment
+        time_s = self._time64[0].tolist()
+        time_f = self._time64[-1].tolist()
 
+        # set up starttime with custom center times.
+        if cust_center_time:
+            
+            print("using custom center time")
+            
+            if subset_units == "month":
+                ustart  = datetime(time_s.year, time_s.month,
+                                   cust_center_time.day, cust_center_time.hour,
+                                   cust_center_time.minute, cust_center_time.second,
+                                   cust_center_time.microsecond)
+            elif subset_units == "hour":
+                ustart  = datetime(time_s.year, time_s.month, time_s.day, time_s.hour,
+                                   cust_center_time.minute, cust_center_time.second,
+                                   cust_center_time.microsecond)
+            elif subset_units == "minute":
+                ustart  = datetime(time_s.year, time_s.month, time_s.day, time_s.hour, time_s.minute,
+                                   cust_center_time.second, cust_center_time.microsecond)
+            else: #subset_units == "day":
+                ustart  = datetime(time_s.year, time_s.month, time_s.day,
+                                   cust_center_time.hour, cust_center_time.minute,
+                                   cust_center_time.second, cust_center_time.microsecond)
+
+            td      = time_f - time_s
+            uend    = cust_center_time + timedelta(seconds = td.total_seconds())
+
+        # otherwise, set the centers with no offset
+        else:
+            ustart  = self._center_datetime(time_s, subset_units)
+            uend    = self._center_datetime(time_f, subset_units) + timedelta(seconds = step_width)
+
+        # step through entire dataset one time step unit at a time. months and years
+        # vary in length, shorter units are evenly spaced.
+        if subset_units in ["month", "year"]:
+            centers      = []
+            wind_seconds = []
+            center_time  = ustart
+
+            while center_time < uend:
+                step_width = self._units_to_seconds(subset_units, center_time)
+                centers.append(center_time)
+                wind_seconds.append(step_width * (overlap_width + 0.5))
                 center_time += timedelta(seconds = step_width)
 
-        return
+            middles = numpy.array(centers, dtype = "datetime64[us]").astype("int64")
+            widths  = numpy.array(wind_seconds) * 1e6
+
+        else:
+            count   = max(0, int(numpy.ceil((uend - ustart).total_seconds() / step_width)))
+            middles = (numpy.datetime64(ustart, "us").astype("int64") +
+                       numpy.arange(count, dtype = "int64") * int(step_width * 1e6))
+            widths  = numpy.full(count, step_width * (overlap_width + 0.5) * 1e6)
+
+        # rows within the window of each center, in integer microseconds
+        times   = self._time64.astype("int64")
+        firsts  = numpy.searchsorted(times, numpy.floor(middles - widths).astype("int64"), "right")
+        lasts   = numpy.searchsorted(times, numpy.ceil(middles + widths).astype("int64"), "left")
+
+        found   = numpy.nonzero(lasts > firsts)[0]
+        centers = middles[found].astype("datetime64[us]").tolist()
+
+        return zip(centers, firsts[found].tolist(), lasts[found].tolist())
 
 
     def group_bins(self, fmt_units, overlap_width = 0, cyclical = True):
@@ -889,8 +1106,6 @@ class time_series():
             day 1 will be considered adjacent to day 365.
         """
 
-        ow = int(overlap_width)
-        
         if self.subsetted:
             for subset in self.subsets:
                 subset.group_bins(fmt_units, overlap_width, cyclical)
@@ -900,45 +1115,15 @@ class time_series():
             self.subsetted = True
 
             # ensure proper unit format is present
-            fmt     = self._units_to_fmt(fmt_units)
-            units   = self._fmt_to_units(fmt_units)
-
-            # set up cyclical parameters
-            if fmt == "%j": cylen = 365
-            if fmt == "%d": cylen = 365
-            if fmt == "%m": cylen = 12
-            if fmt == "%b": cylen = 12
-
-            # initialize a grouping array to idenfity row indices for each subset
-            grouping  = [int(obj.strftime(fmt)) for obj in self.time_dom]
-            
-            for i in xrange(min(grouping),max(grouping) + 1):
-
-                subset_units    = self._fmt_to_units(fmt)
-                new_subset      = time_series( units = subset_units, parent = self)
-
-                # only take rows whos grouping is within ow of i
-                subset_rows = [j for j,g in enumerate(grouping) if g <= i+ow and g >=i-ow]
+            fmt          = self._units_to_fmt(fmt_units)
+            subset_units = self._fmt_to_units(fmt)
 
-                # fix endpoints
-                if cyclical:
-                    if i <= ow:
-                        subset_rows = subset_rows + [j for j,g in enumerate(grouping) if g-cylen <= i+ow and g-cylen >=i-ow]
-                    elif i >= cylen - ow:
-                        subset_rows = subset_rows + [j for j,g in enumerate(grouping) if g+cylen <= i+ow and g+cylen >=i-ow]
+            for key, center, index in _bin_rows(self._time64, fmt, overlap_width, cyclical):
+                new_subset = self._subset_view(index, subset_units)
+                new_subset.center_time = self._time64[center].tolist()
+                new_subset._name_as_subset(binned = True)
 
-                # grab row indeces from parent matrix to put in the subset
-                subset_data = [self.row_data[row] for row in subset_rows]
-
-                # run naming methods and definitions on the new subset
-                if not len(subset_data) == 0:
-                    new_subset.from_list(subset_data, self.headers, self.time_header, self.fmt)
-                    new_subset.define_time(self.time_header, self.fmt)
-                    
-                    new_subset.center_time = self.time_dom[grouping.index(i)]
-                    new_subset._name_as_subset(binned = True)
-
-                    self.subsets.append(new_subset)
+                self.subsets.append(new_subset)
         return
 
     
@@ -964,18 +1149,16 @@ class time_series():
         print("calculating stats for time_series '{0}', col '{1}'".format(self.name,col_header))
 
         # pull column data and find some stats
-        import numpy as np
-
         self.clean(col_header)
-        col_data = map(float, self.col_data[col_header])
+        col_data = self._numeric(col_header)
 
         # build array of stats
-        stats = [max(col_data),
-                 min(col_data),
-                 col_data.index(max(col_data)),
-                 col_data.index(min(col_data)),
-                 np.mean(col_data),
-                 np.std(col_data)]
+        stats = [float(col_data.max()),
+                 float(col_data.min()),
+                 int(col_data.argmax()),
+                 int(col_data.argmin()),
+                 float(col_data.mean()),
+                 float(col_data.std())]
 
         # build array of names
         names = ["{0}_max_v".format(col_header),
@@ -1058,7 +1241,7 @@ class time_series():
         for col_header in col_headers:
 
             stats = self.column_stats(col_header)
-            ax.plot(self.time_dom, self.col_data[col_header], label = col_header)
+            ax.plot(self.time_dom, self._numeric(col_header), label = col_header)
         
         # date formatting stuff
         ax.fmt_xdata = mdates.DateFormatter(self.plot_fmt)
@@ -1091,16 +1274,15 @@ class time_series():
         
         # make sure data is cleaned for numerical formatting
         self.clean(col_header)
-        temp_col = self.col_data[col_header]
-        temp_col = map(float, temp_col)
+        temp_col = self._numeric(col_header)
 
         # perform normalization
-        minval   = min(temp_col)
-        maxval   = max(temp_col)
+        minval   = temp_col.min()
+        maxval   = temp_col.max()
 
-        c = self.headers.index(col_header)
-        for i,row in enumerate(self.row_data):
-            self.row_data[i][c] = (float(row[c]) - minval) / (maxval - minval)
+        self._detach_views()
+        self._columns[col_header] = (temp_col - minval) / (maxval - minval)
+        self._views = {}
 
         print("data in column '{0}' has been normalized!".format(col_header))
 
@@ -1113,14 +1295,12 @@ class time_series():
     def add_mono_time(self):
         """ Adds a monotonically increasing time column with units of decimal days """
 
-        # add an entry to every row item in row_data, then rebuild column data
+        # add a column of decimal days, then rebuild views of the data
         if "decimal_days" not in self.headers:
             self.headers.append("decimal_days")
-            
-            for i, row in enumerate(self.row_data):
-                self.row_data[i].append(self.time_dec_days[i])
 
-        self.build_col_data()
+        self._columns["decimal_days"] = self.time_dec_days
+        self._views = {}
 
         if self.subsetted:
             for subset in self.subsets:
@@ -1144,7 +1324,7 @@ class time_series():
         self.clean(col_header)
 
         # x and y data for interpolation
-        y = self.col_data[col_header]
+        y = self._numeric(col_header)
         x = self.time_seconds
 
         if not isinstance(time_obj, datetime):
@@ -1173,16 +1353,305 @@ class time_series():
         padded_name = self.disc_level * "   " + self.name
         print("{0} \t {1} \t {2} \t {3}".format(
             padded_name.ljust(28, " "),
-            str(len(self.time)).ljust(5," "),
-            self.time_dom[0],
-            self.time_dom[-1]))
+            str(self._nrows()).ljust(5," "),
+            self._time64[0].tolist(),
+            self._time64[-1].tolist()))
 
         if self.subsetted:
             for subset in self.subsets:
                 subset.interrogate()
         return
 
-            
+
+# widths of the fixed width fmt directives understood by _parse_fixed_width
+_FIXED_WIDTHS = {"%Y": 4, "%m": 2, "%d": 2, "%j": 3, "%H": 2, "%M": 2, "%S": 2}
+
+
+def _parse_times(datestamps, fmt):
+    """
+    parses an array of datestamps into a datetime64[us] array. Common fixed width
+    formats such as "%Y%j", "%Y-%m-%d %H:%M:%S" or "%Y%m%d%H%M" are sliced and
+    converted all at once, anything else falls back to datetime.strptime.
+    """
+
+    times = _parse_fixed_width(datestamps, fmt)
+    if times is not None:
+        return times
+
+    times = numpy.empty(len(datestamps), dtype = "datetime64[us]")
+    for i, datestamp in enumerate(datestamps):
+
+        # If error, give user information about the line on which the error occurs
+        try:
+            times[i] = datetime.strptime(datestamp, fmt)
+        except:
+            raise Exception("Input '{0}' in line {1} is not of format {2}".format(
+                            datestamp, i+2 , fmt))
+    return times
+
+
+def _parse_fixed_width(datestamps, fmt):
+    """
+    vectorized parser for formats made only of fixed width numeric directives
+    and literal characters. Returns None if the format or any datestamp doesn't
+    fit, so the caller can fall back to strptime.
+    """
+
+    # split the format into (start, width, directive) fields and literal characters
+    fields   = []
+    literals = []
+    width    = 0
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == "%":
+            directive = fmt[i:i + 2]
+            if directive not in _FIXED_WIDTHS:
+                return None
+            fields.append((width, _FIXED_WIDTHS[directive], directive))
+            width += _FIXED_WIDTHS[directive]
+            i += 2
+        else:
+            literals.append((width, ord(fmt[i])))
+            width += 1
+            i += 1
+
+    directives = [field[2] for field in fields]
+    if len(set(directives)) != len(directives) or ("%j" in directives and
+                                                  ("%m" in directives or "%d" in directives)):
+        return None
+
+    try:
+        stamps = numpy.asarray(datestamps)
+        if stamps.dtype.kind not in "SU" or stamps.ndim != 1:
+            return None
+        if len(stamps) == 0:
+            return numpy.array([], dtype = "datetime64[us]")
+        if numpy.any(numpy.char.str_len(stamps) != width):
+            return None
+        chars = stamps.astype("S{0}".format(width)).view("uint8").reshape(-1, width)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+    for position, char in literals:
+        if numpy.any(chars[:, position] != char):
+            return None
+
+    # integer value of every field
+    values = {}
+    for start, size, directive in fields:
+        digits = chars[:, start:start + size].astype("int64") - 48
+        if numpy.any((digits < 0) | (digits > 9)):
+            return None
+        values[directive] = digits.dot(10 ** numpy.arange(size - 1, -1, -1))
+
+    n     = len(chars)
+    one   = numpy.ones(n, dtype = "int64")
+    year  = values.get("%Y", 1900 * one)
+    month = values.get("%m", one)
+    day   = values.get("%d", one)
+    hour  = values.get("%H", 0 * one)
+    mins  = values.get("%M", 0 * one)
+    secs  = values.get("%S", 0 * one)
+
+    if (numpy.any((month < 1) | (month > 12) | (day < 1) | (hour > 23) |
+                  (mins > 59) | (secs > 59))):
+        return None
+
+    years = (year - 1970).astype("datetime64[Y]")
+    if "%j" in values:
+        doy   = values["%j"]
+        days  = years.astype("datetime64[D]") + (doy - 1).astype("timedelta64[D]")
+        valid = (doy >= 1) & (days.astype("datetime64[Y]") == years)
+    else:
+        months = years.astype("datetime64[M]") + (month - 1).astype("timedelta64[M]")
+        days   = months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+        valid  = days.astype("datetime64[M]") == months
+
+    # days past the end of the month or year are left to strptime to report
+    if not valid.all():
+        return None
+
+    seconds = (hour * 3600 + mins * 60 + secs).astype("timedelta64[s]")
+    return days.astype("datetime64[us]") + seconds
+
+
+# strftime directives understood by _time_keys, as (unit of the value, unit it counts within)
+_KEY_UNITS = {"%Y": ("Y", None),
+              "%m": ("M", "Y"),
+              "%b": ("M", "Y"),
+              "%j": ("D", "Y"),
+              "%d": ("D", "M"),
+              "%H": ("h", "D"),
+              "%M": ("m", "h"),
+              "%S": ("s", "m")}
+
+# number of bins in one cycle, for cyclical grouping
+_CYCLE_LENGTHS = {"%m": 12, "%b": 12, "%j": 365, "%d": 365, "%H": 24, "%M": 60, "%S": 60}
+
+
+def _time_keys(time64, fmt):
+    """ int64 array equal to int(dto.strftime(fmt)) for every time in a datetime64 array """
+
+    if fmt not in _KEY_UNITS:
+        raise Exception("'{0}' is an invalid unit or format!".format(fmt))
+
+    unit, within = _KEY_UNITS[fmt]
+    times = time64.astype("datetime64[{0}]".format(unit))
+
+    if within is None:
+        return times.astype("int64") + 1970
+
+    starts = times.astype("datetime64[{0}]".format(within)).astype(times.dtype)
+    keys   = (times - starts).astype("int64")
+
+    # months and days count from 1
+    if unit in ["M", "D"]:
+        keys += 1
+    return keys
+
+
+def _bin_rows(time64, fmt, overlap_width = 0, cyclical = True):
+    """
+    groups rows into bins by the value of a strftime directive, for ``group_bins``.
+    Every bin from the lowest to the highest value found gets the rows whose value is
+    within overlap_width of it. When cyclical, values at the ends of the cycle (like
+    december and january) are adjacent. Keys are computed once for every row, and the
+    rows of all the bins are found together with a single sort.
+
+    :param time64:          sorted datetime64 array of row times
+    :param fmt:             strftime directive to group by, such as "%j" or "%m"
+    :param overlap_width:   integer number of adjacent bins to include in each bin
+    :param cyclical:        set True to wrap bins around the ends of the cycle
+
+    :return bins:           list of (bin value, row of the bin's center time,
+                            sorted array of row indices) for every bin with rows
+    """
+
+    keys = _time_keys(time64, fmt)
+    if len(keys) == 0:
+        return []
+
+    ow    = int(overlap_width)
+    low   = int(keys.min())
+    high  = int(keys.max())
+    rows  = numpy.arange(len(keys))
+
+    # the day of year cycle has 366 days whenever a leap day is in the data
+    if not cyclical:
+        cylen = None
+    elif fmt == "%j" and high == 366:
+        cylen = 366
+    else:
+        cylen = _CYCLE_LENGTHS.get(fmt)
+    first = 0 if fmt in ["%H", "%M", "%S"] else 1
+
+    # every (bin, row) pair, a row belongs to bins within ow of its key
+    bins    = []
+    members = []
+    for offset in range(-ow, ow + 1):
+        candidates = [keys + offset]
+
+        # bins at the start of the cycle take rows from its end, and the reverse, but
+        # only bins on the cycle, a nonzero distance of at most ow around it away
+        if cylen:
+            for wrapped in [keys + offset - cylen, keys + offset + cylen]:
+                gap      = numpy.abs(wrapped - keys)
+                distance = numpy.minimum(gap, cylen - gap)
+                valid    = ((distance > 0) & (distance <= ow) &
+                            (wrapped >= first) & (wrapped < first + cylen))
+                candidates.append(numpy.where(valid, wrapped, high + 1))
+
+        for candidate in candidates:
+            bins.append(candidate)
+            members.append(rows)
+
+    bins    = numpy.concatenate(bins)
+    members = numpy.concatenate(members)
+
+    inside  = (bins >= low) & (bins <= high)
+    bins    = bins[inside]
+    members = members[inside]
+
+    # short cycles with wide overlaps may reach a bin both ways, keep each row once
+    order   = numpy.lexsort((members, bins))
+    bins    = bins[order]
+    members = members[order]
+    unique  = numpy.ones(len(bins), dtype = "bool")
+    unique[1:] = (bins[1:] != bins[:-1]) | (members[1:] != members[:-1])
+    bins    = bins[unique]
+    members = members[unique]
+
+    counts  = numpy.bincount(bins - low, minlength = high - low + 1)
+    ends    = numpy.cumsum(counts)
+
+    # center of each bin is the first row with exactly its value
+    values, firsts = numpy.unique(keys, return_index = True)
+    centers = dict(zip(values.tolist(), firsts.tolist()))
+
+    groups = []
+    for i in numpy.nonzero(counts)[0]:
+        index = members[ends[i] - counts[i]:ends[i]]
+        groups.append((low + i, centers.get(low + i, int(index[0])), index))
+    return groups
+
+
+def _compose_index(outer, inner):
+    """ index into a source of the rows at inner, within the rows at outer of that source """
+
+    if isinstance(outer, slice):
+        if isinstance(inner, slice):
+            return slice(outer.start + inner.start, outer.start + inner.stop)
+        return inner + outer.start
+    return outer[inner]
+
+
+def _as_column(values):
+    """
+    typed numpy array of one column. Numbers are stored as numbers, and text as
+    fixed width numpy strings, which are far smaller than lists of python strings.
+    """
+
+    try:
+        column = numpy.array(values)
+    except ValueError:
+        column = numpy.array(values, dtype = "object")
+
+    if column.ndim != 1:
+        column = numpy.empty(len(values), dtype = "object")
+        for i, value in enumerate(values):
+            column[i] = value
+    return column
+
+
+def _as_text(column):
+    """ numpy string array of a column """
+
+    if column.dtype.kind in "SU":
+        return column
+    return column.astype("S")
+
+
+def _parse_floats(column):
+    """
+    float64 array of a column, along with a boolean array marking the values
+    which could not be read as numbers at all. Those become NaN, as do values
+    that are NaN to begin with, like "nan", which are not marked invalid.
+    """
+
+    invalid = numpy.zeros(len(column), dtype = "bool")
+    try:
+        return column.astype("float64"), invalid
+    except (ValueError, TypeError):
+        out = numpy.empty(len(column), dtype = "float64")
+        for i, value in enumerate(column):
+            try:
+                out[i] = float(value)
+            except (ValueError, TypeError):
+                out[i] = numpy.nan
+                invalid[i] = True
+        return out, invalid
+
+
 # testing code
 if __name__ == "__main__":
 
@@ -1234,24 +1703,3 @@ if __name__ == "__main__":
     ts.from_csv(r"test_data\weather_csv.txt")       # reload this time_series from a CSV. note that the time
                                                     #   series must be re-subsetted as before, this information
                                                     #   was not preserved.
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-